@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark harness for initMotorIOCs.
+It builds synthetic binary distributions and a local motor-ioc-template fixture, and times IOC generation
+end to end and per stage, fully offline. Results are written as JSON so that releases can be compared.
+
+Usage: python3 benchmarkMotorIOCs.py --output results.json [--compare previous.json]
+"""
+
+# imports
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import platform as host_platform
+import contextlib
+
+import initMotorIOCs
+from initmotorioc.config import pipeline_stages
+from initmotorioc.caches import detect_bin_flat
+
+
+# Version of the benchmark result format, bumped when the layout changes
+RESULT_VERSION = 1
+
+# Default benchmark dimensions
+DEFAULT_COUNTS  = [1, 10, 100, 1000]
+DEFAULT_MODULES = [10, 100, 500]
+DEFAULT_LAYOUTS = ['flat', 'stacked']
+
+# Minimal motor-ioc-template layout, as relative path to file contents
+template_files = {
+    'startupScripts/newfocus8742.cmd'               : '#!../../bin/linux-x86_64/newfocus\n< envPaths\n< unique.cmd\n'
+                                                      'dbLoadTemplate("motor.substitutions")\niocInit()\n',
+    'startupScripts/motorsim.cmd'                   : '#!../../bin/linux-x86_64/motorSim\n< envPaths\n< unique.cmd\n'
+                                                      'dbLoadTemplate("motor.substitutions")\niocInit()\n',
+    'autosaveFiles/newfocus_auto_settings.req'      : 'file "motor_settings.req" P=$(PREFIX)\n',
+    'autosaveFiles/motorsim_auto_settings.req'      : 'file "motor_settings.req" P=$(PREFIX)\n',
+    'dependancyFiles/newfocus_motor.substitutions'  : 'file "$(MOTOR)/db/basic_asyn_motor.db"\n{\npattern\n{P, PORT}\n'
+                                                      + '{"$(PREFIX)", "$(PORT)"}\n' * 64 + '}\n',
+    'dependancyFiles/motorsim_motor.substitutions'  : 'file "$(MOTOR)/db/basic_asyn_motor.db"\n{\npattern\n{P, PORT}\n'
+                                                      + '{"$(PREFIX)", "$(PORT)"}\n' * 64 + '}\n',
+    'unique.cmd'                                    : '# Unique IOC settings\n'
+                                                      'epicsEnvSet("ENGINEER", "engineer")\n'
+                                                      'epicsEnvSet("HOSTNAME", "localhost")\n'
+                                                      'epicsEnvSet("IOCNAME", "motor")\n'
+                                                      'epicsEnvSet("IOC", "iocMotor")\n'
+                                                      'epicsEnvSet("SUPPORT_DIR", "/epics/support")\n'
+                                                      'epicsEnvSet("MC_CONNECT", "NA")\n'
+                                                      'epicsEnvSet("CT", "XF:CT")\n'
+                                                      'epicsEnvSet("MC", "MC:01")\n'
+                                                      'epicsEnvSet("PREFIX", "$(CT){MC:01}")\n'
+                                                      'epicsEnvSet("EPICS_CA_ADDR_LIST", "127.0.0.1")\n',
+    'config'                                        : 'NAME=motor\nPORT=4000\nHOST=localhost\nUSER=softioc\n',
+    'envPaths'                                      : 'epicsEnvSet("ARCH", "linux-x86_64")\nepicsEnvSet("TOP", ".")\n'
+                                                      'epicsEnvSet("SUPPORT", "$(SUPPORT_DIR)")\nepicsEnvSet("EPICS_BASE", "/epics/base")\n',
+    'docs/README.md'                                : 'Motor IOC template documentation\n',
+    'README.md'                                     : 'motor-ioc-template\n',
+    'cleanup.sh'                                    : '#!/bin/bash\nDIR="$(cd "$(dirname "$0")" && pwd)"\n'
+                                                      'rm -rf $DIR/startupScripts\nrm -rf $DIR/autosaveFiles\n'
+                                                      'rm -rf $DIR/dependancyFiles\nrm -rf $DIR/docs\nrm -f $DIR/README.md\n',
+}
+
+
+def build_template(template_dir):
+    """
+    Function that writes a local copy of the motor-ioc-template layout
+    Parameters
+    ----------
+    template_dir : str
+        directory to create the template in
+    """
+
+    for relpath, contents in template_files.items():
+        os.makedirs(os.path.dirname(os.path.join(template_dir, relpath)), exist_ok=True)
+        with open(os.path.join(template_dir, relpath), 'w') as template_fp:
+            template_fp.write(contents)
+
+
+def build_binary_tree(bin_loc, layout, num_modules):
+    """
+    Function that creates a synthetic binary distribution
+    Parameters
+    ----------
+    bin_loc : str
+        top level of the binary distribution to create
+    layout : str
+        'flat' for support modules next to base, 'stacked' for a support directory
+    num_modules : int
+        number of support modules. Every tenth module has no library directory
+    """
+
+    arch = initMotorIOCs.get_host_arch()
+    support_dir = bin_loc if layout == 'flat' else bin_loc + '/support'
+    os.makedirs(bin_loc + '/base/lib/' + arch)
+    for i in range(num_modules):
+        module_dir = support_dir + '/module{:03d}'.format(i)
+        if i % 10 == 9:
+            os.makedirs(module_dir + '/db')
+        else:
+            os.makedirs(module_dir + '/lib/' + arch)
+            open(module_dir + '/lib/' + arch + '/libmodule{:03d}.so'.format(i), 'w').close()
+    os.makedirs(support_dir + '/motor/lib/' + arch, exist_ok=True)
+    for driver in initMotorIOCs.supported_drivers:
+        bin_dir = support_dir + '/motor/modules/{}/iocs/{}IOC/bin/{}'.format(driver, driver[5:], arch)
+        os.makedirs(bin_dir)
+        executable = bin_dir + '/{}App'.format(driver[5:])
+        open(executable, 'w').close()
+        os.chmod(executable, 0o755)
+
+
+def make_entries(count, ioc_dir, bin_loc, prefix='bench'):
+    """
+    Function that creates IOC actions and configurations for a benchmark run
+    Parameters
+    ----------
+    count : int
+        number of IOCs
+    ioc_dir : str
+        output directory for the IOCs
+    bin_loc : str
+        top level of the binary distribution
+    prefix : str
+        prefix of the IOC names
+
+    Returns
+    -------
+    entries : list of (MotorIOCAction, dict of str to str)
+        IOC actions paired with their configuration
+    """
+
+    entries = []
+    for i in range(count):
+        driver = initMotorIOCs.supported_drivers[i % len(initMotorIOCs.supported_drivers)]
+        action = initMotorIOCs.MotorIOCAction(driver, '{}{:04d}'.format(prefix, i), 'XF:99ID-CT', str(10000 + i), 'NA', str(i))
+        configuration = dict(initMotorIOCs.optional_configuration_keys)
+        configuration.update({
+            'IOC_DIR'       : ioc_dir,
+            'TOP_BINARY_DIR': bin_loc,
+            'HOSTNAME'      : 'localhost',
+            'ENGINEER'      : 'benchmark',
+            'CA_ADDRESS'    : '127.0.0.255'
+        })
+        entries.append((action, configuration))
+    return entries
+
+
+def time_stages(entries, template):
+    """
+    Function that generates IOCs one at a time, timing each stage separately
+    Parameters
+    ----------
+    entries : list of (MotorIOCAction, dict of str to str)
+        IOC actions paired with their configuration
+    template : TemplateCache
+        local template fixture
+
+    Returns
+    -------
+    stage_times : dict of str to float
+        total seconds spent in each stage
+    """
+
+    stage_times = dict([(stage, 0.0) for stage in pipeline_stages])
+    for action, configuration in entries:
+        ioc_top = configuration['IOC_DIR']
+        bin_loc = configuration['TOP_BINARY_DIR']
+
+        start = time.perf_counter()
+        bin_flat = detect_bin_flat(bin_loc)
+        binary_path = action.check_setup(ioc_top, bin_loc, bin_flat)
+        stage_times['lookup'] += time.perf_counter() - start
+        if binary_path is None:
+            raise RuntimeError('no binary found for {}'.format(action.ioc_type))
+
+        start = time.perf_counter()
+        template.materialize(ioc_top + '/' + action.ioc_name)
+        stage_times['fetch'] += time.perf_counter() - start
+
+        for stage, sources, generated in initMotorIOCs.setup_stages:
+            start = time.perf_counter()
+            action.render_stage(stage, ioc_top, configuration, bin_flat, binary_path)
+            stage_times[stage] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        action.cleanup(ioc_top, template)
+        stage_times['cleanup'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        action.save_state(ioc_top, configuration, bin_flat, binary_path, template.revision)
+        stage_times['state'] += time.perf_counter() - start
+    return stage_times
+
+
+def run_scenario(work_dir, template, layout, num_modules, count, workers):
+    """
+    Function that benchmarks one combination of binary layout, support module count and IOC count
+    Parameters
+    ----------
+    work_dir : str
+        scratch directory for the scenario
+    template : TemplateCache
+        local template fixture
+    layout : str
+        'flat' or 'stacked'
+    num_modules : int
+        number of support modules
+    count : int
+        number of IOCs to generate
+    workers : int
+        worker threads used for the end to end run
+
+    Returns
+    -------
+    result : dict
+        timings for the scenario
+    """
+
+    bin_loc = os.path.join(work_dir, 'bin')
+    build_binary_tree(bin_loc, layout, num_modules)
+
+    # Cold scans of the binary distribution, done once per run
+    initMotorIOCs.reset_caches()
+    start = time.perf_counter()
+    bin_flat = initMotorIOCs.get_binary_index(bin_loc).bin_flat
+    index_scan = time.perf_counter() - start
+    start = time.perf_counter()
+    initMotorIOCs.get_support_lib_dirs(bin_loc, bin_flat, initMotorIOCs.get_host_arch())
+    support_scan = time.perf_counter() - start
+
+    # Per stage timings, generating IOCs sequentially from cold caches
+    initMotorIOCs.reset_caches()
+    ioc_dir = os.path.join(work_dir, 'staged')
+    os.makedirs(ioc_dir)
+    start = time.perf_counter()
+    stage_times = time_stages(make_entries(count, ioc_dir, bin_loc), template)
+    staged_total = time.perf_counter() - start
+
+    # End to end timing through the batch entry point, from cold caches
+    initMotorIOCs.reset_caches()
+    ioc_dir = os.path.join(work_dir, 'batch')
+    os.makedirs(ioc_dir)
+    entries = make_entries(count, ioc_dir, bin_loc)
+    start = time.perf_counter()
+    results = initMotorIOCs.run_batch(entries, workers, template)
+    batch_total = time.perf_counter() - start
+    failed = len([result for result in results if not result[1]])
+
+    return {
+        'layout'            : layout,
+        'modules'           : num_modules,
+        'iocs'              : count,
+        'workers'           : workers,
+        'failed'            : failed,
+        'index_scan_s'      : index_scan,
+        'support_scan_s'    : support_scan,
+        'sequential_s'      : staged_total,
+        'end_to_end_s'      : batch_total,
+        'end_to_end_per_ioc_s' : batch_total / count,
+        'stages'            : dict([(stage, {'total_s' : total, 'mean_s' : total / count}) for stage, total in stage_times.items()])
+    }
+
+
+def compare_results(current, previous):
+    """
+    Function that prints the change in end to end and per stage time against a previous result file
+    Parameters
+    ----------
+    current : dict
+        results of this run
+    previous : dict
+        results loaded from a previous run
+    """
+
+    old_results = dict([((result['layout'], result['modules'], result['iocs']), result) for result in previous['results']])
+    print('')
+    print('Comparison against {} ({})'.format(previous.get('initMotorIOCs_version'), previous.get('timestamp')))
+    print('{:8} {:>7} {:>6} {:>12} {:>12} {:>8}  {}'.format('layout', 'modules', 'iocs', 'previous_s', 'current_s', 'ratio', 'slowest stage change'))
+    for result in current['results']:
+        old = old_results.get((result['layout'], result['modules'], result['iocs']))
+        if old is None:
+            continue
+        ratio = result['end_to_end_s'] / max(old['end_to_end_s'], 1e-9)
+        stage_ratios = [(result['stages'][stage]['total_s'] / max(old['stages'][stage]['total_s'], 1e-9), stage)
+                        for stage in result['stages'] if stage in old['stages']]
+        worst = max(stage_ratios) if len(stage_ratios) > 0 else (1.0, '-')
+        print('{:8} {:>7} {:>6} {:>12.4f} {:>12.4f} {:>8.2f}  {} x{:.2f}'.format(result['layout'], result['modules'], result['iocs'],
+              old['end_to_end_s'], result['end_to_end_s'], ratio, worst[1], worst[0]))
+
+
+def main():
+    """ Function that parses command line arguments and runs the benchmark """
+
+    parser = argparse.ArgumentParser(description='Offline benchmark for initMotorIOCs.')
+    parser.add_argument('--counts', type=int, nargs='+', default=DEFAULT_COUNTS, help='Numbers of IOCs to generate.')
+    parser.add_argument('--modules', type=int, nargs='+', default=DEFAULT_MODULES, help='Numbers of support modules in the binary tree.')
+    parser.add_argument('--layouts', nargs='+', default=DEFAULT_LAYOUTS, choices=DEFAULT_LAYOUTS, help='Binary distribution layouts.')
+    parser.add_argument('-w', '--workers', type=int, default=initMotorIOCs.DEFAULT_WORKERS, help='Worker threads for the end to end run.')
+    parser.add_argument('-o', '--output', help='File to write the JSON results to. Printed to stdout if not given.')
+    parser.add_argument('--compare', help='Previous JSON results to compare against.')
+    parser.add_argument('--work-dir', help='Scratch directory. A temporary directory is used and removed if not given.')
+    args = parser.parse_args()
+
+    work_top = args.work_dir or tempfile.mkdtemp(prefix='initMotorIOCs-bench-')
+    os.makedirs(work_top, exist_ok=True)
+    results = []
+    try:
+        template_dir = os.path.join(work_top, 'motor-ioc-template')
+        build_template(template_dir)
+        template = initMotorIOCs.TemplateCache(template_dir=template_dir)
+        with contextlib.redirect_stdout(io.StringIO()):
+            template.prepare()
+        for layout in args.layouts:
+            for num_modules in args.modules:
+                for count in args.counts:
+                    scenario_dir = os.path.join(work_top, '{}-{}-{}'.format(layout, num_modules, count))
+                    os.makedirs(scenario_dir)
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        result = run_scenario(scenario_dir, template, layout, num_modules, count, args.workers)
+                    shutil.rmtree(scenario_dir)
+                    results.append(result)
+                    print('{:8} modules={:<4} iocs={:<5} end_to_end={:.4f}s per_ioc={:.6f}s failed={}'.format(layout, num_modules, count,
+                          result['end_to_end_s'], result['end_to_end_per_ioc_s'], result['failed']), file=sys.stderr)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_top, ignore_errors=True)
+
+    output = {
+        'version'               : RESULT_VERSION,
+        'initMotorIOCs_version' : initMotorIOCs.version,
+        'timestamp'             : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python'                : sys.version.split()[0],
+        'platform'              : host_platform.platform(),
+        'results'               : results
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as output_fp:
+            json.dump(output, output_fp, indent=4)
+    else:
+        print(json.dumps(output, indent=4))
+    if args.compare is not None:
+        with open(args.compare, 'r') as previous_fp:
+            compare_results(output, json.load(previous_fp))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
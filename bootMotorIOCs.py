@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+
+"""
+Boot orchestrator for the EPICS Motion Controller IOCs generated by initMotorIOCs.
+It reads the procServ config file of every IOC meant for this host, starts the IOCs under procServ
+in parallel, and waits for each telnet port to accept connections, reporting per IOC startup latency.
+
+It only depends on the python standard library, so it can be run from the initMotorIOCs repository,
+or copied into the IOC directories and archives it writes with --install-boot-script.
+
+Usage: python3 bootMotorIOCs.py [--ioc-dir IOC_DIR] [-j 8] [--host HOSTNAME]
+"""
+
+# imports
+import os
+import re
+import sys
+import json
+import shlex
+import time
+import socket
+import asyncio
+import argparse
+
+
+# Default number of IOCs started at the same time
+DEFAULT_LIMIT = 8
+
+# Default number of seconds an IOC may take before its telnet port accepts connections
+DEFAULT_TIMEOUT = 30.0
+
+# Seconds between two connection attempts to a starting IOC's telnet port
+PORT_POLL_INTERVAL = 0.1
+
+# Matches a KEY=VALUE line of an IOC config file
+CONFIG_VALUE = re.compile(r'^\s*(?P<key>[A-Za-z_][A-Za-z0-9_]*)\s*=\s*(?P<value>.*?)\s*$')
+
+# Host names in config files that match any host
+any_host = ['', 'localhost']
+
+# Shell command starting an IOC with the library path of its binary distribution, set by its ldpath.sh
+ldpath_command = '. ./ldpath.sh && exec ./st.cmd'
+
+
+def boot_print(text):
+    """ Function that prints a line, flushing so progress shows up in service logs """
+
+    print(text, flush=True)
+
+
+def read_config(config_path):
+    """
+    Function that reads the KEY=VALUE settings of an IOC config file
+    Parameters
+    ----------
+    config_path : str
+        path to the config file
+
+    Returns
+    -------
+    settings : dict of str to str
+        settings keyed by name, empty if the file can not be read
+    """
+
+    settings = {}
+    try:
+        with open(config_path, 'r') as config_fp:
+            for line in config_fp:
+                match = CONFIG_VALUE.match(line)
+                if match is not None and not line.lstrip().startswith('#'):
+                    settings[match.group('key')] = match.group('value')
+    except OSError:
+        pass
+    return settings
+
+
+def is_same_host(config_host, hostname):
+    """
+    Function that checks if the HOST of an IOC config file is a given host, comparing short names
+    """
+
+    if config_host.lower() in any_host:
+        return True
+    return config_host.lower().split('.')[0] == hostname.lower().split('.')[0]
+
+
+def find_iocs(ioc_top, hostname=None, names=None):
+    """
+    Function that finds the IOCs to start, from the config file of every IOC directory
+    Parameters
+    ----------
+    ioc_top : str
+        Path to the top directory containing generated IOCs
+    hostname : str
+        only IOCs whose config HOST is this host are started. If None, all IOCs are started
+    names : list of str
+        if given, only IOCs with these names are started
+
+    Returns
+    -------
+    iocs : list of dict of str to str
+        name, port, host and path of each IOC, sorted by name
+    """
+
+    iocs = []
+    with os.scandir(ioc_top) as scanner:
+        entries = sorted([entry for entry in scanner if entry.is_dir() and not entry.name.startswith('.')], key=lambda entry: entry.name)
+    for entry in entries:
+        settings = read_config(entry.path + '/config')
+        if 'PORT' not in settings or not os.path.exists(entry.path + '/st.cmd'):
+            continue
+        name = settings.get('NAME', entry.name)
+        if hostname is not None and not is_same_host(settings.get('HOST', ''), hostname):
+            continue
+        if names is not None and name not in names and entry.name not in names:
+            continue
+        iocs.append({'name' : name, 'port' : settings['PORT'], 'host' : settings.get('HOST', ''), 'path' : entry.path})
+    return iocs
+
+
+def get_procserv_command(ioc, procserv='procServ'):
+    """
+    Function that returns the command starting an IOC under procServ, which daemonizes once the IOC is started.
+    If the IOC has an ldpath.sh script, it is sourced first so the IOC binary finds its shared libraries
+    Parameters
+    ----------
+    ioc : dict of str to str
+        the IOC, as returned by find_iocs
+    procserv : str
+        procServ executable
+
+    Returns
+    -------
+    command : list of str
+        the command to run
+    """
+
+    command = [procserv, '-q', '-n', ioc['name'], '-i', '^D^C', '-c', ioc['path'], '-L', ioc['path'] + '/procServ.log', ioc['port']]
+    if os.path.exists(ioc['path'] + '/ldpath.sh'):
+        return command + ['/bin/bash', '-c', ldpath_command]
+    return command + ['./st.cmd']
+
+
+async def is_port_open(port):
+    """ Function that checks if something accepts connections on a local telnet port """
+
+    try:
+        reader, writer = await asyncio.open_connection('localhost', int(port))
+    except OSError:
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
+
+
+async def boot_ioc(ioc, limit, timeout, procserv):
+    """
+    Function that starts one IOC under procServ and waits until its telnet port accepts connections
+    Parameters
+    ----------
+    ioc : dict of str to str
+        the IOC, as returned by find_iocs
+    limit : asyncio.Semaphore
+        limits the number of IOCs starting at the same time
+    timeout : float
+        seconds after which the IOC is reported as not ready
+    procserv : str
+        procServ executable
+
+    Returns
+    -------
+    result : dict
+        IOC name, port, 'status' (started, running, failed or timeout) and 'latency' in seconds
+    """
+
+    result = {'name' : ioc['name'], 'port' : ioc['port'], 'status' : 'failed', 'latency' : None}
+    async with limit:
+        if await is_port_open(ioc['port']):
+            result['status'] = 'running'
+            return result
+        start = time.perf_counter()
+        try:
+            process = await asyncio.create_subprocess_exec(*get_procserv_command(ioc, procserv), stdin=asyncio.subprocess.DEVNULL)
+            out = await process.wait()
+        except OSError as err:
+            boot_print('ERROR - Could not start IOC {}: {}'.format(ioc['name'], err))
+            return result
+        if out != 0:
+            boot_print('ERROR - procServ exited with code {} for IOC {}'.format(out, ioc['name']))
+            return result
+        while not await is_port_open(ioc['port']):
+            if time.perf_counter() - start > timeout:
+                boot_print('ERROR - IOC {} telnet port {} not ready after {}s'.format(ioc['name'], ioc['port'], timeout))
+                result['status'] = 'timeout'
+                return result
+            await asyncio.sleep(PORT_POLL_INTERVAL)
+        result['status'] = 'started'
+        result['latency'] = round(time.perf_counter() - start, 3)
+        boot_print('Started IOC {} on port {} in {:.3f}s'.format(ioc['name'], ioc['port'], result['latency']))
+    return result
+
+
+async def boot_iocs(iocs, limit=DEFAULT_LIMIT, timeout=DEFAULT_TIMEOUT, procserv='procServ'):
+    """
+    Function that starts a list of IOCs in parallel, at most limit at a time
+    Parameters
+    ----------
+    iocs : list of dict of str to str
+        IOCs to start, as returned by find_iocs
+    limit : int
+        maximum number of IOCs starting at the same time
+    timeout : float
+        seconds after which an IOC is reported as not ready
+    procserv : str
+        procServ executable
+
+    Returns
+    -------
+    results : list of dict
+        result of each IOC, as returned by boot_ioc
+    """
+
+    semaphore = asyncio.Semaphore(max(1, limit))
+    return list(await asyncio.gather(*[boot_ioc(ioc, semaphore, timeout, procserv) for ioc in iocs]))
+
+
+def print_boot_summary(results, duration):
+    """
+    Function that prints the status and startup latency of every IOC, slowest first
+    Parameters
+    ----------
+    results : list of dict
+        results as returned by boot_iocs
+    duration : float
+        seconds taken to start all IOCs
+    """
+
+    name_width = max([len('IOC')] + [len(result['name']) for result in results])
+    boot_print('')
+    boot_print('Boot summary:')
+    boot_print('{} {} {}'.format('IOC'.ljust(name_width), 'STATUS'.ljust(8), 'LATENCY (s)'))
+    for result in sorted(results, key=lambda result: -1 if result['latency'] is None else result['latency'], reverse=True):
+        latency = '' if result['latency'] is None else '{:.3f}'.format(result['latency'])
+        boot_print('{} {} {}'.format(result['name'].ljust(name_width), result['status'].ljust(8), latency).rstrip())
+    latencies = sorted([result['latency'] for result in results if result['latency'] is not None])
+    num_failed = len([result for result in results if result['status'] in ['failed', 'timeout']])
+    boot_print('')
+    if len(latencies) > 0:
+        boot_print('Median startup latency {:.3f}s, slowest {:.3f}s.'.format(latencies[len(latencies) // 2], latencies[-1]))
+    boot_print('{} of {} IOCs up in {:.3f}s, {} failed.'.format(len(results) - num_failed, len(results), duration, num_failed))
+
+
+def main():
+    """ Function that parses command line arguments and starts the IOCs of this host """
+
+    parser = argparse.ArgumentParser(description='Start the motor IOCs generated by initMotorIOCs for this host under procServ.')
+    parser.add_argument('--ioc-dir', default=os.path.dirname(os.path.abspath(__file__)),
+                        help='Directory containing the generated IOCs. Default: the directory of this script')
+    parser.add_argument('-j', '--limit', type=int, default=DEFAULT_LIMIT,
+                        help='Number of IOCs started at the same time. Default: {}'.format(DEFAULT_LIMIT))
+    parser.add_argument('--host', default=socket.gethostname(),
+                        help='Only start IOCs whose config HOST is this host. Default: this host')
+    parser.add_argument('--all-hosts', action='store_true', help='Start every IOC, whatever its config HOST.')
+    parser.add_argument('--ioc', action='append', metavar='NAME', help='Only start this IOC. May be repeated.')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help='Seconds an IOC may take to accept telnet connections. Default: {}'.format(DEFAULT_TIMEOUT))
+    parser.add_argument('--procserv', default='procServ', help='procServ executable. Default: procServ')
+    parser.add_argument('--dry-run', action='store_true', help='Only print the procServ command of each IOC.')
+    parser.add_argument('-o', '--output', help='JSON file to which the status and latency of every IOC is written.')
+    args = parser.parse_args()
+
+    try:
+        iocs = find_iocs(os.path.abspath(args.ioc_dir), None if args.all_hosts else args.host, args.ioc)
+    except OSError as err:
+        boot_print('ERROR - Could not read IOC directory {}: {}'.format(args.ioc_dir, err))
+        return 1
+    if len(iocs) == 0:
+        boot_print('No IOCs to start for host {} in {}.'.format(args.host, args.ioc_dir))
+        return 0
+    if args.dry_run:
+        for ioc in iocs:
+            boot_print(' '.join([shlex.quote(arg) for arg in get_procserv_command(ioc, args.procserv)]))
+        return 0
+
+    boot_print('Starting {} IOCs, {} at a time.'.format(len(iocs), args.limit))
+    start = time.perf_counter()
+    results = asyncio.run(boot_iocs(iocs, args.limit, args.timeout, args.procserv))
+    duration = time.perf_counter() - start
+    print_boot_summary(results, duration)
+    if args.output is not None:
+        with open(args.output, 'w') as output_fp:
+            json.dump({'host' : args.host, 'duration' : round(duration, 3), 'iocs' : results}, output_fp, indent=4)
+    if any([result['status'] in ['failed', 'timeout'] for result in results]):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,30 +9,289 @@ Usage instructions can be found in the README.md file in this repo.
 Author: Jakub Wlodek
 """
 
-# imports
+# imports. The helpers used by every IOC live in the initmotorioc package next to this script. Modules only needed
+# by some commands (asyncio, concurrent.futures, tarfile, ctypes, socket, csv, configparser, argparse...) are imported
+# where they are used, here and in the package, so importing this module stays cheap
 import os
 import re
 import subprocess
 import datetime
+import time
+import shutil
+import threading
+import json
+import sys
 from sys import platform
 
+from initmotorioc.config import (version, KERNEL_PATH_LIMIT, supported_drivers, configuration_keys, optional_configuration_keys,
+                                 action_fields, DEFAULT_WORKERS, DEFAULT_STAGE_LIMITS, STATE_FILE, STATE_VERSION, setup_stages,
+                                 is_enabled)
+from initmotorioc.events import (EventLog, get_event_log, set_event_log, stage_event, record_exit_code, fail_event,
+                                 print_stage_summary, initIOC_print, capture_request)
+from initmotorioc.files import (DiskTree, MemoryTree, disk_tree, hash_inputs, hash_file, write_file_atomic, substitute_macros,
+                                rewrite_file)
+from initmotorioc.indexes import BinaryIndex, Inventory, DriverRegistry, get_host_arch, get_mc_number
+from initmotorioc.caches import (get_binary_index, get_inventory, get_driver_registry, get_support_lib_dirs, get_required_lib_dirs,
+                                 get_stale_binary_dirs, invalidate_binary_caches, reset_caches)
+from initmotorioc.template import TEMPLATE_URL, DEFAULT_TEMPLATE_CACHE, CLEANUP_MANIFEST, cleanup_scripts, link_modes, TemplateCache
+from initmotorioc.staging import read_state, regenerate_staged
+from initmotorioc.archives import install_boot_script, close_archives, check_archive_mode
+from initmotorioc.watch import WATCH_DEBOUNCE, DirectoryWatcher
+from initmotorioc.pipeline import execute_ioc_action, run_batch
+
+
+# Public API when used as a library
+__all__ = [
+    'MotorIOCAction',
+    'TemplateCache',
+    'BinaryIndex',
+    'DriverRegistry',
+    'Inventory',
+    'DiskTree',
+    'MemoryTree',
+    'EventLog',
+    'DirectoryWatcher',
+    'GeneratorServer',
+    'read_manifest',
+    'parse_manifest_entries',
+    'allocate_entries',
+    'validate_entries',
+    'generate_entries',
+    'execute_ioc_action',
+    'run_batch',
+    'run_batch_async',
+    'get_binary_index',
+    'get_driver_registry',
+    'get_inventory',
+    'watch_iocs',
+    'invalidate_binary_caches',
+    'reset_caches',
+    'set_event_log',
+    'request_server',
+    'batch_init',
+    'guided_init',
+    'main',
+    'supported_drivers',
+    'configuration_keys',
+    'optional_configuration_keys'
+]
 
-# version number
-version = "v0.0.1"
 
+def __getattr__(name):
+    """ Function that imports the asyncio pipeline on first use, so importing this module stays cheap """
 
-# Bash shebang length limit is 127 characters, so we need to make sure we account for that
-KERNEL_PATH_LIMIT = 127
+    if name == 'run_batch_async':
+        from initmotorioc.pipeline_async import run_batch_async
+
+        return run_batch_async
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+
+
+# Rewrite rule keys: matches the key of an epicsEnvSet line, ex. epicsEnvSet("PREFIX", "...")
+EPICS_ENV_SET_KEY = re.compile(r'^\s*epicsEnvSet\(\s*"(?P<key>[^"]+)"')
+
+# Rewrite rule keys: matches the key of a KEY=VALUE line, as used in the procServ config file
+CONFIG_KEY = re.compile(r'^\s*(?P<key>[A-Za-z_][A-Za-z0-9_]*)\s*=')
+
+
+# Manifest keys that set extra macros for dependency files, ex. macro.AXIS1
+MACRO_KEY_PREFIX = 'macro.'
+
+
+# Requests accepted by the generator server started with --serve
+server_commands = ['ping', 'generate', 'inventory', 'drivers', 'invalidate', 'shutdown']
+
+
+# Telnet port and MC number values that ask for the next free one, and where allocation starts
+AUTO_VALUES = ['', 'auto']
+auto_fields = ['ioc_port', 'ioc_num']
+FIRST_TELNET_PORT = 4000
+FIRST_MC_NUMBER = 1
+
+
+class GeneratorServer:
+
+
+    def __init__(self, socket_path, template, workers=DEFAULT_WORKERS, index_file=None, overrides=None, stage_limits=None):
+        """
+        Constructor for the GeneratorServer class
+        Parameters
+        ----------
+        socket_path : str
+            path of the Unix socket on which requests are accepted
+        template : TemplateCache
+            local template cache shared by all requests
+        workers : int
+            maximum number of IOCs of a request generated at the same time
+        index_file : str
+            optional file in which the binary index is saved between runs
+        overrides : dict of str to str
+            configuration values applied to every requested IOC
+        stage_limits : dict of str to int
+            if given, IOCs are generated with the asyncio pipeline using these per stage concurrency limits
+        """
+
+        self.socket_path    = socket_path
+        self.template       = template
+        self.workers        = workers
+        self.index_file     = index_file
+        self.overrides      = overrides or {}
+        self.stage_limits   = stage_limits
+        self.server         = None
+        self.stopping       = False
+        self.lock           = threading.Lock()
+
+
+    def handle_request(self, request):
+        """
+        Function that runs a single request, capturing its log lines and stage events
+        Parameters
+        ----------
+        request : dict
+            decoded request, with a 'command' from server_commands and its arguments
+
+        Returns
+        -------
+        response : dict
+            'ok', the command's results, 'log', 'events' and 'duration_s'
+        """
+
+        start = time.perf_counter()
+        with capture_request() as capture:
+            try:
+                command = request.get('command') if isinstance(request, dict) else None
+                if command not in server_commands:
+                    initIOC_print('ERROR - Unknown command {}, expected one of {}.'.format(command, ', '.join(server_commands)))
+                    response = {'ok' : False}
+                elif command == 'ping':
+                    response = {'ok' : True, 'version' : version}
+                else:
+                    # Requests are run one at a time, so free ports and MC numbers are never allocated twice
+                    with self.lock:
+                        response = getattr(self, 'run_' + command)(request)
+            except Exception as err:
+                initIOC_print('ERROR - Request failed: {}'.format(err))
+                response = {'ok' : False}
+        response['log'] = capture['log']
+        response['events'] = capture['events']
+        response['duration_s'] = round(time.perf_counter() - start, 6)
+        return response
+
+
+    def run_generate(self, request):
+        """
+        Function that generates the IOCs of a request, holding a 'configuration' mapping and an 'iocs' list as in a YAML manifest
+        """
+
+        entries = parse_manifest_entries(request.get('configuration') or {}, request.get('iocs') or [])
+        for action, configuration in entries:
+            configuration.update(self.overrides)
+        # Only binary indexes whose distribution changed are rebuilt, everything else stays warm
+        for bin_loc in get_stale_binary_dirs():
+            initIOC_print('Binary distribution {} changed, rebuilding its index.'.format(bin_loc))
+            invalidate_binary_caches(bin_loc)
+        results = generate_entries(entries, self.workers, self.template, self.index_file, self.stage_limits,
+                                   request.get('validate_only', False), request.get('skip_invalid', False))
+        if results is None:
+            return {'ok' : False, 'results' : []}
+        return {'ok' : all([result[1] for result in results]),
+                'results' : [{'ioc' : action.ioc_name, 'ok' : success, 'message' : message,
+                              'ioc_port' : action.ioc_port, 'ioc_num' : action.ioc_num} for action, success, message in results]}
+
+
+    def run_inventory(self, request):
+        """ Function that returns the existing IOCs in the request's IOC_DIR """
+
+        return {'ok' : True, 'iocs' : get_inventory(request['IOC_DIR']).records()}
+
+
+    def run_drivers(self, request):
+        """ Function that returns the supported drivers and their files, for the request's optional TOP_BINARY_DIR """
+
+        registry = get_driver_registry(self.template, request.get('TOP_BINARY_DIR'))
+        if registry is None:
+            return {'ok' : False}
+        return {'ok' : True, 'drivers' : registry.drivers}
+
+
+    def run_invalidate(self, request):
+        """ Function that drops all cached indexes, inventories and registries, and checks the template again """
+
+        reset_caches()
+        self.template.reset()
+        return {'ok' : self.template.prepare() == 0}
+
+
+    def run_shutdown(self, request):
+        """ Function that stops the server once the current request has been answered """
+
+        self.stopping = True
+        return {'ok' : True}
+
+
+    def serve(self):
+        """
+        Function that accepts JSON lines requests on the Unix socket until a shutdown request.
+        Each connection may send several requests, and gets one JSON line response per request.
+        Returns
+        -------
+        int
+            0 if success, -1 if error
+        """
+
+        import socketserver
+
+        if os.path.exists(self.socket_path):
+            try:
+                request_server(self.socket_path, {'command' : 'ping'}, timeout=1)
+                initIOC_print('ERROR - A generator server is already listening on {}.'.format(self.socket_path))
+                return -1
+            except OSError:
+                os.remove(self.socket_path)
+        generator = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+
+            def handle(self):
+                for line in self.rfile:
+                    if line.strip() == b'':
+                        continue
+                    try:
+                        request = json.loads(line)
+                    except ValueError as err:
+                        request = {'command' : None}
+                        initIOC_print('ERROR - Invalid request: {}'.format(err))
+                    response = generator.handle_request(request)
+                    self.wfile.write(json.dumps(response, default=str).encode() + b'\n')
+                    self.wfile.flush()
+                    if generator.stopping:
+                        generator.server.shutdown()
+                        return
+
+        class Server(socketserver.ThreadingUnixStreamServer):
+
+            daemon_threads = True
+
+        if self.template.prepare() != 0:
+            return -1
+        self.server = Server(self.socket_path, RequestHandler)
+        initIOC_print('Serving IOC generation requests on {}'.format(self.socket_path))
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        initIOC_print('Generator server on {} stopped.'.format(self.socket_path))
+        return 0
 
-supported_drivers = [
-    'motorNewFocus',
-    'motorMotorSim'
-]
 
 class MotorIOCAction:
 
 
-    def __init__(self, ioc_type, ioc_name, ioc_prefix, ioc_port, connection, ioc_num):
+    def __init__(self, ioc_type, ioc_name, ioc_prefix, ioc_port, connection, ioc_num, macros=None):
         """
         Constructor for the MotorIOCAction class
         Parameters
@@ -49,6 +308,8 @@ class MotorIOCAction:
             Value used to connect to the device ex. IP, serial num. etc.
         ioc_num : int
             Counter that keeps track of which IOC it is
+        macros : dict of str to str
+            extra macros substituted in dependency files, ex. per axis values
         """
 
         self.ioc_type   = ioc_type
@@ -57,7 +318,9 @@ class MotorIOCAction:
         self.ioc_port   = ioc_port
         self.connection = connection
         self.ioc_num    = ioc_num
-
+        self.macros     = dict(macros or {})
+        self.tree       = disk_tree
+        self.registry   = None
 
 
     def convert_st_cmd(self, ioc_top, bin_loc, bin_flat, binary_path):
@@ -66,71 +329,186 @@ class MotorIOCAction:
         initIOC_print("IOC template cloned, converting st.cmd")
         ioc_path = ioc_top +"/" + self.ioc_name
 
-        startup_path = ioc_path+"/startupScripts"
-        startup_type = self.ioc_type[5:].lower()
-
-        for file in os.listdir(ioc_path +"/startupScripts"):
-            if startup_type in file.lower():
-                startup_path = startup_path + "/" + file
-                break
-        
+        startup_path = ioc_path + "/" + self.get_artifacts(ioc_path)['startup_script']
         exe_written = False
-        example_st = open(startup_path, "r+")
+        with self.tree.open_read(startup_path) as example_st:
+            lines = example_st.readlines()
 
+        st_name = "st.cmd"
         if platform =='win32':
-            st_exe = open(ioc_path+'/st.cmd', 'w+')
-            st_exe.write(binary_path+' st_base.cmd\n')
-            st_exe.close()
-            st = open(ioc_path+"/st_base.cmd", "w+")
+            self.tree.write(ioc_path + '/st.cmd', binary_path + ' st_base.cmd\n')
+            st_name = "st_base.cmd"
             exe_written = True
 
         elif len(binary_path) > KERNEL_PATH_LIMIT:     # The path length limit for shebangs (#!/) on linux is usually kernel based and set to 127
             initIOC_print('WARNING - Path to executable exceeds legal bash limit, generating st.cmd and st_base.cmd')
-            st_exe = open(ioc_path + '/st.cmd', 'w+')
-            st_exe.write(binary_path + ' st_base.cmd\n')
-            st = open(ioc_path+"/st_base.cmd", "w+")
-            st_exe.close()
+            self.tree.write(ioc_path + '/st.cmd', binary_path + ' st_base.cmd\n')
+            st_name = "st_base.cmd"
             exe_written = True
-        else:
-            st = open(ioc_path+"/st.cmd", "w+")
 
-        line = example_st.readline()
-        while line:
+        st = []
+        for line in lines:
             if "#!" in line:
                 if not exe_written:
-                    st.write("#!" + binary_path + "\n")
+                    st.append("#!" + binary_path + "\n")
             elif "envPaths" in line:
-                st.write("< envPaths\n")
+                st.append("< envPaths\n")
             else:
-                st.write(line)
-            line = example_st.readline()
-
-        example_st.close()
-        st.close()
+                st.append(line)
+        self.tree.write(ioc_path + "/" + st_name, "".join(st))
 
 
-    def convert_as_and_dep(self, ioc_top, bin_loc, bin_flat):
+    def convert_as_and_dep(self, ioc_top, bin_loc, bin_flat, hostname=None):
         """ Function repsonsible for setting up autosave and dependency files """
 
         ioc_path = ioc_top +"/" + self.ioc_name
-        autosave_path = ioc_path + "/autosaveFiles"
-        autosave_type = self.ioc_type[5:].lower()
-        if os.path.exists(autosave_path + "/" + autosave_type + "_auto_settings.req"):
+        artifacts = self.get_artifacts(ioc_path)
+        if artifacts['autosave'] is not None and self.tree.exists(ioc_path + "/" + artifacts['autosave']):
             initIOC_print("Generating auto_settings.req file for IOC {}.".format(self.ioc_name))
-            os.rename(autosave_path + "/" + autosave_type + "_auto_settings.req", ioc_path + "/auto_settings.req")
+            self.tree.rename(ioc_path + "/" + artifacts['autosave'], ioc_path + "/auto_settings.req")
         else:
             initIOC_print("Could not find supported auto_settings.req file for IOC {}.".format(self.ioc_name))
 
-        if os.path.exists(ioc_path + "/dependancyFiles"):
-            for file in os.listdir(ioc_path + "/dependancyFiles"):
-                if file.lower().startswith(autosave_type):
-                    initIOC_print('Copying dependency file {} for {}'.format(file, self.ioc_type))
-                    # Copy all required dependency files
-                    os.rename(ioc_path + "/dependancyFiles/" + file, ioc_path + "/" + file.split('_', 1)[-1])
-                    self.fix_macros(ioc_path + '/' + file.split('_', 1)[-1])
+        for dependency in artifacts['dependencies']:
+            file = dependency.split('/')[-1]
+            if self.tree.exists(ioc_path + "/" + dependency):
+                initIOC_print('Copying dependency file {} for {}'.format(file, self.ioc_type))
+                # Copy all required dependency files
+                self.tree.rename(ioc_path + "/" + dependency, ioc_path + "/" + file.split('_', 1)[-1])
+                self.fix_macros(ioc_path + '/' + file.split('_', 1)[-1], hostname)
+
+
+    def get_generated_files(self, ioc_path):
+        """
+        Function that returns the files each setup stage writes into the IOC directory, including the
+        dependency files of the driver, which the autosave stage renames out of dependancyFiles
+        Parameters
+        ----------
+        ioc_path : str
+            path to the IOC directory
+
+        Returns
+        -------
+        generated_files : dict of str to list of str
+            paths relative to the IOC directory, keyed by setup stage
+        """
+
+        generated_files = dict([(stage, list(generated)) for stage, sources, generated in setup_stages])
+        try:
+            dependencies = self.get_artifacts(ioc_path)['dependencies']
+        except OSError:
+            # Without a driver registry, the template directories may already have been cleaned up
+            dependencies = []
+        for dependency in dependencies:
+            generated_files['autosave'].append(dependency.split('/')[-1].split('_', 1)[-1])
+        return generated_files
+
+
+    def get_artifacts(self, ioc_path):
+        """
+        Function that returns the template files of the IOC driver, from the driver registry if one is attached,
+        otherwise by scanning the template directories copied into the IOC
+        Parameters
+        ----------
+        ioc_path : str
+            path to the IOC directory
+
+        Returns
+        -------
+        dict
+            driver files as returned by DriverRegistry.get
+        """
+
+        if self.registry is not None and self.registry.get(self.ioc_type) is not None:
+            return self.registry.get(self.ioc_type)
+
+        driver_type = self.ioc_type[5:].lower()
+        artifacts = {'startup_script' : 'startupScripts', 'autosave' : None, 'dependencies' : [], 'macros' : [], 'binary' : None}
+        for file in self.tree.listdir(ioc_path + "/startupScripts"):
+            if driver_type in file.lower():
+                artifacts['startup_script'] = 'startupScripts/' + file
+                break
+        if self.tree.exists(ioc_path + "/autosaveFiles/" + driver_type + "_auto_settings.req"):
+            artifacts['autosave'] = "autosaveFiles/" + driver_type + "_auto_settings.req"
+        if self.tree.exists(ioc_path + "/dependancyFiles"):
+            artifacts['dependencies'] = ["dependancyFiles/" + file for file in self.tree.listdir(ioc_path + "/dependancyFiles")
+                                         if file.lower().startswith(driver_type)]
+        return artifacts
+
+
+    def check_setup(self, ioc_top, bin_loc, bin_flat, minimal_ldpath=False):
+        """
+        Function that checks if the IOC can be set up, before the template is cloned
+        Parameters
+        ----------
+        ioc_top : str
+            Path to the top directory to contain generated IOCs
+        bin_loc : str
+            path to top level of binary distribution
+        bin_flat : bool
+            flag for deciding if binaries are flat or stacked
+        minimal_ldpath : bool
+            if True, check that every shared library needed by the IOC binary is available
+        Returns
+        -------
+        binary_path : str
+            path to the IOC executable, or None if the IOC can't be set up
+        """
+
+        initIOC_print("-------------------------------------------")
+        initIOC_print("Setup process for IOC " + self.ioc_name)
+        initIOC_print("-------------------------------------------")
+        with stage_event(self.ioc_name, 'lookup'):
+            # Checks to see if we should even try to clone + setup
+            if self.tree.exists(ioc_top + '/' + self.ioc_name):
+                initIOC_print('ERROR - IOC with name {} already exists in {}.'.format(self.ioc_name, ioc_top))
+                fail_event('IOC already exists')
+                return None
+            binary_path =  self.getIOCBin(bin_loc, bin_flat) 
+            if binary_path is None:
+                initIOC_print('ERROR - Could not identify a compiled IOC binary for {}, skipping'.format(self.ioc_type))
+                initIOC_print('Make sure that the binary exists and is compiled in the expected location.')
+                fail_event('No IOC binary found')
+                return None
+            if minimal_ldpath and self.find_required_lib_dirs(bin_loc, bin_flat) is None:
+                fail_event('Missing shared libraries')
+                return None
+            return binary_path
+
+
+    def fetch_template(self, ioc_top, template=None):
+        """
+        Function that creates the IOC directory from the template
+        Parameters
+        ----------
+        ioc_top : str
+            Path to the top directory to contain generated IOCs
+        template : TemplateCache
+            local template cache to copy the IOC from. If None, the template is cloned from github
+        Returns
+        -------
+        int
+            0 if success, -1 if error
+        """
+
+        with stage_event(self.ioc_name, 'fetch'):
+            if template is not None:
+                # Copy the template from the local cache
+                template.materialize(ioc_top + "/" + self.ioc_name, self.tree)
+                out = 0
+            else:
+                # Clone the template
+                command = ["git", "clone", "--quiet", TEMPLATE_URL, ioc_top + "/" + self.ioc_name]
+                out = subprocess.call(command)
+                record_exit_code(command, out)
+            if out != 0:
+                initIOC_print("Error failed to clone IOC template for ioc {}".format(self.ioc_name))
+                fail_event('Failed to clone IOC template')
+                return -1
+            return 0
 
 
-    def process(self, ioc_top, bin_loc, bin_flat):
+    def process(self, ioc_top, bin_loc, bin_flat, template=None, minimal_ldpath=False):
         """
         Function that clones ioc-template, and pulls correct st.cmd from startupScripts folder
         The binary for the IOC is also identified and inserted into st.cmd
@@ -142,36 +520,212 @@ class MotorIOCAction:
             path to top level of binary distribution
         bin_flat : bool
             flag for deciding if binaries are flat or stacked
+        template : TemplateCache
+            local template cache to copy the IOC from. If None, the template is cloned from github
+        minimal_ldpath : bool
+            if True, check that every shared library needed by the IOC binary is available before setup
         Returns
         -------
         int
             0 if success, -1 if error
         """
 
-        initIOC_print("-------------------------------------------")
-        initIOC_print("Setup process for IOC " + self.ioc_name)
-        initIOC_print("-------------------------------------------")
-        # Checks to see if we should even try to clone + setup
-        if os.path.exists(ioc_top + '/' + self.ioc_name):
-            initIOC_print('ERROR - IOC with name {} already exists in {}.'.format(self.ioc_name, ioc_top))
-            return -1
-        binary_path =  self.getIOCBin(bin_loc, bin_flat) 
+        binary_path = self.check_setup(ioc_top, bin_loc, bin_flat, minimal_ldpath)
         if binary_path is None:
-            initIOC_print('ERROR - Could not identify a compiled IOC binary for {}, skipping'.format(self.ioc_type))
-            initIOC_print('Make sure that the binary exists and is compiled in the expected location.')
             return -1
-        # Clone the template
-        out = subprocess.call(["git", "clone", "--quiet", "https://github.com/epicsNSLS2-deploy/motor-ioc-template", ioc_top + "/" + self.ioc_name])
-        if out != 0:
-            initIOC_print("Error failed to clone IOC template for ioc {}".format(self.ioc_name))
+        if self.fetch_template(ioc_top, template) != 0:
             return -1
-        else:
-            # Convert all of the required files
+        # Convert all of the required files
+        with stage_event(self.ioc_name, 'st_cmd'):
             self.convert_st_cmd(ioc_top, bin_loc, bin_flat, binary_path)
+        with stage_event(self.ioc_name, 'autosave'):
             self.convert_as_and_dep(ioc_top, bin_loc, bin_flat)
+        return 0
+
+
+    def render_stage(self, stage, ioc_top, configuration, bin_flat, binary_path):
+        """
+        Function that runs a single setup stage, rendering its generated files from the template files in the IOC directory
+        Parameters
+        ----------
+        stage : str
+            name of the stage, one of setup_stages
+        ioc_top : str
+            Path to the top directory to contain generated IOCs
+        configuration : dict of str to str
+            configuration settings of the IOC
+        bin_flat : bool
+            flag for deciding if binaries are flat or stacked
+        binary_path : str
+            path to the IOC executable
+        """
+
+        bin_loc = configuration["TOP_BINARY_DIR"]
+        with stage_event(self.ioc_name, stage):
+            if stage == 'st_cmd':
+                self.convert_st_cmd(ioc_top, bin_loc, bin_flat, binary_path)
+            elif stage == 'autosave':
+                self.convert_as_and_dep(ioc_top, bin_loc, bin_flat, configuration["HOSTNAME"])
+            elif stage == 'unique':
+                self.update_unique(ioc_top, bin_loc, bin_flat, self.ioc_prefix, configuration["ENGINEER"],
+                                   configuration["HOSTNAME"], configuration["CA_ADDRESS"])
+            elif stage == 'config':
+                self.update_config(ioc_top, configuration["HOSTNAME"])
+            elif stage == 'env_paths':
+                self.fix_env_paths(ioc_top, bin_flat)
+            elif stage == 'path_scripts':
+                minimal_ldpath = is_enabled(configuration.get("MINIMAL_LDPATH", optional_configuration_keys["MINIMAL_LDPATH"]))
+                self.create_path_scripts(bin_loc, bin_flat, ioc_top, minimal_ldpath)
+
+
+    def get_stage_inputs(self, configuration, bin_flat, binary_path, revision):
+        """
+        Function that collects everything each setup stage's generated files depend on
+        Parameters
+        ----------
+        configuration : dict of str to str
+            configuration settings of the IOC
+        bin_flat : bool
+            flag for deciding if binaries are flat or stacked
+        binary_path : str
+            path to the IOC executable
+        revision : str
+            commit hash or fingerprint of the IOC template
+
+        Returns
+        -------
+        inputs : dict of str to dict
+            inputs of each stage, keyed by stage name
+        """
+
+        bin_loc = configuration["TOP_BINARY_DIR"]
+        minimal_ldpath = is_enabled(configuration.get("MINIMAL_LDPATH", optional_configuration_keys["MINIMAL_LDPATH"]))
+        lib_dirs = None
+        if minimal_ldpath and platform != "win32":
+            lib_dirs = get_required_lib_dirs(binary_path, get_support_lib_dirs(bin_loc, bin_flat, get_host_arch()))[0]
+        if lib_dirs is None:
+            lib_dirs = get_support_lib_dirs(bin_loc, bin_flat, get_host_arch())
+        return {
+            'st_cmd'        : [revision, platform, self.ioc_type, binary_path],
+            'autosave'      : [revision, self.ioc_type, self.get_macros(configuration["HOSTNAME"])],
+            'unique'        : [revision, bin_loc, bin_flat, self.ioc_type, self.ioc_name, self.ioc_prefix, self.connection,
+                               self.ioc_num, configuration["ENGINEER"], configuration["HOSTNAME"], configuration["CA_ADDRESS"]],
+            'config'        : [revision, self.ioc_name, self.ioc_port, configuration["HOSTNAME"]],
+            'env_paths'     : [revision, platform, bin_flat],
+            'path_scripts'  : [platform, lib_dirs]
+        }
+
+
+    def save_state(self, ioc_top, configuration, bin_flat, binary_path, revision):
+        """
+        Function that records the inputs an IOC was generated from, and hashes of its generated files, in its state file
+        Parameters
+        ----------
+        ioc_top : str
+            Path to the top directory to contain generated IOCs
+        configuration : dict of str to str
+            configuration settings of the IOC
+        bin_flat : bool
+            flag for deciding if binaries are flat or stacked
+        binary_path : str
+            path to the IOC executable
+        revision : str
+            commit hash or fingerprint of the IOC template
+        """
+
+        ioc_path = ioc_top + '/' + self.ioc_name
+        with stage_event(self.ioc_name, 'state'):
+            inputs = self.get_stage_inputs(configuration, bin_flat, binary_path, revision)
+            outputs = {}
+            for stage, generated in self.get_generated_files(ioc_path).items():
+                for file in generated:
+                    if os.path.exists(ioc_path + '/' + file):
+                        outputs[file] = hash_file(ioc_path + '/' + file)
+            state = {
+                'version'       : STATE_VERSION,
+                'action'        : dict([(field, getattr(self, field)) for field in action_fields] + [('macros', self.macros)]),
+                'configuration' : configuration,
+                'bin_flat'      : bin_flat,
+                'stages'        : dict([(stage, hash_inputs(stage_inputs)) for stage, stage_inputs in inputs.items()]),
+                'outputs'       : outputs
+            }
+            write_file_atomic(ioc_path + '/' + STATE_FILE, json.dumps(state, indent=4, sort_keys=True) + '\n')
+
+
+    def regenerate(self, ioc_top, configuration, bin_flat, template):
+        """
+        Function that updates an existing IOC in place, re-rendering only generated files whose inputs changed.
+        Files that are not generated, and generated files whose inputs are unchanged, are left untouched.
+        Parameters
+        ----------
+        ioc_top : str
+            Path to the top directory containing generated IOCs
+        configuration : dict of str to str
+            configuration settings of the IOC
+        bin_flat : bool
+            flag for deciding if binaries are flat or stacked
+        template : TemplateCache
+            local template cache the IOC is rendered from
+        Returns
+        -------
+        int
+            0 if success, -1 if error
+        """
+
+        ioc_path = ioc_top + '/' + self.ioc_name
+        state = read_state(ioc_path)
+        if state is None:
+            initIOC_print('ERROR - IOC {} has no usable state file, it must be regenerated from scratch.'.format(self.ioc_name))
+            return -1
+        binary_path = self.getIOCBin(configuration["TOP_BINARY_DIR"], bin_flat)
+        if binary_path is None:
+            initIOC_print('ERROR - Could not identify a compiled IOC binary for {}, skipping'.format(self.ioc_type))
+            return -1
+        if template.prepare() != 0:
+            return -1
 
+        inputs = self.get_stage_inputs(configuration, bin_flat, binary_path, template.revision)
+        stale = [stage for stage, sources, generated in setup_stages if state['stages'].get(stage) != hash_inputs(inputs[stage])]
+        if len(stale) == 0:
+            initIOC_print('IOC {} is up to date.'.format(self.ioc_name))
             return 0
+        initIOC_print('Updating {} for IOC {}'.format(', '.join(stale), self.ioc_name))
+
+        # Bring back the template files the stale stages are rendered from
+        added = []
+        generated_files = self.get_generated_files(ioc_path)
+        for stage, sources, generated in setup_stages:
+            if stage not in stale:
+                continue
+            for file in generated_files[stage]:
+                if os.path.exists(ioc_path + '/' + file):
+                    if file in state['outputs'] and hash_file(ioc_path + '/' + file) != state['outputs'][file]:
+                        initIOC_print('WARNING - Overwriting local modifications to {} in IOC {}'.format(file, self.ioc_name))
+                    if file not in sources:
+                        os.remove(ioc_path + '/' + file)
+            for source in sources:
+                source_path = os.path.join(template.snapshot, source)
+                if os.path.isdir(source_path):
+                    if not os.path.exists(ioc_path + '/' + source):
+                        shutil.copytree(source_path, ioc_path + '/' + source)
+                        added.append(ioc_path + '/' + source)
+                elif os.path.exists(source_path):
+                    # Never write through a file that may be linked to the template snapshot
+                    if os.path.exists(ioc_path + '/' + source):
+                        os.remove(ioc_path + '/' + source)
+                    shutil.copy2(source_path, ioc_path + '/' + source)
 
+        try:
+            for stage in stale:
+                self.render_stage(stage, ioc_top, configuration, bin_flat, binary_path)
+        finally:
+            for path in added:
+                shutil.rmtree(path, ignore_errors=True)
+        # Only a re-rendered st.cmd is a new file, an unchanged one may be hard linked to the published IOC
+        if 'st_cmd' in stale and os.path.exists(ioc_path + '/st.cmd'):
+            os.chmod(ioc_path + '/st.cmd', 0o755)
+        self.save_state(ioc_top, configuration, bin_flat, binary_path, template.revision)
+        return 0
 
 
     def update_unique(self, ioc_top, bin_loc, bin_flat, prefix, engineer, hostname, ca_ip):
@@ -195,48 +749,27 @@ class MotorIOCAction:
             Channel Access IP address
         """
 
-        if os.path.exists(ioc_top + "/" + self.ioc_name +"/unique.cmd"):
+        unique_path = ioc_top + "/" + self.ioc_name +"/unique.cmd"
+        if self.tree.exists(unique_path):
             initIOC_print("Updating unique file based on configuration.")
-            unique_path = ioc_top + "/" + self.ioc_name +"/unique.cmd"
-            unique_old_path = ioc_top +"/" + self.ioc_name +"/unique_OLD.cmd"
-            os.rename(unique_path, unique_old_path)
-
-            uq_old = open(unique_old_path, "r")
-            uq = open(unique_path, "w")
-            line = uq_old.readline()
-            while line:
-                if not line.startswith('#'):
-                    if "SUPPORT_DIR" in line:
-                        if bin_flat:
-                            uq.write('epicsEnvSet("SUPPORT_DIR", "{}")\n'.format(bin_loc))
-                        else:
-                            uq.write('epicsEnvSet("SUPPORT_DIR", "{}")\n'.format(bin_loc + "/support"))
-                    elif "ENGINEER" in line:
-                        uq.write('epicsEnvSet("ENGINEER", "{}")\n'.format(engineer))
-                    elif "CAM-CONNECT" in line:
-                        uq.write('epicsEnvSet("MC_CONNECT", "{}")\n'.format(self.connection))
-                    elif "HOSTNAME" in line:
-                        uq.write('epicsEnvSet("HOSTNAME", "{}")\n'.format(hostname))
-                    elif '("MC"' in line:
-                        uq.write('epicsEnvSet("MC", "MC:{}")\n'.format(self.ioc_num))
-                    elif '("CT"' in line:
-                        uq.write('epicsEnvSet("CT", "{}")\n'.format(prefix))
-                    elif "PREFIX" in line and "MC_PREFIX" not in line:
-                        uq.write('epicsEnvSet("PREFIX", "{}")\n'.format(prefix + "{{{}}}".format(self.ioc_type[5:] +"IOC:MC{}".format(self.ioc_num))))
-                    elif "IOCNAME" in line:
-                        uq.write('epicsEnvSet("IOCNAME", "{}")\n'.format(self.ioc_name))
-                    elif "EPICS_CA_ADDR_LIST" in line:
-                        uq.write('epicsEnvSet("EPICS_CA_ADDR_LIST", "{}")\n'.format(ca_ip))
-                    elif "IOC" in line and "IOCNAME" not in line:
-                        uq.write('epicsEnvSet("IOC", "{}")\n'.format("ioc"+self.ioc_type))
-                    else:
-                        uq.write(line)
-                else:
-                    uq.write(line)
-                line = uq_old.readline()
-
-            uq_old.close()
-            uq.close()
+            if bin_flat:
+                support_dir = bin_loc
+            else:
+                support_dir = bin_loc + "/support"
+            rules = {
+                'SUPPORT_DIR'           : 'epicsEnvSet("SUPPORT_DIR", "{}")'.format(support_dir),
+                'ENGINEER'              : 'epicsEnvSet("ENGINEER", "{}")'.format(engineer),
+                'CAM-CONNECT'           : 'epicsEnvSet("MC_CONNECT", "{}")'.format(self.connection),
+                'MC_CONNECT'            : 'epicsEnvSet("MC_CONNECT", "{}")'.format(self.connection),
+                'HOSTNAME'              : 'epicsEnvSet("HOSTNAME", "{}")'.format(hostname),
+                'MC'                    : 'epicsEnvSet("MC", "MC:{}")'.format(get_mc_number(self.ioc_num)),
+                'CT'                    : 'epicsEnvSet("CT", "{}")'.format(prefix),
+                'PREFIX'                : 'epicsEnvSet("PREFIX", "{}")'.format(prefix + "{{{}}}".format(self.ioc_type[5:] +"IOC:MC{}".format(get_mc_number(self.ioc_num)))),
+                'IOCNAME'               : 'epicsEnvSet("IOCNAME", "{}")'.format(self.ioc_name),
+                'EPICS_CA_ADDR_LIST'    : 'epicsEnvSet("EPICS_CA_ADDR_LIST", "{}")'.format(ca_ip),
+                'IOC'                   : 'epicsEnvSet("IOC", "{}")'.format("ioc"+self.ioc_type),
+            }
+            rewrite_file(unique_path, EPICS_ENV_SET_KEY, rules, self.tree)
         else:
             initIOC_print("No unique file found, proceeding to next step.")
 
@@ -253,25 +786,14 @@ class MotorIOCAction:
         """
 
         conf_path = ioc_top + "/" + self.ioc_name + "/config"
-        if os.path.exists(conf_path):
+        if self.tree.exists(conf_path):
             initIOC_print("Updating config file for procServer connection.")
-            conf_old_path = ioc_top + "/" + self.ioc_name + "/config_OLD"
-            os.rename(conf_path, conf_old_path)
-            cn_old = open(conf_old_path, "r")
-            cn = open(conf_path, "w")
-            line = cn_old.readline()
-            while line:
-                if "NAME" in line:
-                    cn.write("NAME={}\n".format(self.ioc_name))
-                elif "PORT" in line:
-                    cn.write("PORT={}\n".format(self.ioc_port))
-                elif "HOST" in line:
-                    cn.write("HOST={}\n".format(hostname))
-                else:
-                    cn.write(line)
-                line = cn_old.readline()
-            cn_old.close()
-            cn.close()
+            rules = {
+                'NAME' : "NAME={}".format(self.ioc_name),
+                'PORT' : "PORT={}".format(self.ioc_port),
+                'HOST' : "HOST={}".format(hostname),
+            }
+            rewrite_file(conf_path, CONFIG_KEY, rules, self.tree)
         else:
             initIOC_print("No config file found moving to next step.")
 
@@ -288,26 +810,12 @@ class MotorIOCAction:
         """
 
         env_path = ioc_top + "/" + self.ioc_name + "/envPaths"
-        if os.path.exists(env_path):
-            env_old_path = ioc_top + "/" + self.ioc_name + "/envPaths_OLD"
-            os.rename(env_path, env_old_path)
-            env_old = open(env_old_path, "r")
-            env = open(env_path, "w")
-            line = env_old.readline()
-            while line:
-                if line.startswith('epicsEnvSet("ARCH",'):
-                    if platform == 'win32':
-                        env.write('epicsEnvSet("ARCH",       "windows-x64-static")\n')
-                    else:
-                        env.write('epicsEnvSet("ARCH",       "linux-x86_64")\n')
-                elif "EPICS_BASE" in line and not bin_flat:
-                    initIOC_print("Detected non-flat binaries, fixing base location in envPaths.")
-                    env.write('epicsEnvSet("EPICS_BASE", "$(SUPPORT)/../base")\n')
-                else:
-                    env.write(line)
-                line = env_old.readline()
-            env_old.close()
-            env.close()
+        if self.tree.exists(env_path):
+            rules = {'ARCH' : 'epicsEnvSet("ARCH",       "{}")'.format(get_host_arch())}
+            if not bin_flat:
+                rules['EPICS_BASE'] = 'epicsEnvSet("EPICS_BASE", "$(SUPPORT)/../base")'
+            if 'EPICS_BASE' in rewrite_file(env_path, EPICS_ENV_SET_KEY, rules, self.tree):
+                initIOC_print("Detected non-flat binaries, fixing base location in envPaths.")
 
 
     def getIOCBin(self, bin_loc, bin_flat):
@@ -326,61 +834,78 @@ class MotorIOCAction:
             Path to the IOC executable located in driverName/iocs/IOC/bin/OS/driverApp or None if not found
         """
 
-        try:
-            if bin_flat:
-                # if flat, there is no support directory
-                driver_path = bin_loc + "/motor/modules/" + self.ioc_type
-            else:
-                driver_path = bin_loc + "/support/motor/modules/" + self.ioc_type
-            # identify the IOCs folder
-            for name in os.listdir(driver_path):
-                if "ioc" == name or "iocs" == name:
-                    driver_path = driver_path + "/" + name
-                    break
-            # identify the IOC 
-            for name in os.listdir(driver_path):
-                # Add check to see if NOIOC in name - occasional problems generating ADSimDetector
-                if ("IOC" in name or "ioc" in name) and "NOIOC" not in name.upper():
-                    driver_path = driver_path + "/" + name
-                    break 
-            # Find the bin folder
-            driver_path = driver_path + "/bin"
-            # There should only be one architecture
-            for name in os.listdir(driver_path):
-                driver_path = driver_path + "/" + name
-                break
-            # We look for the executable that ends with App
-            for name in os.listdir(driver_path):
-                driver_path = driver_path + "/" + name
-                break
+        return get_binary_index(bin_loc, bin_flat).lookup(self.ioc_type)
 
-            return driver_path
-        except FileNotFoundError:
-            return None
 
+    def get_macros(self, hostname=None):
+        """
+        Function that builds the macros substituted in dependency files from the IOC fields and configuration
+        Parameters
+        ----------
+        hostname : str
+            name of the host IOC server on which the IOC will run. If None, $(HOSTNAME) is left as is
+
+        Returns
+        -------
+        macros : dict of str to str
+            macro values keyed by macro name. Extra macros given to the action override the defaults
+        """
 
-    def fix_macros(self, file_path):
+        macros = {
+            'PREFIX'    : self.ioc_prefix,
+            'PORT'      : 'P0',
+            'MC'        : 'MC:{}'.format(get_mc_number(self.ioc_num)),
+            'CT'        : self.ioc_prefix,
+            'IOCNAME'   : self.ioc_name,
+            'IOC'       : 'ioc' + self.ioc_type,
+        }
+        if hostname is not None:
+            macros['HOSTNAME'] = hostname
+        macros.update(self.macros)
+        return macros
+
+
+    def fix_macros(self, file_path, hostname=None):
         """
         Function that replaces certain macros in given filepath (used primarily for substitution files)
         Parameters
         ----------
         file_path : str
             path to the target file
+        hostname : str
+            name of the host IOC server on which the IOC will run
+        """
+
+        substitute_macros(file_path, self.get_macros(hostname), tree=self.tree)
+
+
+    def find_required_lib_dirs(self, bin_loc, bin_flat):
+        """
+        Function that finds the library directories needed by the IOC binary, from its ELF dependencies
+        Parameters
+        ----------
+        bin_loc : str
+            path to top level of binary distribution
+        bin_flat : bool
+            flag for deciding if binaries are flat or stacked
+
+        Returns
+        -------
+        lib_dirs : list of str
+            required library directories in resolution order, or None if a needed library could not be found
         """
 
-        os.rename(file_path, file_path + '_OLD')
-        old = open(file_path+'_OLD', 'r')
-        contents = old.read()
-        contents = contents.replace('$(PREFIX)', self.ioc_prefix)
-        contents = contents.replace('$(PORT)', 'P0')
-        new = open(file_path, 'w')
-        new.write(contents)
-        old.close()
-        new.close()
-        os.remove(file_path+'_OLD')
+        binary_path = self.getIOCBin(bin_loc, bin_flat)
+        if binary_path is None:
+            return None
+        lib_dirs, missing = get_required_lib_dirs(binary_path, get_support_lib_dirs(bin_loc, bin_flat, get_host_arch()))
+        if len(missing) > 0:
+            initIOC_print('ERROR - Libraries needed by {} were not found in the binary distribution: {}'.format(binary_path, ', '.join(missing)))
+            return None
+        return lib_dirs
 
 
-    def create_path_scripts(self, bin_loc, bin_flat, ioc_top):
+    def create_path_scripts(self, bin_loc, bin_flat, ioc_top, minimal=False):
         """
         Function that attempts to create scripts for setting the dev environment for the IOC given the location of the binaries.
         Parameters
@@ -391,68 +916,95 @@ class MotorIOCAction:
             toggle that determines if the binaries have a flat structure or not
         ioc_top : str
             path to the ioc output_directory
+        minimal : bool
+            if True, only add the library directories needed by the IOC binary, as found from its ELF dependencies
         """
 
+        lib_dirs = None
+        if minimal and platform != "win32":
+            lib_dirs = self.find_required_lib_dirs(bin_loc, bin_flat)
+            if lib_dirs is None:
+                initIOC_print('WARNING - Could not compute minimal library path for {}, using all support modules.'.format(self.ioc_name))
+        if lib_dirs is None:
+            lib_dirs = get_support_lib_dirs(bin_loc, bin_flat, get_host_arch())
         if platform == "win32":
-            delimeter = ';'
-            closer = '%PATH%"'
-            arch='windows-x64-static'
-            path_file = open(ioc_top + '/' + self.ioc_name + '/dllPath.bat', 'w+')
-            path_file.write('@ECHO OFF\n')
-            path_file.write('SET "PATH=')
+            self.tree.write(ioc_top + '/' + self.ioc_name + '/dllPath.bat',
+                            '@ECHO OFF\nSET "PATH=' + ';'.join(lib_dirs + ['%PATH%"']))
         else:
-            delimeter = ':'
-            closer = '$LD_LIBRARY_PATH'
-            arch = 'linux-x86_64'
-            path_file = open(ioc_top + '/' + self.ioc_name + '/ldpath.sh', 'w+')
-            path_file.write('export LD_LIBRARY_PATH=')
-        path_file.write(bin_loc + '/base/lib/' + arch)
-        path_file.write(delimeter)
-        support_dir = bin_loc
-        if not bin_flat:
-            support_dir = bin_loc + '/support'
-
-        if os.path.exists(support_dir) and os.path.isdir(support_dir):
-            for dir in os.listdir(support_dir):
-                if os.path.isdir(support_dir + '/' + dir) and dir != "base" and dir != "areaDetector":
-                    path_file.write(support_dir + '/' + dir + '/lib/' + arch)
-                    path_file.write(delimeter)
+            self.tree.write(ioc_top + '/' + self.ioc_name + '/ldpath.sh',
+                            'export LD_LIBRARY_PATH=' + ':'.join(lib_dirs + ['$LD_LIBRARY_PATH']))
 
-        path_file.write(closer)
-        path_file.close()
 
+    def cleanup(self, ioc_top, template=None):
+        """
+        Function that removes unwanted template files from the IOC. The cleanup manifest of the template is
+        applied natively if available, otherwise the cleanup.sh/cleanup.bat script in ioc-template is run.
+        Parameters
+        ----------
+        ioc_top : str
+            Path to the top directory to contain generated IOCs
+        template : TemplateCache
+            local template cache the IOC was copied from
+        """
 
-    def cleanup(self, ioc_top):
-        """ Function that runs the cleanup.sh/cleanup.bat script in ioc-template to remove unwanted files """
-
-        cleanup_completed = False
+        ioc_path = ioc_top + '/' + self.ioc_name
+        patterns = None
+        if template is not None:
+            patterns = template.cleanup_patterns()
 
-        if platform == "win32":
-            if os.path.exists(ioc_top + '/' + self.ioc_name + '/cleanup.bat'):
+        with stage_event(self.ioc_name, 'cleanup'):
+            if patterns is not None:
                 initIOC_print('Performing cleanup for {}'.format(self.ioc_name))
-                out = subprocess.call([ioc_top + '/' + self.ioc_name + '/cleanup.bat'])
-                initIOC_print('')
-                cleanup_completed = True
-                os.remove(ioc_top + '/' + self.ioc_name + '/cleanup.bat')
-        else:
-            if os.path.exists(ioc_top + '/' + self.ioc_name + '/cleanup.sh'):
+                self.tree.remove_matching(ioc_path, patterns + cleanup_scripts + [CLEANUP_MANIFEST])
+                self.finish_cleanup(ioc_top, True)
+                return
+            command = self.get_cleanup_command(ioc_top)
+            if command is not None:
                 initIOC_print('Performing cleanup for {}'.format(self.ioc_name))
-                out = subprocess.call(['bash', ioc_top + '/' + self.ioc_name + '/cleanup.sh'])
+                out = subprocess.call(command)
+                record_exit_code(command, out)
                 initIOC_print('')
-                cleanup_completed = True
-                os.remove(ioc_top + '/' + self.ioc_name + '/cleanup.sh')
-        if os.path.exists(ioc_top + '/' + self.ioc_name + '/st.cmd'):
-            os.chmod(ioc_top + '/' + self.ioc_name + '/st.cmd', 0o755)
-        if not cleanup_completed:
-            initIOC_print('No cleanup script found, using outdated version of Motor IOC template')
+                os.remove(command[-1])
+            self.finish_cleanup(ioc_top, command is not None)
 
 
-def initIOC_print(text):
-    """
-    A wrapper function for 'print' that allows for printing to CLI or to log
-    """
+    def get_cleanup_command(self, ioc_top):
+        """
+        Function that returns the command running the cleanup.sh/cleanup.bat script in ioc-template for this platform
+        Parameters
+        ----------
+        ioc_top : str
+            Path to the top directory to contain generated IOCs
+        Returns
+        -------
+        command : list of str
+            the command to run, ending with the path to the script, or None if there is no cleanup script
+        """
 
-    print(text)
+        ioc_path = ioc_top + '/' + self.ioc_name
+        if platform == "win32":
+            if os.path.exists(ioc_path + '/cleanup.bat'):
+                return [ioc_path + '/cleanup.bat']
+        elif os.path.exists(ioc_path + '/cleanup.sh'):
+            return ['bash', ioc_path + '/cleanup.sh']
+        return None
+
+
+    def finish_cleanup(self, ioc_top, cleanup_completed):
+        """
+        Function that makes st.cmd executable once cleanup is done
+        Parameters
+        ----------
+        ioc_top : str
+            Path to the top directory to contain generated IOCs
+        cleanup_completed : bool
+            False if no cleanup could be performed
+        """
+
+        if self.tree.exists(ioc_top + '/' + self.ioc_name + '/st.cmd'):
+            self.tree.chmod(ioc_top + '/' + self.ioc_name + '/st.cmd', 0o755)
+        if not cleanup_completed:
+            initIOC_print('No cleanup script found, using outdated version of Motor IOC template')
 
 
 def print_start_message():
@@ -467,80 +1019,834 @@ def print_start_message():
     initIOC_print('')
 
 
-def print_supported_drivers():
-    """ Function that prints list of supported drivers """
+def print_supported_drivers(registry=None):
+    """ Function that prints list of supported drivers, from the driver registry if given """
 
+    drivers = supported_drivers
+    if registry is not None:
+        drivers = sorted(registry.drivers.keys())
     initIOC_print('Supported Drivers:')
     initIOC_print("+-----------------------------+")
-    for driver in supported_drivers:
+    for driver in drivers:
         initIOC_print('+ {}'.format(driver))
     initIOC_print('')
 
 
-def execute_ioc_action(action, configuration, bin_flat):
+def print_driver_registry(registry):
+    """
+    Function that prints the template files and binary of every driver in a driver registry
+    Parameters
+    ----------
+    registry : DriverRegistry
+        the driver registry
+    """
+
+    for driver, artifacts in sorted(registry.drivers.items()):
+        initIOC_print(driver)
+        initIOC_print('    startup script : {}'.format(artifacts['startup_script']))
+        initIOC_print('    autosave       : {}'.format(artifacts['autosave']))
+        initIOC_print('    dependencies   : {}'.format(', '.join(artifacts['dependencies'])))
+        initIOC_print('    macros         : {}'.format(', '.join(artifacts['macros'])))
+        initIOC_print('    binary         : {}'.format(artifacts['binary']))
+    initIOC_print('{} supported drivers'.format(len(registry.drivers)))
+
+
+def read_manifest(manifest_path):
+    """
+    Function that reads a fleet manifest describing many IOCs to generate, from a CSV, INI or YAML file.
+    See the README for the manifest layout
+    Parameters
+    ----------
+    manifest_path : str
+        path to the manifest file
+
+    Returns
+    -------
+    entries : list of (MotorIOCAction, dict of str to str)
+        IOC actions paired with the configuration to use for each of them
+
+    Raises
+    ------
+    ValueError
+        if the manifest is malformed or an IOC entry is missing required fields
+    """
+
+    import csv
+    import configparser
+
+    extension = os.path.splitext(manifest_path)[1].lower()
+    shared = {}
+    raw_entries = []
+    if extension == '.csv':
+        with open(manifest_path, 'r', newline='') as manifest_fp:
+            for row in csv.DictReader(manifest_fp):
+                raw_entries.append(row)
+    elif extension in ['.ini', '.cfg', '.conf']:
+        parser = configparser.ConfigParser(interpolation=None)
+        parser.optionxform = str
+        parser.read(manifest_path)
+        for section in parser.sections():
+            if section.lower() == 'configuration':
+                shared.update(parser[section])
+            else:
+                entry = {'ioc_name' : section}
+                entry.update(parser[section])
+                raw_entries.append(entry)
+    elif extension in ['.yml', '.yaml']:
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError('PyYAML is required to read YAML manifests, install it or use a CSV/INI manifest')
+        with open(manifest_path, 'r') as manifest_fp:
+            contents = yaml.safe_load(manifest_fp) or {}
+        if not isinstance(contents, dict):
+            raise ValueError('YAML manifest must contain a mapping with an iocs list')
+        shared = contents.get('configuration') or {}
+        raw_entries = contents.get('iocs') or []
+    else:
+        raise ValueError('Unsupported manifest format {}, expected csv, ini or yaml'.format(extension))
+    return parse_manifest_entries(shared, raw_entries)
+
+
+def parse_manifest_entries(shared, raw_entries):
     """
-    Function that runs all required IOC action functions with a given configuration
+    Function that creates the IOC actions and configurations of a manifest, see read_manifest
     Parameters
     ----------
-    action : IOCAction
-        currently executing IOC action
-    configuration : dict of str to str
-        configuration settings as read from CONFIGURE or inputted by user
-    bin_flat : bool
-        toggle that tells the script if binaries are flat of not
-    """
-
-    # Perform the overall process action
-    out = action.process(configuration["IOC_DIR"], configuration["TOP_BINARY_DIR"], bin_flat)
-    # if successfull, update any remaining required files
-    if out == 0:
-        action.update_unique(configuration["IOC_DIR"], configuration["TOP_BINARY_DIR"], bin_flat, 
-                action.ioc_prefix, configuration["ENGINEER"], configuration["HOSTNAME"], 
-            configuration["CA_ADDRESS"])
-        action.update_config(configuration["IOC_DIR"], configuration["HOSTNAME"])
-        action.fix_env_paths(configuration["IOC_DIR"], bin_flat)
-        action.create_path_scripts(configuration["TOP_BINARY_DIR"], bin_flat, configuration["IOC_DIR"])
-        action.cleanup(configuration["IOC_DIR"])
-
-
-def guided_init():
-    """ Function that guides the user through generating a single IOC through the CLI """
+    shared : dict of str to str
+        configuration shared by all IOCs
+    raw_entries : list of dict of str to str
+        fields of each IOC, which may override shared configuration keys
+
+    Returns
+    -------
+    entries : list of (MotorIOCAction, dict of str to str)
+        IOC actions paired with the configuration to use for each of them
+
+    Raises
+    ------
+    ValueError
+        if the configuration or an IOC entry is not a mapping, or an IOC entry is missing required fields
+    """
+
+    if not isinstance(shared, dict):
+        raise ValueError('Manifest configuration must be a mapping of configuration keys')
+    if not isinstance(raw_entries, list):
+        raise ValueError('Manifest iocs must be a list of IOC entries')
+    entries = []
+    for entry_num, raw_entry in enumerate(raw_entries, 1):
+        if not isinstance(raw_entry, dict):
+            raise ValueError('Manifest entry {} must be a mapping of IOC fields, not {}'.format(entry_num, repr(raw_entry)))
+        configuration = dict(optional_configuration_keys)
+        fields = {}
+        macros = {}
+        for key, value in shared.items():
+            key = str(key)
+            if (key.upper() in configuration_keys or key.upper() in optional_configuration_keys) and value is not None:
+                configuration[key.upper()] = str(value).strip()
+            elif key.lower().startswith(MACRO_KEY_PREFIX) and value is not None:
+                macros[key[len(MACRO_KEY_PREFIX):]] = str(value).strip()
+        for key, value in raw_entry.items():
+            if key == 'macros':
+                if not isinstance(value, dict):
+                    raise ValueError('Manifest entry {} macros must be a mapping of macro names to values'.format(entry_num))
+                macros.update([(str(name), str(macro)) for name, macro in value.items()])
+                continue
+            if key is None or value is None or str(value).strip() == '':
+                continue
+            key = str(key)
+            if key.lower().startswith(MACRO_KEY_PREFIX):
+                macros[key[len(MACRO_KEY_PREFIX):]] = str(value).strip()
+            elif key.upper() in configuration_keys or key.upper() in optional_configuration_keys:
+                configuration[key.upper()] = str(value).strip()
+            elif key.lower() in action_fields:
+                fields[key.lower()] = str(value).strip()
+        for field in auto_fields:
+            fields.setdefault(field, 'auto')
+        missing = [field for field in action_fields if field not in fields]
+        missing = missing + [key for key in configuration_keys if key not in configuration]
+        if len(missing) > 0:
+            raise ValueError('Manifest entry {} ({}) is missing {}'.format(entry_num, fields.get('ioc_name', 'unnamed'), ', '.join(missing)))
+        action = MotorIOCAction(fields['ioc_type'], fields['ioc_name'], fields['ioc_prefix'],
+                                fields['ioc_port'], fields['connection'], fields['ioc_num'], macros)
+        entries.append((action, configuration))
+    return entries
+
+
+def is_auto(value):
+    """
+    Function that checks if a telnet port or MC number asks for the next free value
+    """
+
+    return str(value).strip().lower() in AUTO_VALUES
+
+
+def get_replaced_iocs(entries):
+    """
+    Function that finds the IOCs of a run that are regenerated in place, so they don't collide with themselves
+    Parameters
+    ----------
+    entries : list of (MotorIOCAction, dict of str to str)
+        IOC actions and their configurations
+
+    Returns
+    -------
+    set of (str, str)
+        IOC directory and name of each replaced IOC
+    """
+
+    replaced = set()
+    for action, configuration in entries:
+        if is_enabled(configuration.get("INCREMENTAL", optional_configuration_keys["INCREMENTAL"])):
+            replaced.add((configuration['IOC_DIR'], action.ioc_name))
+    return replaced
+
+
+def get_existing_ioc_dirs(entries):
+    """
+    Function that lists the IOC directories whose existing IOCs the IOCs of a run must not collide with.
+    IOCs written to archives are deployed elsewhere, so their IOC directory on this machine is not checked.
+    """
+
+    return sorted(set([configuration['IOC_DIR'] for action, configuration in entries if not configuration.get("ARCHIVE_DIR")]))
+
+
+def allocate_entries(entries):
+    """
+    Function that gives IOCs with an auto or blank telnet port or MC number the next free one,
+    skipping those used by existing IOCs and by the other IOCs of the run
+    Parameters
+    ----------
+    entries : list of (MotorIOCAction, dict of str to str)
+        IOC actions and their configurations, updated in place
+    """
+
+    replaced = get_replaced_iocs(entries)
+    previous = {}
+    ports, mcs = set(), set()
+    for ioc_top in get_existing_ioc_dirs(entries):
+        for record in get_inventory(ioc_top).records():
+            if (ioc_top, record['name']) in replaced:
+                previous[(ioc_top, record['name'])] = record
+                continue
+            if record['port'] is not None:
+                ports.add((record['host'], record['port']))
+            if record['mc'] is not None:
+                mcs.add((record['prefix'], record['mc']))
+    for action, configuration in entries:
+        if not is_auto(action.ioc_port):
+            ports.add((configuration['HOSTNAME'], str(action.ioc_port).strip()))
+        if not is_auto(action.ioc_num):
+            mcs.add((action.ioc_prefix, get_mc_number(action.ioc_num)))
+
+    for action, configuration in entries:
+        hostname = configuration['HOSTNAME']
+        record = previous.get((configuration['IOC_DIR'], action.ioc_name))
+        if is_auto(action.ioc_port):
+            if record is not None and record['port'] is not None and (hostname, record['port']) not in ports:
+                port = int(record['port'])
+            else:
+                port = FIRST_TELNET_PORT
+                while (hostname, str(port)) in ports:
+                    port = port + 1
+            ports.add((hostname, str(port)))
+            action.ioc_port = str(port)
+            initIOC_print('Allocated telnet port {} on {} for IOC {}.'.format(port, hostname, action.ioc_name))
+        if is_auto(action.ioc_num):
+            if record is not None and record['mc'] is not None and record['prefix'] == action.ioc_prefix \
+                    and (action.ioc_prefix, record['mc']) not in mcs:
+                mc = int(record['mc'])
+            else:
+                mc = FIRST_MC_NUMBER
+                while (action.ioc_prefix, str(mc)) in mcs:
+                    mc = mc + 1
+            mcs.add((action.ioc_prefix, str(mc)))
+            action.ioc_num = str(mc)
+            initIOC_print('Allocated MC:{} under {} for IOC {}.'.format(mc, action.ioc_prefix, action.ioc_name))
+
+
+def print_inventory(inventory):
+    """
+    Function that prints the IOCs of an inventory
+    Parameters
+    ----------
+    inventory : Inventory
+        inventory of an IOC directory
+    """
+
+    records = inventory.records()
+    columns = ['name', 'host', 'port', 'prefix', 'mc', 'driver']
+    widths = [max([len(column)] + [len(str(record[column])) for record in records]) for column in columns]
+    initIOC_print('  '.join([column.upper().ljust(width) for column, width in zip(columns, widths)]).rstrip())
+    for record in records:
+        initIOC_print('  '.join([str(record[column]).ljust(width) for column, width in zip(columns, widths)]).rstrip())
+    initIOC_print('{} IOCs in {}'.format(len(records), inventory.ioc_top))
+
+
+def validate_entries(entries, index_file=None, template=None):
+    """
+    Function that checks all IOCs of a run against each other and against the IOCs that already exist,
+    before anything is cloned
+    Parameters
+    ----------
+    entries : list of (MotorIOCAction, dict of str to str)
+        IOC actions and their configurations
+    index_file : str
+        optional file in which the binary index is saved between runs
+    template : TemplateCache
+        local template cache. If given, supported drivers are taken from its driver registry
+
+    Returns
+    -------
+    list of list of str
+        the errors found for each entry, in the same order as entries
+    """
+
+    problems = [[] for entry in entries]
+    names, ports, mcs = {}, {}, {}
+    replaced = get_replaced_iocs(entries)
+    for ioc_top in get_existing_ioc_dirs(entries):
+        for record in get_inventory(ioc_top).records():
+            if (ioc_top, record['name']) in replaced:
+                continue
+            owner = 'existing IOC {} in {}'.format(record['name'], ioc_top)
+            names[(ioc_top, record['name'])] = owner
+            if record['port'] is not None:
+                ports.setdefault((record['host'], record['port']), owner)
+            if record['mc'] is not None:
+                mcs.setdefault((record['prefix'], record['mc']), owner)
+
+    unsupported = None
+    for (action, configuration), errors in zip(entries, problems):
+        ioc_top = configuration['IOC_DIR']
+        hostname = configuration['HOSTNAME']
+        owner = 'IOC {} of this run'.format(action.ioc_name)
+        if len(action.ioc_name) == 0 or '/' in action.ioc_name:
+            errors.append('invalid IOC name "{}"'.format(action.ioc_name))
+        elif (ioc_top, action.ioc_name) in names:
+            errors.append('name is already used by {}'.format(names[(ioc_top, action.ioc_name)]))
+        elif (ioc_top, action.ioc_name) not in replaced and not configuration.get("ARCHIVE_DIR") \
+                and os.path.exists(ioc_top + '/' + action.ioc_name):
+            errors.append('IOC directory {} already exists'.format(ioc_top + '/' + action.ioc_name))
+        else:
+            names[(ioc_top, action.ioc_name)] = owner
+
+        port = str(action.ioc_port).strip()
+        if not port.isdigit() or not 0 < int(port) < 65536:
+            errors.append('invalid telnet port "{}"'.format(action.ioc_port))
+        elif (hostname, port) in ports:
+            errors.append('telnet port {} on {} is already used by {}'.format(port, hostname, ports[(hostname, port)]))
+        else:
+            ports[(hostname, port)] = owner
+
+        mc = get_mc_number(action.ioc_num)
+        if (action.ioc_prefix, mc) in mcs:
+            errors.append('MC:{} under prefix {} is already used by {}'.format(mc, action.ioc_prefix, mcs[(action.ioc_prefix, mc)]))
+        else:
+            mcs[(action.ioc_prefix, mc)] = owner
+
+        binary_index = get_binary_index(configuration['TOP_BINARY_DIR'], index_file=index_file)
+        registry = get_driver_registry(template, configuration['TOP_BINARY_DIR'], binary_index.bin_flat)
+        if action.ioc_type not in (supported_drivers if registry is None else registry.drivers):
+            errors.append('unsupported driver type {}'.format(action.ioc_type))
+            unsupported = [registry]
+            continue
+        binary_path = binary_index.lookup(action.ioc_type)
+        if binary_path is None:
+            errors.append('no compiled IOC binary for {} in {}'.format(action.ioc_type, configuration['TOP_BINARY_DIR']))
+        elif platform != 'win32' and len(binary_path) > KERNEL_PATH_LIMIT:
+            initIOC_print('WARNING - IOC {}: path to executable exceeds legal bash limit, st.cmd will call st_base.cmd'.format(action.ioc_name))
+
+    for (action, configuration), errors in zip(entries, problems):
+        for error in errors:
+            initIOC_print('ERROR - IOC {}: {}.'.format(action.ioc_name, error))
+    if unsupported is not None:
+        print_supported_drivers(unsupported[0])
+    return problems
+
+
+def print_batch_summary(results):
+    """
+    Function that prints a per IOC success/failure summary for a batch run
+    Parameters
+    ----------
+    results : list of (MotorIOCAction, bool, str)
+        results as returned by run_batch
+    """
+
+    num_failed = len([result for result in results if not result[1]])
+    name_width = max([len('IOC')] + [len(result[0].ioc_name) for result in results])
+    initIOC_print('')
+    initIOC_print('Batch summary:')
+    initIOC_print("+-----------------------------+")
+    for action, success, message in results:
+        status = 'OK    ' if success else 'FAILED'
+        initIOC_print('+ {} {} {}'.format(action.ioc_name.ljust(name_width), status, message))
+    initIOC_print('')
+    initIOC_print('{} of {} IOCs generated successfully, {} failed.'.format(len(results) - num_failed, len(results), num_failed))
+
+
+def generate_entries(entries, workers=DEFAULT_WORKERS, template=None, index_file=None, stage_limits=None,
+                     validate_only=False, skip_invalid=False):
+    """
+    Function that allocates free ports and MC numbers, validates, and generates a list of IOCs
+    Parameters
+    ----------
+    entries : list of (MotorIOCAction, dict of str to str)
+        IOC actions and their configurations
+    workers : int
+        maximum number of IOCs generated at the same time
+    template : TemplateCache
+        local template cache shared by all IOCs
+    index_file : str
+        optional file in which the binary index is saved between runs
+    stage_limits : dict of str to int
+        if given, IOCs are generated with the asyncio pipeline using these per stage concurrency limits
+    validate_only : bool
+        only check the IOCs, without generating any
+    skip_invalid : bool
+        generate the IOCs that passed validation instead of aborting the run
+
+    Returns
+    -------
+    results : list of (MotorIOCAction, bool, str)
+        for each IOC action, whether it succeeded (or is valid with validate_only) and a short status message,
+        rejected IOCs last. None if the run was aborted
+    """
+
+    # The shared template mirror is prepared first, so drivers can be discovered from it
+    if template is not None and template.prepare() != 0:
+        return None
+    allocate_entries(entries)
+    problems = validate_entries(entries, index_file, template)
+    rejected = [(entry[0], False, 'rejected, ' + '; '.join(errors)) for entry, errors in zip(entries, problems) if len(errors) > 0]
+    entries = [entry for entry, errors in zip(entries, problems) if len(errors) == 0]
+    if validate_only:
+        return [(action, True, 'valid') for action, configuration in entries] + rejected
+    if len(rejected) > 0 and not skip_invalid:
+        initIOC_print('ERROR - {} of {} IOCs failed validation, nothing was generated. Use --skip-invalid to generate the others.'.format(len(rejected), len(entries) + len(rejected)))
+        return None
+    if check_archive_mode(entries, template) != 0:
+        return None
+    if stage_limits is not None:
+        import asyncio
+        from initmotorioc.pipeline_async import run_batch_async
+
+        initIOC_print('Generating {} IOCs using the asyncio pipeline.'.format(len(entries)))
+        results = asyncio.run(run_batch_async(entries, template, stage_limits))
+    else:
+        initIOC_print('Generating {} IOCs using {} workers.'.format(len(entries), workers))
+        results = run_batch(entries, workers, template)
+    close_archives()
+    boot_entries = [(action, configuration) for action, configuration in entries
+                    if is_enabled(configuration.get("INSTALL_BOOT_SCRIPT", optional_configuration_keys["INSTALL_BOOT_SCRIPT"]))]
+    for ioc_top in get_existing_ioc_dirs(boot_entries):
+        install_boot_script(ioc_top)
+    return results + rejected
+
+
+def batch_init(manifest_path, workers=DEFAULT_WORKERS, template=None, index_file=None, overrides=None, stage_limits=None,
+               validate_only=False, skip_invalid=False):
+    """
+    Function that generates all IOCs described in a fleet manifest without user interaction
+    Parameters
+    ----------
+    manifest_path : str
+        path to the manifest file
+    workers : int
+        maximum number of IOCs generated at the same time
+    template : TemplateCache
+        local template cache shared by all IOCs
+    index_file : str
+        optional file in which the binary index is saved between runs
+    overrides : dict of str to str
+        configuration values given on the command line, applied to every IOC
+    stage_limits : dict of str to int
+        if given, IOCs are generated with the asyncio pipeline using these per stage concurrency limits
+    validate_only : bool
+        only check the manifest, without generating any IOC
+    skip_invalid : bool
+        generate the IOCs that passed validation instead of aborting the run
+
+    Returns
+    -------
+    int
+        0 if all IOCs were generated (or are valid with validate_only), -1 otherwise
+    """
+
+    print_start_message()
+    try:
+        entries = read_manifest(manifest_path)
+    except (OSError, ValueError) as err:
+        initIOC_print('ERROR - Could not read manifest {}: {}'.format(manifest_path, err))
+        return -1
+    for action, configuration in entries:
+        configuration.update(overrides or {})
+    results = generate_entries(entries, workers, template, index_file, stage_limits, validate_only, skip_invalid)
+    if results is None:
+        return -1
+    if validate_only:
+        initIOC_print('{} of {} IOCs in {} are valid.'.format(len([result for result in results if result[1]]), len(results), manifest_path))
+    else:
+        print_batch_summary(results)
+        print_stage_summary(get_event_log().events)
+    if all([result[1] for result in results]):
+        return 0
+    return -1
+
+
+def request_server(socket_path, request, timeout=None):
+    """
+    Function that sends one request to a generator server started with --serve, and waits for its response
+    Parameters
+    ----------
+    socket_path : str
+        path of the server's Unix socket
+    request : dict
+        request with a 'command' from server_commands and its arguments,
+        ex. {'command' : 'generate', 'configuration' : {...}, 'iocs' : [{...}]}
+    timeout : float
+        optional number of seconds to wait for the response
+
+    Returns
+    -------
+    response : dict
+        decoded response, see GeneratorServer.handle_request
+
+    Raises
+    ------
+    OSError
+        if the server can not be reached or closes the connection without responding
+    """
+
+    import socket
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path)
+        client.sendall(json.dumps(request).encode() + b'\n')
+        with client.makefile('rb') as response_fp:
+            line = response_fp.readline()
+    if not line.endswith(b'\n'):
+        raise ConnectionError('Generator server on {} closed the connection'.format(socket_path))
+    return json.loads(line)
+
+
+def get_watch_targets(ioc_tops):
+    """
+    Function that finds the IOCs to keep up to date, and the binary distribution files each of them depends on
+    Parameters
+    ----------
+    ioc_tops : list of str
+        IOC directories to watch. Only IOCs with a state file can be regenerated
+
+    Returns
+    -------
+    targets : list of dict
+        for each IOC, its 'ioc_top', 'action', 'configuration', 'bin_flat', its 'driver_dir', the 'lib_dirs' it uses,
+        and whether it uses a 'minimal' library path
+    directories : list of str
+        binary distribution directories to watch
+    """
+
+    targets = []
+    directories = set()
+    for ioc_top in ioc_tops:
+        for record in get_inventory(ioc_top).records():
+            state = read_state(ioc_top + '/' + record['name'])
+            if state is None:
+                continue
+            configuration = state['configuration']
+            bin_loc = configuration["TOP_BINARY_DIR"]
+            bin_flat = state['bin_flat']
+            index = get_binary_index(bin_loc, bin_flat)
+            action = MotorIOCAction(**state['action'])
+            support_dir = bin_loc if bin_flat else bin_loc + '/support'
+            lib_dirs = get_support_lib_dirs(bin_loc, bin_flat, get_host_arch())
+            minimal = is_enabled(configuration.get("MINIMAL_LDPATH", optional_configuration_keys["MINIMAL_LDPATH"]))
+            binary_path = index.lookup(action.ioc_type)
+            if minimal and binary_path is not None and platform != "win32":
+                lib_dirs = get_required_lib_dirs(binary_path, lib_dirs)[0] or lib_dirs
+            targets.append({
+                'ioc_top'       : ioc_top,
+                'action'        : action,
+                'configuration' : configuration,
+                'bin_flat'      : bin_flat,
+                'driver_dir'    : index.get_modules_dir() + '/' + action.ioc_type,
+                'lib_dirs'      : lib_dirs,
+                'minimal'       : minimal
+            })
+            # Everything the binary index scanned, and the library directories of every support module
+            directories.update(index.mtimes.keys())
+            directories.update([support_dir, index.get_modules_dir()])
+            for lib_dir in get_support_lib_dirs(bin_loc, bin_flat, get_host_arch()):
+                directories.update([lib_dir, os.path.dirname(lib_dir)])
+    return targets, sorted(directories)
+
+
+def get_affected_iocs(changed, targets):
+    """
+    Function that maps changed binary distribution paths to the IOCs that may need regenerating.
+    A change inside a driver's module or to a library only affects the IOCs using it
+    Parameters
+    ----------
+    changed : set of str
+        changed paths, as returned by DirectoryWatcher.wait
+    targets : list of dict
+        IOCs and their dependencies, as returned by get_watch_targets
+
+    Returns
+    -------
+    affected : list of dict
+        targets of the affected IOCs
+    """
+
+    def depends_on(target, path):
+        bin_loc = target['configuration']["TOP_BINARY_DIR"]
+        if path != bin_loc and not path.startswith(bin_loc + '/'):
+            return False
+        if path == target['driver_dir'] or path.startswith(target['driver_dir'] + '/'):
+            return True
+        if path.startswith(os.path.dirname(target['driver_dir']) + '/'):
+            return False
+        if os.path.dirname(path) in target['lib_dirs']:
+            return target['minimal']
+        if os.path.dirname(path) in get_support_lib_dirs(bin_loc, target['bin_flat'], get_host_arch()):
+            return False
+        return True
+
+    return [target for target in targets if any([depends_on(target, path) for path in changed])]
+
+
+def watch_iocs(ioc_tops, template, poll=False, debounce=WATCH_DEBOUNCE):
+    """
+    Function that watches the binary distributions IOCs were built from, and regenerates the files of affected IOCs
+    when a driver or support module is rebuilt. Runs until interrupted.
+    Parameters
+    ----------
+    ioc_tops : list of str
+        IOC directories to keep up to date
+    template : TemplateCache
+        local template cache the IOCs are regenerated from
+    poll : bool
+        if True, poll for changes instead of using inotify
+    debounce : float
+        seconds without new changes before a rebuild is considered finished
+
+    Returns
+    -------
+    int
+        0 if interrupted, -1 if error
+    """
+
+    if template.prepare() != 0:
+        return -1
+    watcher = DirectoryWatcher(poll)
+    try:
+        targets, directories = get_watch_targets(ioc_tops)
+        while True:
+            watcher.set_directories(directories)
+            initIOC_print('Watching {} directories of {} binary distributions for {} IOCs.'.format(
+                len(directories), len(set([target['configuration']["TOP_BINARY_DIR"] for target in targets])), len(targets)))
+            changed = watcher.wait()
+            # Wait for the rebuild to finish
+            while True:
+                more = watcher.wait(debounce)
+                if len(more) == 0:
+                    break
+                changed.update(more)
+            start = time.perf_counter()
+            affected = get_affected_iocs(changed, targets)
+            initIOC_print('{} paths changed, {} IOCs affected.'.format(len(changed), len(affected)))
+            reset_caches()
+            num_failed = 0
+            for target in affected:
+                action = target['action']
+                action.registry = get_driver_registry(template, target['configuration']["TOP_BINARY_DIR"], target['bin_flat'])
+                try:
+                    configuration = dict(target['configuration'], IOC_DIR=target['ioc_top'])
+                    out = regenerate_staged(action, configuration, target['bin_flat'], template)
+                except Exception as err:
+                    initIOC_print('ERROR - Failed to regenerate IOC {}: {}'.format(action.ioc_name, err))
+                    out = -1
+                if out != 0:
+                    num_failed = num_failed + 1
+            if len(affected) > 0:
+                initIOC_print('{} of {} affected IOCs checked in {:.3f}s, {} failed.'.format(
+                    len(affected) - num_failed, len(affected), time.perf_counter() - start, num_failed))
+            # New IOCs and directories are picked up after every rebuild
+            targets, directories = get_watch_targets(ioc_tops)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        watcher.close()
+
+
+def guided_init(template=None, index_file=None, overrides=None):
+    """
+    Function that guides the user through generating a single IOC through the CLI
+    Parameters
+    ----------
+    template : TemplateCache
+        local template cache shared by all IOCs
+    index_file : str
+        optional file in which the binary index is saved between runs
+    overrides : dict of str to str
+        configuration values given on the command line
+    """
 
     print_start_message()
     initIOC_print('Welcome to initMotorIOCs!')
-    configuration = {}
+    configuration = dict(optional_configuration_keys)
+    configuration.update(overrides or {})
     configuration['IOC_DIR']        = input('Enter the ioc output location. > ')
     configuration['TOP_BINARY_DIR'] = input('Enter the location of your compiled binaries. > ')
-    bin_flat = True
-    if os.path.exists(configuration['TOP_BINARY_DIR']):
-        if os.path.exists(os.path.join(configuration['TOP_BINARY_DIR'], 'support')):
-            bin_flat = False
+    bin_flat = get_binary_index(configuration['TOP_BINARY_DIR'], index_file=index_file).bin_flat
     configuration['HOSTNAME']   = input('Enter the IOC server hostname. > ')
     configuration['ENGINEER']   = input('Enter your name and contact information. > ')
     configuration['CA_ADDRESS'] = input('Enter the CA_ADDRESS IP. > ')
+    registry = get_driver_registry(template, configuration['TOP_BINARY_DIR'], bin_flat)
     another_ioc = True
     while another_ioc:
         driver_type = None
         while driver_type is None:
             driver_type = input('What driver type would you like to generate? > ')
-            if driver_type not in supported_drivers:
+            if driver_type not in (supported_drivers if registry is None else registry.drivers):
                 driver_type = None
                 initIOC_print('The selected driver type is not supported. See list of supported drivers below.')
-                print_supported_drivers()
+                print_supported_drivers(registry)
         ioc_name = input('What should the IOC name be? > ')
         #port = input('What port should the IOC use? (ex. P0). > ')
         #controller_port = input('What should the controller port be? (ex. M0) > ')
-        mc_number = input('What should the motion controller number be? (ex. MC:37) > ')
+        mc_number = input('What should the motion controller number be? (ex. 37 for MC:37, blank for the next free one) > ')
         prefix = input('What should the controller prefix be? (ex. XF:10IDC-CT) > ')
-        ioc_port = input('What telnet port should procServer use to run the IOC? > ')
+        ioc_port = input('What telnet port should procServer use to run the IOC? (blank for the next free one) > ')
         connection = input('Enter the connection param for your device. (ex. IP, serial number etc.) enter NA if not sure. > ')
         #ioc_action = MotorIOCAction(driver_type, ioc_name, port, controller_port, mc_number, ct_prefix, ioc_port, connection)
         ioc_action = MotorIOCAction(driver_type, ioc_name, prefix, ioc_port, connection, mc_number)
-        execute_ioc_action(ioc_action, configuration, bin_flat)
+        allocate_entries([(ioc_action, configuration)])
+        if any(validate_entries([(ioc_action, configuration)], index_file, template)):
+            initIOC_print('IOC {} was not generated.'.format(ioc_name))
+        else:
+            execute_ioc_action(ioc_action, configuration, bin_flat, template)
+            if is_enabled(configuration.get("INSTALL_BOOT_SCRIPT", optional_configuration_keys["INSTALL_BOOT_SCRIPT"])):
+                install_boot_script(configuration['IOC_DIR'])
         another = input('Would you like to generate another IOC? (y/n). > ')
         if another != 'y':
             another_ioc = False
+    print_stage_summary(get_event_log().events)
     initIOC_print('Done.')
 
 
-guided_init()
\ No newline at end of file
+def main():
+    """ Function that parses command line arguments and runs guided or batch initialization """
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Auto initialization of EPICS Motion Controller IOCs.')
+    parser.add_argument('-m', '--manifest', help='Fleet manifest (csv, ini or yaml) for non-interactive batch generation.')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help='Number of IOCs to generate in parallel in batch mode. Default: {}'.format(DEFAULT_WORKERS))
+    parser.add_argument('--template-cache', default=DEFAULT_TEMPLATE_CACHE,
+                        help='Directory for the local IOC template mirror. Default: {}'.format(DEFAULT_TEMPLATE_CACHE))
+    parser.add_argument('--template-dir', help='Use an existing template checkout or unpacked snapshot instead of the mirror.')
+    parser.add_argument('--offline', action='store_true', help='Never contact the template remote, use the cached mirror as is.')
+    parser.add_argument('--binary-index', help='File in which the binary distribution index is saved between runs.')
+    parser.add_argument('--minimal-ldpath', action='store_true',
+                        help='Only put library directories needed by the IOC binary (from its ELF dependencies) in ldpath.sh.')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Update existing IOCs in place, re-rendering only generated files whose inputs changed.')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Generate batch IOCs with an asyncio pipeline that overlaps template fetch, binary lookup and rendering.')
+    parser.add_argument('--stage-limit', action='append', default=[], metavar='STAGE=N',
+                        help='Maximum number of IOCs in a pipeline stage at once, for stages {}. May be repeated.'.format(', '.join(DEFAULT_STAGE_LIMITS.keys())))
+    parser.add_argument('--list-drivers', metavar='TOP_BINARY_DIR',
+                        help='List the drivers supported by the template and binary distribution, with their files.')
+    parser.add_argument('--inventory', metavar='IOC_DIR', help='List the IOCs in an IOC directory, updating its saved inventory.')
+    parser.add_argument('--validate-only', action='store_true', help='Only check the manifest for conflicts and missing binaries.')
+    parser.add_argument('--skip-invalid', action='store_true', help='Generate the IOCs that pass validation instead of aborting the run.')
+    parser.add_argument('--link-mode', choices=link_modes, default='copy',
+                        help='Share template files that are never rewritten between IOCs by hard link or reflink, falling back to copies. Default: copy')
+    parser.add_argument('--staging-dir',
+                        help='Build IOCs in this directory, ex. on tmpfs, and copy them into IOC_DIR once complete. Default: a staging directory in IOC_DIR')
+    parser.add_argument('--archive-dir', help='Write the generated IOCs of each IOC server to ARCHIVE_DIR/HOSTNAME.tar.gz instead of IOC_DIR.')
+    parser.add_argument('--install-boot-script', action='store_true',
+                        help='Copy the bootMotorIOCs.py boot orchestrator into IOC_DIR, or into each archive with --archive-dir.')
+    parser.add_argument('--serve', metavar='SOCKET',
+                        help='Run a generator server on a Unix socket, keeping the template, indexes and inventories warm between requests.')
+    parser.add_argument('--watch', action='append', default=[], metavar='IOC_DIR',
+                        help='Watch the binary distributions the IOCs in IOC_DIR were built from, and regenerate affected files when they change. May be repeated.')
+    parser.add_argument('--poll', action='store_true', help='In watch mode, poll for changes instead of using inotify, ex. on NFS.')
+    parser.add_argument('--debounce', type=float, default=WATCH_DEBOUNCE,
+                        help='In watch mode, seconds without changes before a rebuild is handled. Default: {}'.format(WATCH_DEBOUNCE))
+    parser.add_argument('--event-log', help='JSON lines file to which a timing event is appended for every IOC stage.')
+    parser.add_argument('--profile', metavar='IOC_NAME', help='Run the generation of one IOC under cProfile.')
+    args = parser.parse_args()
+
+    stage_limits = None
+    if args.use_async or len(args.stage_limit) > 0:
+        stage_limits = {}
+        for stage_limit in args.stage_limit:
+            stage, _, limit = stage_limit.partition('=')
+            if stage not in DEFAULT_STAGE_LIMITS or not limit.isdigit():
+                parser.error('invalid stage limit {}'.format(stage_limit))
+            stage_limits[stage] = int(limit)
+    if (args.validate_only or args.skip_invalid) and args.manifest is None:
+        parser.error('--validate-only and --skip-invalid require a manifest')
+    if args.archive_dir is not None and args.manifest is None:
+        parser.error('--archive-dir requires a manifest')
+    if args.profile is not None and stage_limits is not None:
+        parser.error('--profile can not be combined with --async or --stage-limit')
+    if args.serve is not None and (args.manifest is not None or args.profile is not None):
+        parser.error('--serve can not be combined with a manifest or --profile')
+    if len(args.watch) > 0 and (args.manifest is not None or args.serve is not None):
+        parser.error('--watch can not be combined with a manifest or --serve')
+    if args.link_mode == 'hardlink' and args.template_dir is not None:
+        parser.error('--link-mode hardlink can not be combined with --template-dir, use reflink or copy')
+
+    if args.inventory is not None:
+        print_inventory(get_inventory(args.inventory))
+        return 0
+
+    overrides = {}
+    if args.minimal_ldpath:
+        overrides['MINIMAL_LDPATH'] = 'YES'
+    if args.incremental:
+        overrides['INCREMENTAL'] = 'YES'
+    if args.profile is not None:
+        overrides['PROFILE_IOC'] = args.profile
+    if args.archive_dir is not None:
+        overrides['ARCHIVE_DIR'] = os.path.abspath(args.archive_dir)
+    if args.staging_dir is not None:
+        overrides['STAGING_DIR'] = os.path.abspath(args.staging_dir)
+    if args.install_boot_script:
+        overrides['INSTALL_BOOT_SCRIPT'] = 'YES'
+    # A generator server keeps running, so its events are only logged and returned with each response
+    set_event_log(args.event_log, keep_events=args.serve is None and len(args.watch) == 0)
+    template = TemplateCache(args.template_cache, args.template_dir, offline=args.offline, link_mode=args.link_mode)
+    if args.list_drivers is not None:
+        registry = get_driver_registry(template, args.list_drivers)
+        if registry is None:
+            return 1
+        print_driver_registry(registry)
+        return 0
+    try:
+        if len(args.watch) > 0:
+            out = watch_iocs([os.path.abspath(ioc_top) for ioc_top in args.watch], template, args.poll, args.debounce)
+        elif args.serve is not None:
+            server = GeneratorServer(args.serve, template, args.workers, args.binary_index, overrides, stage_limits)
+            out = server.serve()
+        elif args.manifest is not None:
+            out = batch_init(args.manifest, args.workers, template, args.binary_index, overrides, stage_limits,
+                             args.validate_only, args.skip_invalid)
+        else:
+            guided_init(template, args.binary_index, overrides)
+            out = 0
+        # The library functions return -1 on errors, which would be exit status 255
+        return 0 if out == 0 else 1
+    finally:
+        get_event_log().close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
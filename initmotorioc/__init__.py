@@ -0,0 +1,4 @@
+"""
+Helpers of initMotorIOCs: configuration, caches of binary distributions and IOC templates, file rendering,
+staging, archives and the IOC generation pipelines. The command line and library API live in initMotorIOCs.py.
+"""
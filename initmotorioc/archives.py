@@ -0,0 +1,194 @@
+"""
+Writing the generated IOCs of each IOC server to a compressed archive, and the boot orchestrator.
+"""
+
+# imports
+import os
+import time
+import io
+import threading
+
+from .config import is_enabled, optional_configuration_keys
+from .events import initIOC_print, stage_event
+from .files import hash_file, write_file_atomic
+
+
+# Archives of generated IOCs, one per IOC server, written with --archive-dir
+ARCHIVE_SUFFIX = '.tar.gz'
+
+# Boot orchestrator shipped next to initMotorIOCs.py, copied into IOC directories and archives with --install-boot-script
+BOOT_SCRIPT = 'bootMotorIOCs.py'
+
+# Archives being written during this run, keyed by path
+_archives = {}
+_archive_lock = threading.Lock()
+
+
+class HostArchive:
+
+
+    def __init__(self, archive_path, boot_script=None):
+        """
+        Constructor for the HostArchive class, a compressed tar of all IOCs for one IOC server
+        Parameters
+        ----------
+        archive_path : str
+            path of the archive, written to a temporary file until closed
+        boot_script : str
+            optional path of the boot orchestrator, added to the archive when it is closed
+        """
+
+        import tarfile
+
+        self.archive_path   = archive_path
+        self.temp_path      = archive_path + '.tmp'
+        self.tar            = tarfile.open(self.temp_path, 'w:gz')
+        self.boot_script    = boot_script
+        self.lock           = threading.Lock()
+        self.num_iocs       = 0
+
+
+    def add(self, tree, ioc_name):
+        """
+        Function that streams a generated IOC into the archive
+        Parameters
+        ----------
+        tree : MemoryTree
+            the generated IOC
+        ioc_name : str
+            name of the IOC, used as its top directory in the archive
+        """
+
+        with self.lock:
+            tree.write_archive(self.tar, ioc_name)
+            self.num_iocs = self.num_iocs + 1
+
+
+    def close(self):
+        """ Function that adds the boot orchestrator if requested, finishes the archive and moves it into place """
+
+        import tarfile
+
+        with self.lock:
+            if self.boot_script is not None:
+                with open(self.boot_script, 'rb') as boot_fp:
+                    data = boot_fp.read()
+                info = tarfile.TarInfo(BOOT_SCRIPT)
+                info.size = len(data)
+                info.mode = 0o755
+                info.mtime = time.time()
+                self.tar.addfile(info, io.BytesIO(data))
+            self.tar.close()
+            os.replace(self.temp_path, self.archive_path)
+
+
+def get_boot_script():
+    """ Function that returns the path of the boot orchestrator shipped with this script, or None if it is missing """
+
+    boot_script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), BOOT_SCRIPT)
+    if os.path.exists(boot_script):
+        return boot_script
+    return None
+
+
+def install_boot_script(ioc_top):
+    """
+    Function that copies the boot orchestrator into an IOC directory, unless it is already up to date
+    Parameters
+    ----------
+    ioc_top : str
+        Path to the top directory containing generated IOCs
+    """
+
+    boot_script = get_boot_script()
+    target = ioc_top + '/' + BOOT_SCRIPT
+    if boot_script is None or not os.path.isdir(ioc_top):
+        return
+    if os.path.exists(target) and hash_file(target) == hash_file(boot_script):
+        return
+    try:
+        with open(boot_script, 'r') as boot_fp:
+            write_file_atomic(target, boot_fp.read(), 0o755)
+    except OSError as err:
+        initIOC_print('WARNING - Could not copy {} into {}: {}'.format(BOOT_SCRIPT, ioc_top, err))
+
+
+def get_archive_path(configuration):
+    """
+    Function that returns the archive an IOC is written to in archive mode, one per IOC server
+    """
+
+    return configuration["ARCHIVE_DIR"] + '/' + configuration["HOSTNAME"] + ARCHIVE_SUFFIX
+
+
+def archive_ioc(action, configuration):
+    """
+    Function that streams an IOC generated in memory into the archive of its IOC server
+    Parameters
+    ----------
+    action : MotorIOCAction
+        IOC action whose tree holds the generated IOC
+    configuration : dict of str to str
+        configuration of the IOC, with ARCHIVE_DIR set
+    """
+
+    archive_path = get_archive_path(configuration)
+    with _archive_lock:
+        if archive_path not in _archives:
+            boot_script = None
+            if is_enabled(configuration.get("INSTALL_BOOT_SCRIPT", optional_configuration_keys["INSTALL_BOOT_SCRIPT"])):
+                boot_script = get_boot_script()
+            _archives[archive_path] = HostArchive(archive_path, boot_script)
+        archive = _archives[archive_path]
+    with stage_event(action.ioc_name, 'archive'):
+        archive.add(action.tree, action.ioc_name)
+
+
+def close_archives():
+    """ Function that finishes all archives written during this run """
+
+    with _archive_lock:
+        for archive_path in sorted(_archives.keys()):
+            _archives[archive_path].close()
+            initIOC_print('Wrote {} IOCs to {}'.format(_archives[archive_path].num_iocs, archive_path))
+        _archives.clear()
+
+
+def check_archive_mode(entries, template):
+    """
+    Function that checks that IOCs written to archives can be generated entirely in memory
+    Parameters
+    ----------
+    entries : list of (MotorIOCAction, dict of str to str)
+        IOC actions and their configurations
+    template : TemplateCache
+        local template cache shared by all IOCs, already prepared
+
+    Returns
+    -------
+    int
+        0 if archive mode can be used, -1 otherwise
+    """
+
+    archived = [configuration for action, configuration in entries if configuration.get("ARCHIVE_DIR")]
+    if len(archived) == 0:
+        return 0
+    if any([is_enabled(configuration.get("INCREMENTAL", optional_configuration_keys["INCREMENTAL"])) for configuration in archived]):
+        initIOC_print('ERROR - Archive output can not be combined with incremental regeneration.')
+        return -1
+    if template is None or template.cleanup_patterns() is None:
+        initIOC_print('ERROR - Archive output requires a local template cache with a cleanup manifest, cleanup scripts can not run in memory.')
+        return -1
+    for archive_dir in set([configuration["ARCHIVE_DIR"] for configuration in archived]):
+        os.makedirs(archive_dir, exist_ok=True)
+    return 0
+
+
+def get_output_message(action, configuration):
+    """
+    Function that describes where an IOC was generated, for the batch summary
+    """
+
+    if configuration.get("ARCHIVE_DIR"):
+        return 'archived in {}'.format(get_archive_path(configuration))
+    return 'generated in {}'.format(configuration['IOC_DIR'] + '/' + action.ioc_name)
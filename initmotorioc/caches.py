@@ -0,0 +1,330 @@
+"""
+Indexes, registries, inventories and library directories shared by all IOCs of a run, built at most once.
+"""
+
+# imports
+import os
+import threading
+import json
+import collections
+
+from .events import initIOC_print
+from .files import write_file_atomic
+from .elf import read_elf_dynamic, system_lib_dirs
+from .indexes import BinaryIndex, DriverRegistry, Inventory
+
+
+# Lock guarding every cache below, reentrant as building a driver registry builds its binary index.
+# Caches are shared by the worker threads, the asyncio pipeline executor and the generator server
+_cache_lock = threading.RLock()
+
+# Support modules that are never added to the library path
+excluded_support_modules = [
+    'base',
+    'areaDetector'
+]
+
+# Library directories of the binary distributions used during this run, keyed by (binary location, flat flag, arch)
+_support_lib_dirs = {}
+
+# Shared libraries found in each set of library directories, and libraries needed by each IOC executable
+_lib_maps = {}
+_required_lib_dirs = {}
+
+# Version of the saved binary index format, bumped when the layout changes
+BINARY_INDEX_VERSION = 1
+
+# Binary indexes built during this run, keyed by (binary location, flat flag)
+_binary_indexes = {}
+
+# Driver registries built during this run, keyed by (template snapshot, binary location, flat flag)
+_driver_registries = {}
+
+# Inventory of existing IOCs, saved in each IOC directory
+INVENTORY_FILE = '.initMotorIOCs-inventory.json'
+
+# Inventories read during this run, keyed by IOC directory
+_inventories = {}
+
+
+def get_binary_index(bin_loc, bin_flat=None, index_file=None):
+    """
+    Function that returns the binary index for a distribution, building it at most once per run
+    Parameters
+    ----------
+    bin_loc : str
+        path to top level of binary distribution
+    bin_flat : bool
+        flag for deciding if binaries are flat or stacked. If None, it is detected
+    index_file : str
+        optional json file in which indexes are saved between runs. A saved index is reused
+        unless one of the directories it was built from has been modified
+
+    Returns
+    -------
+    BinaryIndex
+        the index for the binary distribution
+    """
+
+    with _cache_lock:
+        if (bin_loc, bin_flat) in _binary_indexes:
+            return _binary_indexes[(bin_loc, bin_flat)]
+
+        saved = {}
+        if index_file is not None and os.path.exists(index_file):
+            try:
+                with open(index_file, 'r') as index_fp:
+                    saved = json.load(index_fp)
+            except (OSError, ValueError):
+                initIOC_print('WARNING - Could not read binary index {}, rebuilding it.'.format(index_file))
+            if saved.get('version') != BINARY_INDEX_VERSION:
+                saved = {}
+
+        index = BinaryIndex(bin_loc, bin_flat)
+        contents = saved.get('indexes', {}).get(bin_loc)
+        if contents is not None and (bin_flat is None or contents['bin_flat'] == bin_flat):
+            index.from_dict(contents)
+            if index.is_stale():
+                contents = None
+        else:
+            contents = None
+        if contents is None:
+            index = BinaryIndex(bin_loc, bin_flat)
+            index.scan()
+            if index_file is not None:
+                saved['version'] = BINARY_INDEX_VERSION
+                saved.setdefault('indexes', {})[bin_loc] = index.to_dict()
+                index_temp = index_file + '.tmp'
+                with open(index_temp, 'w') as index_fp:
+                    json.dump(saved, index_fp)
+                os.replace(index_temp, index_file)
+
+        _binary_indexes[(bin_loc, bin_flat)] = index
+        _binary_indexes[(bin_loc, index.bin_flat)] = index
+        return index
+
+
+def get_inventory(ioc_top):
+    """
+    Function that returns the up to date inventory of the IOCs in an IOC directory.
+    The inventory is saved in the directory, so only IOCs that changed since the last run are parsed.
+    Parameters
+    ----------
+    ioc_top : str
+        Path to the top directory containing generated IOCs
+
+    Returns
+    -------
+    Inventory
+        the inventory of the directory
+    """
+
+    with _cache_lock:
+        inventory = _inventories.get(ioc_top)
+        inventory_path = ioc_top + '/' + INVENTORY_FILE
+        if inventory is None:
+            inventory = Inventory(ioc_top)
+            if os.path.exists(inventory_path):
+                try:
+                    with open(inventory_path, 'r') as inventory_fp:
+                        inventory.from_dict(json.load(inventory_fp))
+                except (OSError, ValueError):
+                    initIOC_print('WARNING - Could not read inventory {}, rebuilding it.'.format(inventory_path))
+            _inventories[ioc_top] = inventory
+        if inventory.update() and os.path.isdir(ioc_top):
+            try:
+                write_file_atomic(inventory_path, json.dumps(inventory.to_dict()))
+            except OSError as err:
+                initIOC_print('WARNING - Could not save inventory {}: {}'.format(inventory_path, err))
+        return inventory
+
+
+def get_driver_registry(template, bin_loc=None, bin_flat=None):
+    """
+    Function that returns the driver registry for a template and binary distribution, building it at most once per run
+    Parameters
+    ----------
+    template : TemplateCache
+        local template cache, prepared if needed
+    bin_loc : str
+        optional path to top level of binary distribution, used to discover drivers and their binaries
+    bin_flat : bool
+        flag for deciding if binaries are flat or stacked. If None, it is detected
+
+    Returns
+    -------
+    DriverRegistry
+        the driver registry, or None if the template is not available
+    """
+
+    if template is None or template.prepare() != 0:
+        return None
+    with _cache_lock:
+        key = (template.snapshot, bin_loc, bin_flat)
+        if key not in _driver_registries:
+            binary_index = None
+            if bin_loc is not None:
+                binary_index = get_binary_index(bin_loc, bin_flat)
+            registry = DriverRegistry(template.snapshot, binary_index)
+            registry.scan()
+            _driver_registries[key] = registry
+        return _driver_registries[key]
+
+
+def get_support_lib_dirs(bin_loc, bin_flat, arch):
+    """
+    Function that finds the library directories of base and all support modules, scanning the distribution at most once per run.
+    Only modules that actually contain a lib/<arch> directory are included.
+    Parameters
+    ----------
+    bin_loc : str
+        path to top level of binary distribution
+    bin_flat : bool
+        flag for deciding if binaries are flat or stacked
+    arch : str
+        EPICS architecture of the libraries
+
+    Returns
+    -------
+    lib_dirs : list of str
+        library directories, base first followed by support modules in sorted order
+    """
+
+    with _cache_lock:
+        if (bin_loc, bin_flat, arch) not in _support_lib_dirs:
+            support_dir = bin_loc
+            if not bin_flat:
+                support_dir = bin_loc + '/support'
+            lib_dirs = []
+            if os.path.isdir(bin_loc + '/base/lib/' + arch):
+                lib_dirs.append(bin_loc + '/base/lib/' + arch)
+            try:
+                with os.scandir(support_dir) as scanner:
+                    modules = sorted([entry.name for entry in scanner if entry.is_dir()])
+            except (FileNotFoundError, NotADirectoryError):
+                modules = []
+            for module in modules:
+                if module not in excluded_support_modules and os.path.isdir(support_dir + '/' + module + '/lib/' + arch):
+                    lib_dirs.append(support_dir + '/' + module + '/lib/' + arch)
+            _support_lib_dirs[(bin_loc, bin_flat, arch)] = tuple(lib_dirs)
+        return list(_support_lib_dirs[(bin_loc, bin_flat, arch)])
+
+
+def invalidate_binary_caches(bin_loc):
+    """
+    Function that drops the binary indexes of a distribution and everything derived from them: the driver registries
+    using them, its support library directories, and the library maps and resolved libraries of its directories
+    Parameters
+    ----------
+    bin_loc : str
+        path to top level of binary distribution
+    """
+
+    prefix = bin_loc.rstrip('/') + '/'
+    with _cache_lock:
+        for key in [key for key in _binary_indexes if key[0] == bin_loc]:
+            del _binary_indexes[key]
+        for key in [key for key in _driver_registries if key[1] == bin_loc]:
+            del _driver_registries[key]
+        for key in [key for key in _support_lib_dirs if key[0] == bin_loc]:
+            del _support_lib_dirs[key]
+        for key in [key for key in _lib_maps if any([lib_dir.startswith(prefix) for lib_dir in key])]:
+            del _lib_maps[key]
+        for key in [key for key in _required_lib_dirs if key[0].startswith(prefix) or any([lib_dir.startswith(prefix) for lib_dir in key[1]])]:
+            del _required_lib_dirs[key]
+
+
+def get_stale_binary_dirs():
+    """ Function that returns the binary distributions whose index changed on disk since it was built """
+
+    with _cache_lock:
+        return sorted(set([bin_loc for (bin_loc, bin_flat), index in _binary_indexes.items() if index.is_stale()]))
+
+
+def reset_caches():
+    """ Function that drops the binary indexes, driver registries, inventories and library directories cached during this run """
+
+    with _cache_lock:
+        _binary_indexes.clear()
+        _inventories.clear()
+        _driver_registries.clear()
+        _support_lib_dirs.clear()
+        _lib_maps.clear()
+        _required_lib_dirs.clear()
+
+
+def get_required_lib_dirs(binary_path, lib_dirs):
+    """
+    Function that resolves the shared libraries needed by an executable, transitively, against a set of library directories
+    Parameters
+    ----------
+    binary_path : str
+        path to the IOC executable
+    lib_dirs : list of str
+        library directories of the binary distribution, in search order
+
+    Returns
+    -------
+    required : list of str
+        library directories that provide at least one needed library, in resolution order
+    missing : list of str
+        needed libraries found neither in lib_dirs, the executable's runpath nor the system library directories
+    """
+
+    with _cache_lock:
+        if tuple(lib_dirs) not in _lib_maps:
+            lib_map = {}
+            for lib_dir in lib_dirs:
+                try:
+                    with os.scandir(lib_dir) as scanner:
+                        for entry in scanner:
+                            if entry.name not in lib_map and '.so' in entry.name:
+                                lib_map[entry.name] = lib_dir
+                except OSError:
+                    pass
+            _lib_maps[tuple(lib_dirs)] = lib_map
+        lib_map = _lib_maps[tuple(lib_dirs)]
+        if (binary_path, tuple(lib_dirs)) in _required_lib_dirs:
+            required, missing = _required_lib_dirs[(binary_path, tuple(lib_dirs))]
+            return list(required), list(missing)
+
+    required = []
+    missing = []
+    resolved = set()
+    queue = collections.deque([binary_path])
+    while len(queue) > 0:
+        dynamic = read_elf_dynamic(queue.popleft())
+        if dynamic is None:
+            continue
+        needed, search_path = dynamic
+        for library in needed:
+            if library in resolved:
+                continue
+            resolved.add(library)
+            if library in lib_map:
+                if lib_map[library] not in required:
+                    required.append(lib_map[library])
+                queue.append(lib_map[library] + '/' + library)
+            elif not any([os.path.exists(lib_dir + '/' + library) for lib_dir in search_path + system_lib_dirs]):
+                missing.append(library)
+
+    with _cache_lock:
+        _required_lib_dirs[(binary_path, tuple(lib_dirs))] = (tuple(required), tuple(missing))
+    return required, missing
+
+
+def detect_bin_flat(bin_loc):
+    """
+    Function that checks if a binary distribution is flat or stacked
+    Parameters
+    ----------
+    bin_loc : str
+        path to top level of binary distribution
+
+    Returns
+    -------
+    bool
+        False if the binaries contain a support directory, True otherwise
+    """
+
+    return get_binary_index(bin_loc).bin_flat
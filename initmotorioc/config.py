@@ -0,0 +1,92 @@
+"""
+Settings shared by every part of initMotorIOCs: configuration keys, defaults and the setup stages of an IOC.
+"""
+
+
+# version number
+version = "v0.0.1"
+
+# Bash shebang length limit is 127 characters, so we need to make sure we account for that
+KERNEL_PATH_LIMIT = 127
+
+# Drivers known to work. Others are discovered by the driver registry, from the binary distribution and template
+supported_drivers = [
+    'motorNewFocus',
+    'motorMotorSim'
+]
+
+# Keys shared by all IOCs generated in a single run
+configuration_keys = [
+    'IOC_DIR',
+    'TOP_BINARY_DIR',
+    'HOSTNAME',
+    'ENGINEER',
+    'CA_ADDRESS'
+]
+
+# Optional configuration keys, with their default values
+optional_configuration_keys = {
+    'MINIMAL_LDPATH'        : 'NO',
+    'INCREMENTAL'           : 'NO',
+    'PROFILE_IOC'           : '',
+    'ARCHIVE_DIR'           : '',
+    'STAGING_DIR'           : '',
+    'INSTALL_BOOT_SCRIPT'   : 'NO'
+}
+
+# Per IOC fields, matching the positional MotorIOCAction constructor arguments
+action_fields = [
+    'ioc_type',
+    'ioc_name',
+    'ioc_prefix',
+    'ioc_port',
+    'connection',
+    'ioc_num'
+]
+
+# Default number of IOCs generated in parallel in batch mode
+DEFAULT_WORKERS = 4
+
+# Default number of IOCs allowed in each stage at the same time in the asyncio pipeline
+DEFAULT_STAGE_LIMITS = {
+    'lookup'    : 8,
+    'fetch'     : 4,
+    'render'    : 8,
+    'cleanup'   : 4
+}
+
+# File in each generated IOC recording the inputs it was generated from, used for incremental regeneration
+STATE_FILE = '.initMotorIOCs.json'
+
+# Version of the IOC state file format, bumped when the layout changes
+STATE_VERSION = 1
+
+# Setup stages that render generated files, with the template files they read and the files they write
+setup_stages = [
+    ('st_cmd',          ['startupScripts'],                     ['st.cmd', 'st_base.cmd']),
+    ('autosave',        ['autosaveFiles', 'dependancyFiles'],   ['auto_settings.req']),
+    ('unique',          ['unique.cmd'],                         ['unique.cmd']),
+    ('config',          ['config'],                             ['config']),
+    ('env_paths',       ['envPaths'],                           ['envPaths']),
+    ('path_scripts',    [],                                     ['ldpath.sh', 'dllPath.bat'])
+]
+
+# All stages an IOC goes through, in execution order, as reported in the event log
+pipeline_stages = ['lookup', 'fetch'] + [stage for stage, sources, generated in setup_stages] + ['cleanup', 'state', 'publish', 'archive']
+
+
+def is_enabled(value):
+    """
+    Function that interprets a configuration value as a boolean toggle
+    Parameters
+    ----------
+    value : str
+        configuration value, ex. YES or NO
+
+    Returns
+    -------
+    bool
+        True if the value turns the option on
+    """
+
+    return str(value).strip().upper() in ['YES', 'Y', 'TRUE', 'ON', '1']
@@ -0,0 +1,118 @@
+"""
+Reading the shared library dependencies of IOC executables from their ELF dynamic section.
+"""
+
+# imports
+import os
+import struct
+
+
+# ELF program header and dynamic section tags needed to read shared library dependencies
+PT_LOAD     = 1
+PT_DYNAMIC  = 2
+DT_NULL     = 0
+DT_NEEDED   = 1
+DT_STRTAB   = 5
+DT_RPATH    = 15
+DT_RUNPATH  = 29
+
+# Directories searched by the dynamic loader for libraries that are not part of the binary distribution
+system_lib_dirs = [
+    '/lib64',
+    '/usr/lib64',
+    '/lib',
+    '/usr/lib',
+    '/lib/x86_64-linux-gnu',
+    '/usr/lib/x86_64-linux-gnu'
+]
+
+
+def read_elf_dynamic(file_path):
+    """
+    Function that reads the shared library dependencies of an ELF executable or library
+    Parameters
+    ----------
+    file_path : str
+        path to the ELF file
+
+    Returns
+    -------
+    needed : list of str
+        DT_NEEDED library names, in the order they are listed
+    search_path : list of str
+        DT_RUNPATH, or DT_RPATH if there is no runpath, directories with $ORIGIN expanded
+
+    Returns None if the file is not a dynamically linked ELF file
+    """
+
+    try:
+        elf_fp = open(file_path, 'rb')
+    except OSError:
+        return None
+    with elf_fp:
+        ident = elf_fp.read(16)
+        if len(ident) < 16 or ident[:4] != b'\x7fELF' or ident[4] not in [1, 2] or ident[5] not in [1, 2]:
+            return None
+        endian = '<' if ident[5] == 1 else '>'
+        if ident[4] == 2:
+            header_format, phdr_format, dyn_format = 'HHIQQQIHHHHHH', 'IIQQQQQQ', 'qQ'
+        else:
+            header_format, phdr_format, dyn_format = 'HHIIIIIHHHHHH', 'IIIIIIII', 'iI'
+        header = struct.unpack(endian + header_format, elf_fp.read(struct.calcsize(endian + header_format)))
+        phoff, phentsize, phnum = header[4], header[8], header[9]
+
+        loads = []
+        dynamic = None
+        for i in range(phnum):
+            elf_fp.seek(phoff + i * phentsize)
+            phdr = struct.unpack(endian + phdr_format, elf_fp.read(struct.calcsize(endian + phdr_format)))
+            if ident[4] == 2:
+                p_type, p_offset, p_vaddr, p_filesz = phdr[0], phdr[2], phdr[3], phdr[5]
+            else:
+                p_type, p_offset, p_vaddr, p_filesz = phdr[0], phdr[1], phdr[2], phdr[4]
+            if p_type == PT_LOAD:
+                loads.append((p_vaddr, p_offset, p_filesz))
+            elif p_type == PT_DYNAMIC:
+                dynamic = (p_offset, p_filesz)
+        if dynamic is None:
+            return None
+
+        entries = []
+        dyn_size = struct.calcsize(endian + dyn_format)
+        elf_fp.seek(dynamic[0])
+        for i in range(dynamic[1] // dyn_size):
+            tag, value = struct.unpack(endian + dyn_format, elf_fp.read(dyn_size))
+            if tag == DT_NULL:
+                break
+            entries.append((tag, value))
+
+        strtab = None
+        for tag, value in entries:
+            if tag == DT_STRTAB:
+                for vaddr, offset, filesz in loads:
+                    if vaddr <= value < vaddr + filesz:
+                        strtab = value - vaddr + offset
+        if strtab is None:
+            return None
+
+        def read_string(str_offset):
+            elf_fp.seek(strtab + str_offset)
+            data = b''
+            while b'\0' not in data:
+                chunk = elf_fp.read(256)
+                if not chunk:
+                    break
+                data = data + chunk
+            return data.split(b'\0', 1)[0].decode(errors='replace')
+
+        needed = [read_string(value) for tag, value in entries if tag == DT_NEEDED]
+        runpath = [read_string(value) for tag, value in entries if tag == DT_RUNPATH]
+        if len(runpath) == 0:
+            runpath = [read_string(value) for tag, value in entries if tag == DT_RPATH]
+        origin = os.path.dirname(os.path.abspath(file_path))
+        search_path = []
+        for path in runpath:
+            for path_dir in path.split(':'):
+                if path_dir != '':
+                    search_path.append(path_dir.replace('${ORIGIN}', origin).replace('$ORIGIN', origin))
+        return needed, search_path
@@ -0,0 +1,257 @@
+"""
+Printing, and timing of the stages each IOC goes through, recorded as events.
+"""
+
+# imports
+import time
+import contextlib
+import contextvars
+import threading
+import json
+
+from .config import pipeline_stages
+
+
+# Event currently being recorded by the running stage, and lock keeping printed lines whole
+_current_event = contextvars.ContextVar('_current_event', default=None)
+_print_lock = threading.Lock()
+
+# Log lines and events of the generator server request being handled, if any
+_request_capture = contextvars.ContextVar('_request_capture', default=None)
+
+
+class EventLog:
+
+
+    def __init__(self, log_path=None, keep_events=True):
+        """
+        Constructor for the EventLog class
+        Parameters
+        ----------
+        log_path : str
+            optional JSON lines file to which every stage event is appended
+        keep_events : bool
+            if False, events are not kept in memory, ex. for a long running generator server
+        """
+
+        self.log_path   = log_path
+        self.keep_events = keep_events
+        self.events     = []
+        self.lock       = threading.Lock()
+        self.log_fp     = None
+        if log_path is not None:
+            self.log_fp = open(log_path, 'a')
+
+
+    def record(self, event):
+        """
+        Function that stores a finished stage event, and appends it to the log file
+        Parameters
+        ----------
+        event : dict
+            event as created by stage_event
+        """
+
+        capture = _request_capture.get()
+        if capture is not None:
+            capture['events'].append(event)
+        with self.lock:
+            if self.keep_events:
+                self.events.append(event)
+            if self.log_fp is not None:
+                self.log_fp.write(json.dumps(event) + '\n')
+                self.log_fp.flush()
+
+
+    def close(self):
+        """ Function that closes the log file """
+
+        with self.lock:
+            if self.log_fp is not None:
+                self.log_fp.close()
+                self.log_fp = None
+
+
+# Event log of the current run, replaced by set_event_log
+_event_log = EventLog()
+_event_log_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def stage_event(ioc_name, stage):
+    """
+    Context manager that times a stage of an IOC, and records it in the event log once finished.
+    Writes, removed files and subprocess exit codes reported while the stage runs are added to its event.
+    Parameters
+    ----------
+    ioc_name : str
+        name of the IOC
+    stage : str
+        name of the stage, one of pipeline_stages
+
+    Yields
+    ------
+    event : dict
+        the event being recorded
+    """
+
+    event = {
+        'ioc'           : ioc_name,
+        'stage'         : stage,
+        'start'         : time.time(),
+        'end'           : None,
+        'duration_s'    : None,
+        'bytes_written' : 0,
+        'files_touched' : 0,
+        'exit_codes'    : [],
+        'status'        : 'ok'
+    }
+    token = _current_event.set(event)
+    start = time.perf_counter()
+    try:
+        yield event
+    except BaseException as err:
+        event['status'] = 'error'
+        event['error'] = '{}: {}'.format(type(err).__name__, err)
+        raise
+    finally:
+        event['duration_s'] = time.perf_counter() - start
+        event['end'] = time.time()
+        _current_event.reset(token)
+        get_event_log().record(event)
+
+
+def record_write(file_path, num_bytes):
+    """
+    Function that adds a written, moved or removed file to the event of the running stage
+    Parameters
+    ----------
+    file_path : str
+        path to the file
+    num_bytes : int
+        number of bytes written
+    """
+
+    event = _current_event.get()
+    if event is not None:
+        event['bytes_written'] += num_bytes
+        event['files_touched'] += 1
+
+
+def record_exit_code(command, exit_code):
+    """
+    Function that adds a subprocess exit code to the event of the running stage
+    Parameters
+    ----------
+    command : list of str
+        command that was run
+    exit_code : int
+        its exit code
+    """
+
+    event = _current_event.get()
+    if event is not None:
+        event['exit_codes'].append({'command' : ' '.join(command), 'exit_code' : exit_code})
+
+
+def fail_event(message):
+    """
+    Function that marks the running stage as failed without raising an exception
+    Parameters
+    ----------
+    message : str
+        reason for the failure
+    """
+
+    event = _current_event.get()
+    if event is not None:
+        event['status'] = 'failed'
+        event['error'] = message
+
+
+def set_event_log(log_path=None, keep_events=True):
+    """
+    Function that starts a new event log for the run, closing the previous one
+    Parameters
+    ----------
+    log_path : str
+        optional JSON lines file to which stage events are appended
+    keep_events : bool
+        if False, events are not kept in memory
+
+    Returns
+    -------
+    EventLog
+        the new event log
+    """
+
+    global _event_log
+    with _event_log_lock:
+        _event_log.close()
+        _event_log = EventLog(log_path, keep_events)
+        return _event_log
+
+
+def get_event_log():
+    """ Function that returns the event log of the current run """
+
+    with _event_log_lock:
+        return _event_log
+
+
+@contextlib.contextmanager
+def capture_request():
+    """
+    Context manager that collects the log lines and stage events of a generator server request
+
+    Yields
+    ------
+    capture : dict
+        'log' lines and 'events' recorded so far
+    """
+
+    capture = {'log' : [], 'events' : []}
+    token = _request_capture.set(capture)
+    try:
+        yield capture
+    finally:
+        _request_capture.reset(token)
+
+
+def print_stage_summary(events):
+    """
+    Function that prints the time spent in each stage, aggregated over all IOCs of the run
+    Parameters
+    ----------
+    events : list of dict
+        events recorded by stage_event
+    """
+
+    if len(events) == 0:
+        return
+    stages = [stage for stage in pipeline_stages if stage in [event['stage'] for event in events]]
+    initIOC_print('')
+    initIOC_print('Time per stage:')
+    initIOC_print('{:<14}{:>6}{:>12}{:>12}{:>12}{:>8}{:>12}{:>8}'.format('stage', 'iocs', 'total s', 'mean ms', 'max ms', 'files', 'bytes', 'failed'))
+    total = 0.0
+    for stage in stages:
+        stage_events = [event for event in events if event['stage'] == stage]
+        durations = [event['duration_s'] for event in stage_events]
+        total = total + sum(durations)
+        initIOC_print('{:<14}{:>6}{:>12.3f}{:>12.2f}{:>12.2f}{:>8}{:>12}{:>8}'.format(stage, len(stage_events), sum(durations),
+                      1000 * sum(durations) / len(durations), 1000 * max(durations),
+                      sum([event['files_touched'] for event in stage_events]), sum([event['bytes_written'] for event in stage_events]),
+                      len([event for event in stage_events if event['status'] != 'ok'])))
+    initIOC_print('{:<14}{:>6}{:>12.3f}'.format('all stages', len(set([event['ioc'] for event in events])), total))
+
+
+def initIOC_print(text):
+    """
+    A wrapper function for 'print' that allows for printing to CLI or to log
+    """
+
+    capture = _request_capture.get()
+    if capture is not None:
+        capture['log'].append(text)
+    with _print_lock:
+        print(text)
@@ -0,0 +1,543 @@
+"""
+File helpers: atomic writes, hashing, macro substitution, and the disk and in memory trees IOCs are built in.
+"""
+
+# imports
+import os
+import re
+import time
+import io
+import contextlib
+import shutil
+import tempfile
+import hashlib
+import json
+import glob
+import fnmatch
+
+from .events import record_write
+
+# fcntl is only available on unix, where it is used to make reflinks
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Dependency files are substituted in chunks of this many characters, so memory use does not grow with file size
+MACRO_CHUNK_SIZE = 1 << 16
+
+# ioctl cloning a file on copy-on-write filesystems (btrfs, xfs), from linux/fs.h
+FICLONE = 0x40049409
+
+
+class DiskTree:
+
+
+    def exists(self, path):
+        """ Function that checks if a file or directory exists """
+
+        return os.path.exists(path)
+
+
+    def listdir(self, path):
+        """ Function that lists the names in a directory """
+
+        return os.listdir(path)
+
+
+    def open_read(self, path, newline=None):
+        """ Function that opens a file for reading text """
+
+        return open(path, 'r', newline=newline)
+
+
+    def open_write(self, path, mode=None):
+        """ Function that opens a file for writing bytes, replacing it atomically once closed, see open_atomic """
+
+        return open_atomic(path, mode)
+
+
+    def write(self, path, contents, mode=None):
+        """ Function that atomically replaces the contents of a file, see write_file_atomic """
+
+        return write_file_atomic(path, contents, mode)
+
+
+    def rename(self, src, dst):
+        """ Function that moves a file or directory """
+
+        os.rename(src, dst)
+        record_write(dst, 0)
+
+
+    def chmod(self, path, mode):
+        """ Function that changes the permission bits of a file """
+
+        os.chmod(path, mode)
+
+
+    def remove_matching(self, path, patterns):
+        """ Function that removes everything under a directory matching cleanup patterns, see remove_cleanup_paths """
+
+        remove_cleanup_paths(path, patterns)
+
+
+    def copytree(self, src, dst, ignore):
+        """
+        Function that copies a directory tree into a new directory
+        Parameters
+        ----------
+        src : str
+            directory to copy
+        dst : str
+            directory to create. Must not exist yet
+        ignore : callable
+            called with each directory and its entry names, returns the names not to copy, as for shutil.copytree
+        """
+
+        def copy(src, dst):
+            shutil.copy2(src, dst)
+            record_write(dst, os.path.getsize(dst))
+
+        shutil.copytree(src, dst, ignore=ignore, copy_function=copy)
+
+
+# IOCs are written directly to disk unless given another tree
+disk_tree = DiskTree()
+
+
+class MemoryTree:
+
+
+    def __init__(self, root):
+        """
+        Constructor for the MemoryTree class, an in memory stand in for an IOC directory
+        Parameters
+        ----------
+        root : str
+            path of the IOC directory the tree stands in for. All paths given to the tree must be under it
+        """
+
+        self.root   = root
+        self.files  = {}
+
+
+    def relpath(self, path):
+        """ Function that converts a path under the root to the key of the files dictionary """
+
+        if path == self.root:
+            return ''
+        if not path.startswith(self.root + '/'):
+            raise ValueError('{} is outside of {}'.format(path, self.root))
+        return path[len(self.root) + 1:]
+
+
+    def exists(self, path):
+        """ Function that checks if a file or directory exists """
+
+        relpath = self.relpath(path)
+        prefix = relpath + '/' if relpath != '' else ''
+        return relpath in self.files or any([name.startswith(prefix) for name in self.files])
+
+
+    def listdir(self, path):
+        """ Function that lists the names in a directory """
+
+        relpath = self.relpath(path)
+        prefix = relpath + '/' if relpath != '' else ''
+        names = set([name[len(prefix):].split('/')[0] for name in self.files if name.startswith(prefix)])
+        if len(names) == 0:
+            raise FileNotFoundError(path)
+        return sorted(names)
+
+
+    def open_read(self, path, newline=None):
+        """ Function that opens a file for reading text """
+
+        relpath = self.relpath(path)
+        if relpath not in self.files:
+            raise FileNotFoundError(path)
+        return io.StringIO(self.files[relpath][0].decode(), newline=newline)
+
+
+    @contextlib.contextmanager
+    def open_write(self, path, mode=None):
+        """ Context manager that yields a byte buffer that becomes the file once closed without error """
+
+        relpath = self.relpath(path)
+        if mode is None:
+            mode = self.files[relpath][1] if relpath in self.files else 0o644
+        buffer = io.BytesIO()
+        yield buffer
+        self.files[relpath] = [buffer.getvalue(), mode]
+        record_write(path, len(self.files[relpath][0]))
+
+
+    def write(self, path, contents, mode=None):
+        """ Function that replaces the contents of a file """
+
+        data = contents.encode()
+        with self.open_write(path, mode) as file_fp:
+            file_fp.write(data)
+        return len(data)
+
+
+    def rename(self, src, dst):
+        """ Function that moves a file or directory """
+
+        src_relpath, dst_relpath = self.relpath(src), self.relpath(dst)
+        for name in list(self.files.keys()):
+            if name == src_relpath:
+                self.files[dst_relpath] = self.files.pop(name)
+            elif name.startswith(src_relpath + '/'):
+                self.files[dst_relpath + name[len(src_relpath):]] = self.files.pop(name)
+        record_write(dst, 0)
+
+
+    def chmod(self, path, mode):
+        """ Function that changes the permission bits of a file """
+
+        self.files[self.relpath(path)][1] = mode
+
+
+    def remove_matching(self, path, patterns):
+        """ Function that removes everything under a directory matching cleanup patterns, see remove_cleanup_paths """
+
+        relpath = self.relpath(path)
+        prefix = relpath + '/' if relpath != '' else ''
+        for name in list(self.files.keys()):
+            if not name.startswith(prefix):
+                continue
+            parts = name[len(prefix):].split('/')
+            # a file is removed if it, or any directory containing it, matches
+            if any([match_cleanup_pattern('/'.join(parts[:i]), pattern) for pattern in patterns for i in range(1, len(parts) + 1)]):
+                del self.files[name]
+                record_write(self.root + '/' + name, 0)
+
+
+    def copytree(self, src, dst, ignore):
+        """
+        Function that reads a directory tree into memory
+        Parameters
+        ----------
+        src : str
+            directory to copy
+        dst : str
+            path of the copy, under the root
+        ignore : callable
+            called with each directory and its entry names, returns the names not to copy, as for shutil.copytree
+        """
+
+        dst_relpath = self.relpath(dst)
+        for directory, dirnames, filenames in os.walk(src):
+            ignored = set(ignore(directory, dirnames + filenames))
+            dirnames[:] = [name for name in dirnames if name not in ignored]
+            rel_dir = os.path.relpath(directory, src).replace(os.sep, '/')
+            for name in filenames:
+                if name in ignored:
+                    continue
+                relpath = '/'.join([part for part in [dst_relpath, rel_dir, name] if part not in ['', '.']])
+                with open(directory + '/' + name, 'rb') as file_fp:
+                    data = file_fp.read()
+                self.files[relpath] = [data, os.stat(directory + '/' + name).st_mode & 0o7777]
+                record_write(self.root + '/' + relpath, len(data))
+
+
+    def write_archive(self, tar, arcname):
+        """
+        Function that adds the tree to an open tar file, with the permission bits of each file
+        Parameters
+        ----------
+        tar : tarfile.TarFile
+            archive opened for writing
+        arcname : str
+            name of the top directory in the archive
+        """
+
+        import tarfile
+
+        mtime = time.time()
+        directories = set([''])
+        for name in self.files:
+            parts = name.split('/')
+            directories.update(['/'.join(parts[:i]) for i in range(1, len(parts))])
+        for directory in sorted(directories):
+            info = tarfile.TarInfo('/'.join([part for part in [arcname, directory] if part != '']))
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            info.mtime = mtime
+            tar.addfile(info)
+        for name in sorted(self.files.keys()):
+            data, mode = self.files[name]
+            info = tarfile.TarInfo(arcname + '/' + name)
+            info.size = len(data)
+            info.mode = mode
+            info.mtime = mtime
+            tar.addfile(info, io.BytesIO(data))
+
+
+def match_cleanup_pattern(relpath, pattern):
+    """
+    Function that checks if a path relative to the IOC directory matches a cleanup pattern, one path component at a time
+    Parameters
+    ----------
+    relpath : str
+        '/' separated path relative to the IOC directory
+    pattern : str
+        '/' separated cleanup path or glob
+
+    Returns
+    -------
+    bool
+        True if the path matches the pattern
+    """
+
+    path_parts = relpath.split('/')
+    pattern_parts = pattern.split('/')
+    if len(path_parts) != len(pattern_parts):
+        return False
+    return all([fnmatch.fnmatchcase(path_part, pattern_part) for path_part, pattern_part in zip(path_parts, pattern_parts)])
+
+
+def remove_cleanup_paths(ioc_path, patterns):
+    """
+    Function that removes all files and directories of an IOC matching a list of cleanup patterns
+    Parameters
+    ----------
+    ioc_path : str
+        path to the IOC directory
+    patterns : list of str
+        paths and globs relative to the IOC directory
+    """
+
+    for pattern in patterns:
+        for path in glob.glob(os.path.join(glob.escape(ioc_path), pattern)):
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            record_write(path, 0)
+
+
+def hash_inputs(inputs):
+    """
+    Function that computes a stable hash of json serializable inputs
+    Parameters
+    ----------
+    inputs : object
+        list or dict of inputs
+
+    Returns
+    -------
+    str
+        sha256 hex digest
+    """
+
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def hash_file(file_path):
+    """
+    Function that computes the sha256 hash of a file's contents
+    Parameters
+    ----------
+    file_path : str
+        path to the file
+
+    Returns
+    -------
+    str
+        sha256 hex digest
+    """
+
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file_fp:
+        for chunk in iter(lambda: file_fp.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def open_atomic(file_path, mode=None):
+    """
+    Context manager that opens a temporary binary file in the same directory as the target,
+    and moves it into place with os.replace once closed. The target is left untouched on error.
+    Parameters
+    ----------
+    file_path : str
+        path to the target file
+    mode : int
+        permission bits for the file. If None, those of the existing file are kept, or 0o644 for a new file
+
+    Yields
+    ------
+    file_fp : file object
+        temporary file to write the new contents to
+    """
+
+    if mode is None:
+        try:
+            mode = os.stat(file_path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o644
+    file_dir, file_name = os.path.split(file_path)
+    temp_fd, temp_path = tempfile.mkstemp(dir=file_dir or '.', prefix='.' + file_name + '.')
+    try:
+        with os.fdopen(temp_fd, 'wb') as temp_fp:
+            yield temp_fp
+            num_bytes = temp_fp.tell()
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    record_write(file_path, num_bytes)
+
+
+def reflink_file(src, dst):
+    """
+    Function that creates a copy-on-write clone of a file, sharing its data blocks until either copy is modified
+    Parameters
+    ----------
+    src : str
+        file to clone
+    dst : str
+        path of the clone. Must not exist yet
+
+    Raises
+    ------
+    OSError
+        if the filesystem does not support reflinks
+    """
+
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this platform')
+    with open(src, 'rb') as src_fp, open(dst, 'xb') as dst_fp:
+        try:
+            fcntl.ioctl(dst_fp.fileno(), FICLONE, src_fp.fileno())
+        except OSError:
+            dst_fp.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def write_file_atomic(file_path, contents, mode=None):
+    """
+    Function that writes a file through a temporary file in the same directory, and moves it into place with os.replace
+    Parameters
+    ----------
+    file_path : str
+        path to the target file
+    contents : str
+        new contents of the file
+    mode : int
+        permission bits for the file. If None, those of the existing file are kept, or 0o644 for a new file
+
+    Returns
+    -------
+    int
+        number of bytes written
+    """
+
+    data = contents.encode()
+    with open_atomic(file_path, mode) as file_fp:
+        file_fp.write(data)
+    return len(data)
+
+
+def substitute_macros(file_path, macros, chunk_size=MACRO_CHUNK_SIZE, tree=disk_tree):
+    """
+    Function that replaces $(NAME) and ${NAME} macros in a file in a single pass, streaming it in chunks.
+    Macros not in the map are left as is.
+    Parameters
+    ----------
+    file_path : str
+        path to the target file, replaced atomically
+    macros : dict of str to str
+        macro values keyed by macro name
+    chunk_size : int
+        number of characters read at a time
+    tree : DiskTree or MemoryTree
+        tree containing the file
+
+    Returns
+    -------
+    int
+        number of macros replaced
+    """
+
+    if len(macros) == 0:
+        return 0
+    names = '|'.join([re.escape(name) for name in sorted(macros.keys(), key=len, reverse=True)])
+    pattern = re.compile(r'\$(?:\((?P<paren>' + names + r')\)|\{(?P<brace>' + names + r')\})')
+    # A macro starting in the last hold characters may not have been read completely
+    hold = max([len(name) for name in macros.keys()]) + 2
+
+    def replace(match):
+        return macros[match.group('paren') or match.group('brace')]
+
+    replaced = 0
+    with tree.open_read(file_path, newline='') as file_fp, tree.open_write(file_path) as out_fp:
+        pending = ''
+        chunk = file_fp.read(chunk_size)
+        while chunk:
+            pending = pending + chunk
+            chunk = file_fp.read(chunk_size)
+            safe = len(pending) if not chunk else max(len(pending) - hold, 0)
+            pieces = []
+            end = 0
+            for match in pattern.finditer(pending):
+                if match.start() >= safe:
+                    break
+                pieces.append(pending[end:match.start()])
+                pieces.append(replace(match))
+                end = match.end()
+                replaced = replaced + 1
+            pieces.append(pending[end:max(end, safe)])
+            out_fp.write(''.join(pieces).encode())
+            pending = pending[max(end, safe):]
+    return replaced
+
+
+def rewrite_file(file_path, key_pattern, rules, tree=disk_tree):
+    """
+    Function that replaces the lines of a file whose key, the 'key' group of key_pattern, has a rewrite rule
+    Parameters
+    ----------
+    file_path : str
+        path to the target file
+    key_pattern : re.Pattern
+        compiled pattern capturing the key of a line, ex. EPICS_ENV_SET_KEY or CONFIG_KEY
+    rules : dict of str to str
+        replacement line for each key, without line ending
+    tree : DiskTree or MemoryTree
+        tree containing the file
+
+    Returns
+    -------
+    applied : set of str
+        keys for which at least one line was replaced
+    """
+
+    with tree.open_read(file_path) as file_fp:
+        lines = file_fp.readlines()
+    applied = set()
+    for i, line in enumerate(lines):
+        match = key_pattern.match(line)
+        if match is not None and match.group('key') in rules:
+            applied.add(match.group('key'))
+            lines[i] = rules[match.group('key')] + '\n'
+    tree.write(file_path, ''.join(lines))
+    return applied
+
+
+def link_or_copy(src, dst):
+    """ Function that hard links a file, or copies it if linking is not possible, ex. across filesystems """
+
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
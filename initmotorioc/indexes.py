@@ -0,0 +1,435 @@
+"""
+Indexes of binary distributions, IOC templates and existing IOCs.
+"""
+
+# imports
+import os
+import re
+from sys import platform
+
+from .config import supported_drivers
+
+
+# Settings read back from existing IOCs: the key and value of an epicsEnvSet line, or of a KEY=VALUE line
+EPICS_ENV_SET_VALUE = re.compile(r'^\s*epicsEnvSet\(\s*"(?P<key>[^"]+)"\s*,\s*"(?P<value>[^"]*)"')
+CONFIG_VALUE = re.compile(r'^\s*(?P<key>[A-Za-z_][A-Za-z0-9_]*)\s*=\s*(?P<value>.*?)\s*$')
+
+# Any macro referenced in a template file, ex. $(PREFIX) or ${PORT}
+MACRO_REFERENCE = re.compile(r'\$[({](?P<key>[A-Za-z_][A-Za-z0-9_]*)[)}]')
+
+# Version of the inventory file format, bumped when its layout changes
+INVENTORY_VERSION = 1
+
+
+class BinaryIndex:
+
+
+    def __init__(self, bin_loc, bin_flat=None):
+        """
+        Constructor for the BinaryIndex class
+        Parameters
+        ----------
+        bin_loc : str
+            path to top level of binary distribution
+        bin_flat : bool
+            flag for deciding if binaries are flat or stacked. If None, detected when scanning
+        """
+
+        self.bin_loc    = bin_loc
+        self.bin_flat   = bin_flat
+        self.drivers    = {}
+        self.mtimes     = {}
+
+
+    def scan(self):
+        """
+        Function that indexes driver IOC executables in a single pass over the binary distribution,
+        recording the modification time of every directory visited
+        """
+
+        self.drivers = {}
+        self.mtimes = {}
+        top_entries = self.scan_dir(self.bin_loc)
+        if self.bin_flat is None:
+            self.bin_flat = 'support' not in top_entries
+        for driver, driver_entry in self.scan_dir(self.get_modules_dir()).items():
+            if not driver_entry.is_dir():
+                continue
+            driver_entries = self.scan_dir(driver_entry.path)
+            # identify the IOCs folder
+            iocs_dirs = [driver_entries[name].path for name in ['ioc', 'iocs'] if name in driver_entries]
+            for iocs_dir in iocs_dirs:
+                # Add check to see if NOIOC in name - occasional problems generating ADSimDetector
+                ioc_dirs = [entry.path for name, entry in self.scan_dir(iocs_dir).items()
+                            if ("IOC" in name or "ioc" in name) and "NOIOC" not in name.upper() and entry.is_dir()]
+                for ioc_dir in ioc_dirs:
+                    executables = {}
+                    for arch, arch_entry in self.scan_dir(ioc_dir + "/bin").items():
+                        if not arch_entry.is_dir():
+                            continue
+                        files = [name for name, entry in self.scan_dir(arch_entry.path).items() if entry.is_file()]
+                        # We look for the executable that ends with App
+                        apps = [name for name in files if name.endswith('App')]
+                        if len(apps) > 0:
+                            executables[arch] = arch_entry.path + "/" + apps[0]
+                        elif len(files) > 0:
+                            executables[arch] = arch_entry.path + "/" + files[0]
+                    if len(executables) > 0:
+                        self.drivers[driver] = executables
+                        break
+                if driver in self.drivers:
+                    break
+
+
+    def scan_dir(self, path):
+        """
+        Function that lists a directory with os.scandir, and records its modification time
+        Parameters
+        ----------
+        path : str
+            directory to list
+
+        Returns
+        -------
+        entries : dict of str to os.DirEntry
+            directory entries keyed by name, in sorted order. Empty if the directory does not exist
+        """
+
+        try:
+            self.mtimes[path] = os.stat(path).st_mtime_ns
+            with os.scandir(path) as scanner:
+                entries = list(scanner)
+        except (FileNotFoundError, NotADirectoryError):
+            self.mtimes[path] = None
+            return {}
+        return dict([(entry.name, entry) for entry in sorted(entries, key=lambda entry: entry.name)])
+
+
+    def get_modules_dir(self):
+        """ Function that returns the directory holding the motor driver modules """
+
+        if self.bin_flat:
+            # if flat, there is no support directory
+            return self.bin_loc + "/motor/modules"
+        return self.bin_loc + "/support/motor/modules"
+
+
+    def is_stale(self):
+        """
+        Function that checks if any directory in the index has changed since it was scanned
+        Returns
+        -------
+        bool
+            True if the index must be rebuilt
+        """
+
+        for path, mtime in self.mtimes.items():
+            try:
+                current = os.stat(path).st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime:
+                return True
+        return False
+
+
+    def lookup(self, driver, arch=None):
+        """
+        Function that returns the IOC executable for a driver
+        Parameters
+        ----------
+        driver : str
+            name of EPICS motor module driver. ex. motorNewFocus
+        arch : str
+            EPICS architecture. If None, the host architecture is preferred, otherwise the first one found
+
+        Returns
+        -------
+        str
+            path to the IOC executable, or None if not found
+        """
+
+        executables = self.drivers.get(driver)
+        if not executables:
+            return None
+        if arch is None:
+            arch = get_host_arch()
+        if arch in executables:
+            return executables[arch]
+        return executables[sorted(executables.keys())[0]]
+
+
+    def to_dict(self):
+        """ Function that converts the index to a json serializable dictionary """
+
+        return {'bin_flat' : self.bin_flat, 'drivers' : self.drivers, 'mtimes' : self.mtimes}
+
+
+    def from_dict(self, contents):
+        """
+        Function that restores the index from a dictionary created by to_dict
+        Parameters
+        ----------
+        contents : dict
+            saved index contents
+        """
+
+        self.bin_flat   = contents['bin_flat']
+        self.drivers    = contents['drivers']
+        self.mtimes     = contents['mtimes']
+
+
+class Inventory:
+
+
+    def __init__(self, ioc_top):
+        """
+        Constructor for the Inventory class
+        Parameters
+        ----------
+        ioc_top : str
+            Path to the top directory containing generated IOCs
+        """
+
+        self.ioc_top    = ioc_top
+        self.iocs       = {}
+
+
+    def update(self):
+        """
+        Function that brings the inventory up to date with the IOC directory.
+        An IOC is only parsed again if its directory, config or unique.cmd modification time has changed.
+        Returns
+        -------
+        bool
+            True if any IOC was added, removed or parsed again
+        """
+
+        iocs = {}
+        changed = False
+        try:
+            with os.scandir(self.ioc_top) as scanner:
+                entries = [entry for entry in scanner if not entry.name.startswith('.') and entry.is_dir()]
+        except (FileNotFoundError, NotADirectoryError):
+            entries = []
+        for entry in entries:
+            mtimes = [get_mtime(entry.path), get_mtime(entry.path + '/config'), get_mtime(entry.path + '/unique.cmd')]
+            known = self.iocs.get(entry.name)
+            if known is not None and known['mtimes'] == mtimes:
+                iocs[entry.name] = known
+            else:
+                iocs[entry.name] = {'mtimes' : mtimes, 'record' : read_ioc_record(entry.path)}
+                changed = True
+        if len(iocs) != len(self.iocs):
+            changed = True
+        self.iocs = iocs
+        return changed
+
+
+    def records(self):
+        """
+        Function that returns the existing IOCs
+        Returns
+        -------
+        list of dict
+            records as returned by read_ioc_record, sorted by IOC name
+        """
+
+        return [self.iocs[name]['record'] for name in sorted(self.iocs.keys()) if self.iocs[name]['record'] is not None]
+
+
+    def to_dict(self):
+        """ Function that converts the inventory to a json serializable dictionary """
+
+        return {'version' : INVENTORY_VERSION, 'iocs' : self.iocs}
+
+
+    def from_dict(self, contents):
+        """
+        Function that restores the inventory from a dictionary created by to_dict
+        Parameters
+        ----------
+        contents : dict
+            saved inventory contents
+        """
+
+        if contents.get('version') == INVENTORY_VERSION:
+            self.iocs = contents['iocs']
+
+
+class DriverRegistry:
+
+
+    def __init__(self, template_path, binary_index=None):
+        """
+        Constructor for the DriverRegistry class
+        Parameters
+        ----------
+        template_path : str
+            path to the IOC template snapshot
+        binary_index : BinaryIndex
+            index of the binary distribution, used to discover drivers and their executables
+        """
+
+        self.template_path  = template_path
+        self.binary_index   = binary_index
+        self.drivers        = {}
+
+
+    def scan(self):
+        """
+        Function that finds the template files of every known or discovered driver.
+        A driver is supported if the template has a startup script for it, ex. newfocus for motorNewFocus
+        """
+
+        listings = {}
+        for directory in ['startupScripts', 'autosaveFiles', 'dependancyFiles']:
+            try:
+                listings[directory] = sorted(os.listdir(self.template_path + '/' + directory))
+            except OSError:
+                listings[directory] = []
+        candidates = set(supported_drivers)
+        if self.binary_index is not None:
+            candidates.update([driver for driver in self.binary_index.drivers.keys() if driver.startswith('motor')])
+
+        self.drivers = {}
+        for driver in sorted(candidates):
+            driver_type = driver[5:].lower()
+            scripts = [file for file in listings['startupScripts'] if driver_type in file.lower()]
+            if len(driver_type) == 0 or len(scripts) == 0:
+                continue
+            artifacts = {
+                'startup_script'    : 'startupScripts/' + scripts[0],
+                'autosave'          : None,
+                'dependencies'      : ['dependancyFiles/' + file for file in listings['dependancyFiles'] if file.lower().startswith(driver_type)],
+                'macros'            : [],
+                'binary'            : None
+            }
+            if driver_type + '_auto_settings.req' in listings['autosaveFiles']:
+                artifacts['autosave'] = 'autosaveFiles/' + driver_type + '_auto_settings.req'
+            macros = set()
+            for file in [artifacts['startup_script']] + artifacts['dependencies']:
+                with open(self.template_path + '/' + file, 'r') as file_fp:
+                    macros.update([match.group('key') for match in MACRO_REFERENCE.finditer(file_fp.read())])
+            artifacts['macros'] = sorted(macros)
+            if self.binary_index is not None:
+                artifacts['binary'] = self.binary_index.lookup(driver)
+            self.drivers[driver] = artifacts
+
+
+    def get(self, driver):
+        """
+        Function that returns the template files of a driver
+        Parameters
+        ----------
+        driver : str
+            name of EPICS motor module driver. ex. motorNewFocus
+
+        Returns
+        -------
+        dict
+            startup_script, autosave (or None) and dependencies paths relative to the template, the macros
+            they reference, and the driver binary (or None), or None if the driver is not supported
+        """
+
+        return self.drivers.get(driver)
+
+
+def get_host_arch():
+    """ Function that returns the EPICS architecture the generated IOCs run on """
+
+    if platform == 'win32':
+        return 'windows-x64-static'
+    return 'linux-x86_64'
+
+
+def read_settings(file_path, value_pattern):
+    """
+    Function that reads the settings written by update_config or update_unique back from an IOC file
+    Parameters
+    ----------
+    file_path : str
+        path to the config or unique.cmd file
+    value_pattern : re.Pattern
+        CONFIG_VALUE or EPICS_ENV_SET_VALUE
+
+    Returns
+    -------
+    dict of str to str
+        setting values by key, empty if the file does not exist
+    """
+
+    settings = {}
+    if not os.path.exists(file_path):
+        return settings
+    with open(file_path, 'r') as file_fp:
+        for line in file_fp:
+            match = value_pattern.match(line)
+            if match is not None:
+                settings[match.group('key')] = match.group('value')
+    return settings
+
+
+def get_mc_number(ioc_num):
+    """
+    Function that normalizes a motion controller number, so that 37 and MC:37 compare equal
+    Parameters
+    ----------
+    ioc_num : str or int
+        motion controller number
+
+    Returns
+    -------
+    str
+        the number without the MC: prefix
+    """
+
+    ioc_num = str(ioc_num).strip()
+    if ioc_num.startswith('MC:'):
+        ioc_num = ioc_num[3:]
+    return ioc_num
+
+
+def read_ioc_record(ioc_path):
+    """
+    Function that reads the identity of a generated IOC from its config and unique.cmd files
+    Parameters
+    ----------
+    ioc_path : str
+        path to the IOC directory
+
+    Returns
+    -------
+    dict of str to str
+        name, host, port, prefix, mc and driver of the IOC (None when unknown), or None if the directory is not an IOC
+    """
+
+    config = read_settings(ioc_path + '/config', CONFIG_VALUE)
+    unique = read_settings(ioc_path + '/unique.cmd', EPICS_ENV_SET_VALUE)
+    if len(config) == 0 and len(unique) == 0:
+        return None
+    driver = unique.get('IOC')
+    if driver is not None and driver.startswith('ioc'):
+        driver = driver[3:]
+    mc = unique.get('MC')
+    if mc is not None:
+        mc = get_mc_number(mc)
+    return {
+        'name'      : os.path.basename(ioc_path),
+        'host'      : config.get('HOST', unique.get('HOSTNAME')),
+        'port'      : config.get('PORT'),
+        'prefix'    : unique.get('CT'),
+        'mc'        : mc,
+        'driver'    : driver
+    }
+
+
+def get_mtime(path):
+    """
+    Function that returns the modification time of a path in nanoseconds, or None if it does not exist
+    """
+
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
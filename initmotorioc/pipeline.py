@@ -0,0 +1,155 @@
+"""
+Running the stages of IOC actions, one IOC after another or with a pool of worker threads.
+"""
+
+# imports
+import os
+import io
+import contextlib
+import contextvars
+
+from .config import DEFAULT_WORKERS, STATE_FILE, is_enabled, optional_configuration_keys, setup_stages
+from .events import initIOC_print
+from .files import MemoryTree, disk_tree
+from .caches import detect_bin_flat, get_driver_registry
+from .staging import publish_ioc, regenerate_staged, stage_ioc
+from .archives import archive_ioc, get_output_message
+
+
+def profile_call(output_path, function, *args):
+    """
+    Function that runs a function under cProfile, saves the statistics and prints the most expensive calls
+    Parameters
+    ----------
+    output_path : str
+        file to save the profile statistics to, readable with pstats
+    function : callable
+        function to profile
+    args : list
+        arguments to the function
+
+    Returns
+    -------
+    object
+        the function's return value
+    """
+
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        profiler.dump_stats(output_path)
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(20)
+        initIOC_print('Profile saved to {}'.format(output_path))
+        initIOC_print(report.getvalue())
+
+
+def execute_ioc_action(action, configuration, bin_flat, template=None):
+    """
+    Function that runs all required IOC action functions with a given configuration
+    Parameters
+    ----------
+    action : IOCAction
+        currently executing IOC action
+    configuration : dict of str to str
+        configuration settings as read from CONFIGURE or inputted by user
+    bin_flat : bool
+        toggle that tells the script if binaries are flat of not
+    template : TemplateCache
+        local template cache shared by all IOCs. If None, the template is cloned for each IOC
+
+    Returns
+    -------
+    int
+        0 if success, -1 if error
+    """
+
+    action.registry = get_driver_registry(template, configuration["TOP_BINARY_DIR"], bin_flat)
+    if configuration.get("ARCHIVE_DIR"):
+        action.tree = MemoryTree(configuration["IOC_DIR"] + '/' + action.ioc_name)
+    try:
+        if configuration.get("PROFILE_IOC") == action.ioc_name:
+            out = profile_call('initMotorIOCs-{}.prof'.format(action.ioc_name), run_ioc_action, action, configuration, bin_flat, template)
+        else:
+            out = run_ioc_action(action, configuration, bin_flat, template)
+        if out == 0 and configuration.get("ARCHIVE_DIR"):
+            archive_ioc(action, configuration)
+        return out
+    finally:
+        action.tree = disk_tree
+
+
+def run_ioc_action(action, configuration, bin_flat, template=None):
+    """ Function that runs each stage of an IOC action in turn, see execute_ioc_action for the parameters """
+
+    ioc_top = configuration["IOC_DIR"]
+    if is_enabled(configuration.get("INCREMENTAL", optional_configuration_keys["INCREMENTAL"])):
+        if template is None:
+            initIOC_print('ERROR - Incremental regeneration requires a local template cache.')
+            return -1
+        if os.path.exists(ioc_top + '/' + action.ioc_name + '/' + STATE_FILE):
+            return regenerate_staged(action, configuration, bin_flat, template)
+
+    minimal_ldpath = is_enabled(configuration.get("MINIMAL_LDPATH", optional_configuration_keys["MINIMAL_LDPATH"]))
+    binary_path = action.check_setup(ioc_top, configuration["TOP_BINARY_DIR"], bin_flat, minimal_ldpath)
+    if binary_path is None:
+        return -1
+    # IOCs generated in memory for an archive have nothing to roll back, others are built in a staging directory
+    staging = contextlib.nullcontext(ioc_top) if configuration.get("ARCHIVE_DIR") else stage_ioc(action.ioc_name, configuration)
+    with staging as build_top:
+        if action.fetch_template(build_top, template) != 0:
+            return -1
+        for stage, sources, generated in setup_stages:
+            action.render_stage(stage, build_top, configuration, bin_flat, binary_path)
+        action.cleanup(build_top, template)
+        # Archived IOCs are never regenerated in place, so they don't need a state file
+        if template is not None and not configuration.get("ARCHIVE_DIR"):
+            action.save_state(build_top, configuration, bin_flat, binary_path, template.revision)
+        if build_top != ioc_top:
+            publish_ioc(action.ioc_name, build_top, ioc_top)
+    return 0
+
+
+def run_batch(entries, workers=DEFAULT_WORKERS, template=None):
+    """
+    Function that executes many IOC actions on a pool of worker threads
+    Parameters
+    ----------
+    entries : list of (MotorIOCAction, dict of str to str)
+        IOC actions paired with their configuration, as returned by read_manifest
+    workers : int
+        maximum number of IOCs generated at the same time
+    template : TemplateCache
+        local template cache shared by all IOCs
+
+    Returns
+    -------
+    results : list of (MotorIOCAction, bool, str)
+        for each IOC action, in manifest order, whether it succeeded and a short status message
+    """
+
+    import concurrent.futures
+
+    flat_cache = {}
+    for action, configuration in entries:
+        if configuration['TOP_BINARY_DIR'] not in flat_cache:
+            flat_cache[configuration['TOP_BINARY_DIR']] = detect_bin_flat(configuration['TOP_BINARY_DIR'])
+
+    def run_entry(entry):
+        action, configuration = entry
+        try:
+            out = execute_ioc_action(action, configuration, flat_cache[configuration['TOP_BINARY_DIR']], template)
+        except Exception as err:
+            initIOC_print('ERROR - Generating IOC {} failed: {}'.format(action.ioc_name, err))
+            return action, False, '{}: {}'.format(type(err).__name__, err)
+        if out != 0:
+            return action, False, 'setup failed, see log above'
+        return action, True, get_output_message(action, configuration)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # Each IOC runs in a copy of the caller's context, so a generator server request still captures its output
+        futures = [executor.submit(contextvars.copy_context().run, run_entry, entry) for entry in entries]
+        return [future.result() for future in futures]
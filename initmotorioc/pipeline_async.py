@@ -0,0 +1,210 @@
+"""
+Running the stages of IOC actions as an asyncio pipeline with bounded concurrency per stage.
+"""
+
+# imports
+import os
+import contextvars
+import concurrent.futures
+import asyncio
+
+from .config import DEFAULT_STAGE_LIMITS, STATE_FILE, is_enabled, optional_configuration_keys, setup_stages
+from .events import fail_event, initIOC_print, record_exit_code, stage_event
+from .files import MemoryTree, disk_tree
+from .caches import detect_bin_flat, get_driver_registry
+from .template import TEMPLATE_URL
+from .staging import close_staging, open_staging, publish_ioc, regenerate_staged
+from .archives import archive_ioc, get_output_message
+
+
+def run_in_executor(executor, function, *args):
+    """
+    Function that runs a blocking function in an executor thread, within the current context so that
+    its events are recorded for the right IOC and request
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        executor running the blocking stages of the asyncio pipeline
+    function : callable
+        function to run
+    *args
+        arguments passed to the function
+
+    Returns
+    -------
+    asyncio.Future
+        future resolving to the return value of the function
+    """
+
+    return asyncio.get_running_loop().run_in_executor(executor, contextvars.copy_context().run, function, *args)
+
+
+async def execute_ioc_action_async(action, configuration, bin_flat, template, limits, executor):
+    """
+    Coroutine that runs all required IOC action functions, waiting for a free slot before each stage.
+    Filesystem stages run in the executor, and subprocess stages with asyncio subprocesses,
+    so that the stages of different IOCs overlap.
+    Parameters
+    ----------
+    action : MotorIOCAction
+        currently executing IOC action
+    configuration : dict of str to str
+        configuration settings of the IOC
+    bin_flat : bool
+        toggle that tells the script if binaries are flat of not
+    template : TemplateCache
+        local template cache shared by all IOCs. If None, the template is cloned for each IOC
+    limits : dict of str to asyncio.Semaphore
+        concurrency limit of each stage, keyed by the names in DEFAULT_STAGE_LIMITS
+    executor : concurrent.futures.Executor
+        executor running the blocking stages
+
+    Returns
+    -------
+    int
+        0 if success, -1 if error
+    """
+
+    ioc_top = configuration["IOC_DIR"]
+    ioc_path = ioc_top + '/' + action.ioc_name
+    action.registry = await run_in_executor(executor, get_driver_registry, template, configuration["TOP_BINARY_DIR"], bin_flat)
+    if is_enabled(configuration.get("INCREMENTAL", optional_configuration_keys["INCREMENTAL"])):
+        if template is None:
+            initIOC_print('ERROR - Incremental regeneration requires a local template cache.')
+            return -1
+        if os.path.exists(ioc_path + '/' + STATE_FILE):
+            async with limits['render']:
+                return await run_in_executor(executor, regenerate_staged, action, configuration, bin_flat, template)
+
+    if configuration.get("PROFILE_IOC") == action.ioc_name:
+        initIOC_print('WARNING - Profiling IOC {} is not supported by the asyncio pipeline.'.format(action.ioc_name))
+    if configuration.get("ARCHIVE_DIR"):
+        action.tree = MemoryTree(ioc_path)
+        try:
+            out = await execute_ioc_stages_async(action, configuration, bin_flat, template, limits, executor)
+            if out == 0:
+                await run_in_executor(executor, archive_ioc, action, configuration)
+            return out
+        finally:
+            action.tree = disk_tree
+    return await execute_ioc_stages_async(action, configuration, bin_flat, template, limits, executor)
+
+
+async def execute_ioc_stages_async(action, configuration, bin_flat, template, limits, executor):
+    """ Coroutine that runs each stage of an IOC action in turn, see execute_ioc_action_async for the parameters """
+
+    ioc_top = configuration["IOC_DIR"]
+    bin_loc = configuration["TOP_BINARY_DIR"]
+    minimal_ldpath = is_enabled(configuration.get("MINIMAL_LDPATH", optional_configuration_keys["MINIMAL_LDPATH"]))
+    async with limits['lookup']:
+        binary_path = await run_in_executor(executor, action.check_setup, ioc_top, bin_loc, bin_flat, minimal_ldpath)
+    if binary_path is None:
+        return -1
+
+    if configuration.get("ARCHIVE_DIR"):
+        return await build_ioc_async(action, configuration, bin_flat, template, limits, executor, ioc_top, binary_path)
+    staging_top, build_top = await run_in_executor(executor, open_staging, action.ioc_name, configuration)
+    try:
+        out = await build_ioc_async(action, configuration, bin_flat, template, limits, executor, build_top, binary_path)
+        if out == 0:
+            await run_in_executor(executor, publish_ioc, action.ioc_name, build_top, ioc_top)
+        return out
+    finally:
+        await run_in_executor(executor, close_staging, staging_top, build_top)
+
+
+async def build_ioc_async(action, configuration, bin_flat, template, limits, executor, build_top, binary_path):
+    """
+    Coroutine that fetches, renders and cleans up an IOC in its build directory
+    Parameters
+    ----------
+    build_top : str
+        directory the IOC is built in, its staging directory or IOC_DIR when writing archives
+    binary_path : str
+        path of the IOC executable
+    See execute_ioc_action_async for the other parameters
+
+    Returns
+    -------
+    int
+        0 if success, -1 if error
+    """
+
+    async with limits['fetch']:
+        if template is not None:
+            out = await run_in_executor(executor, action.fetch_template, build_top, template)
+        else:
+            with stage_event(action.ioc_name, 'fetch'):
+                command = ["git", "clone", "--quiet", TEMPLATE_URL, build_top + '/' + action.ioc_name]
+                clone = await asyncio.create_subprocess_exec(*command)
+                out = await clone.wait()
+                record_exit_code(command, out)
+                if out != 0:
+                    initIOC_print("Error failed to clone IOC template for ioc {}".format(action.ioc_name))
+                    fail_event('Failed to clone IOC template')
+    if out != 0:
+        return -1
+
+    def render():
+        for stage, sources, generated in setup_stages:
+            action.render_stage(stage, build_top, configuration, bin_flat, binary_path)
+
+    def finish_cleanup(command):
+        if command is not None:
+            os.remove(command[-1])
+        action.finish_cleanup(build_top, command is not None)
+
+    async with limits['render']:
+        await run_in_executor(executor, render)
+
+    async with limits['cleanup']:
+        if template is not None and template.cleanup_patterns() is not None:
+            await run_in_executor(executor, action.cleanup, build_top, template)
+        else:
+            with stage_event(action.ioc_name, 'cleanup'):
+                command = await run_in_executor(executor, action.get_cleanup_command, build_top)
+                if command is not None:
+                    initIOC_print('Performing cleanup for {}'.format(action.ioc_name))
+                    cleanup = await asyncio.create_subprocess_exec(*command)
+                    record_exit_code(command, await cleanup.wait())
+                await run_in_executor(executor, finish_cleanup, command)
+    if template is not None and not configuration.get("ARCHIVE_DIR"):
+        await run_in_executor(executor, action.save_state, build_top, configuration, bin_flat, binary_path, template.revision)
+    return 0
+
+
+async def run_batch_async(entries, template=None, stage_limits=None):
+    """
+    Coroutine that executes many IOC actions as an asyncio pipeline with bounded concurrency per stage
+    Parameters
+    ----------
+    entries : list of (MotorIOCAction, dict of str to str)
+        IOC actions paired with their configuration, as returned by read_manifest
+    template : TemplateCache
+        local template cache shared by all IOCs
+    stage_limits : dict of str to int
+        maximum number of IOCs in each stage at the same time, defaults to DEFAULT_STAGE_LIMITS
+
+    Returns
+    -------
+    results : list of (MotorIOCAction, bool, str)
+        for each IOC action, in manifest order, whether it succeeded and a short status message
+    """
+
+    stage_limits = dict(DEFAULT_STAGE_LIMITS, **(stage_limits or {}))
+    limits = dict([(stage, asyncio.Semaphore(max(1, limit))) for stage, limit in stage_limits.items()])
+
+    async def run_entry(action, configuration, executor):
+        try:
+            # The first lookup of a binary distribution scans it, so it runs in the executor as well
+            bin_flat = await run_in_executor(executor, detect_bin_flat, configuration['TOP_BINARY_DIR'])
+            out = await execute_ioc_action_async(action, configuration, bin_flat, template, limits, executor)
+        except Exception as err:
+            initIOC_print('ERROR - Generating IOC {} failed: {}'.format(action.ioc_name, err))
+            return action, False, '{}: {}'.format(type(err).__name__, err)
+        if out != 0:
+            return action, False, 'setup failed, see log above'
+        return action, True, get_output_message(action, configuration)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, sum(stage_limits.values()))) as executor:
+        return list(await asyncio.gather(*[run_entry(action, configuration, executor) for action, configuration in entries]))
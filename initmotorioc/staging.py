@@ -0,0 +1,319 @@
+"""
+Building IOCs in a private staging directory, and publishing them into IOC_DIR once complete.
+"""
+
+# imports
+import os
+import errno
+import contextlib
+import shutil
+import tempfile
+import threading
+import json
+import filecmp
+
+from .config import STATE_FILE, STATE_VERSION, setup_stages
+from .events import initIOC_print, record_write, stage_event
+from .files import link_or_copy, open_atomic
+
+
+# IOCs are built in a private directory under this one in IOC_DIR (or under STAGING_DIR), and renamed into place once complete
+STAGING_DIR_NAME = '.initMotorIOCs-staging'
+
+# Staging directories already checked for leftovers of interrupted runs
+_staging_checked = set()
+_staging_lock = threading.Lock()
+
+
+def get_staging_top(configuration):
+    """ Function that returns the directory in which IOCs are built before being published to IOC_DIR """
+
+    if configuration.get("STAGING_DIR"):
+        return configuration["STAGING_DIR"]
+    return configuration["IOC_DIR"] + '/' + STAGING_DIR_NAME
+
+
+def remove_stale_staging(staging_top):
+    """
+    Function that removes staging directories left behind by runs on this host that were killed, once per run
+    Parameters
+    ----------
+    staging_top : str
+        directory holding the staging directories
+    """
+
+    with _staging_lock:
+        if staging_top in _staging_checked:
+            return
+        _staging_checked.add(staging_top)
+    host = get_staging_host()
+    try:
+        names = os.listdir(staging_top)
+    except OSError:
+        return
+    for name in names:
+        parts = name.rsplit('.', 3)
+        if len(parts) != 4 or parts[1] != host or not parts[2].isdigit() or int(parts[2]) == os.getpid():
+            continue
+        try:
+            os.kill(int(parts[2]), 0)
+        except ProcessLookupError:
+            initIOC_print('Removing staging directory {} left by an interrupted run.'.format(name))
+            shutil.rmtree(staging_top + '/' + name, ignore_errors=True)
+        except OSError:
+            continue
+
+
+def get_staging_host():
+    """ Function that returns the short name of this host, as used in staging directory names """
+
+    import socket
+
+    return socket.gethostname().split('.')[0] or 'localhost'
+
+
+@contextlib.contextmanager
+def stage_ioc(ioc_name, configuration):
+    """
+    Context manager that creates a private staging directory to build an IOC in, and removes it on exit.
+    Whatever happens while building, the staged IOC is rolled back unless it was published.
+    Parameters
+    ----------
+    ioc_name : str
+        name of the IOC
+    configuration : dict of str to str
+        configuration of the IOC
+
+    Yields
+    ------
+    stage_top : str
+        directory to use as the IOC's top directory while building it
+    """
+
+    staging_top, stage_top = open_staging(ioc_name, configuration)
+    try:
+        yield stage_top
+    finally:
+        close_staging(staging_top, stage_top)
+
+
+def open_staging(ioc_name, configuration):
+    """
+    Function that creates the staging directory of an IOC, see stage_ioc, for callers that cannot use a context manager
+    Parameters
+    ----------
+    ioc_name : str
+        name of the IOC
+    configuration : dict of str to str
+        configuration of the IOC
+
+    Returns
+    -------
+    staging_top : str
+        directory holding the staging directories, to pass to close_staging
+    stage_top : str
+        directory to use as the IOC's top directory while building it
+    """
+
+    staging_top = get_staging_top(configuration)
+    stage_top = make_staging_dir(ioc_name, staging_top)
+    remove_stale_staging(staging_top)
+    return staging_top, stage_top
+
+
+def close_staging(staging_top, stage_top):
+    """
+    Function that removes the staging directory of an IOC created by open_staging, rolling it back unless it was published
+    Parameters
+    ----------
+    staging_top : str
+        directory holding the staging directories
+    stage_top : str
+        staging directory of the IOC
+    """
+
+    shutil.rmtree(stage_top, ignore_errors=True)
+    remove_staging_top(staging_top)
+
+
+def make_staging_dir(ioc_name, staging_top):
+    """
+    Function that creates a private staging directory for an IOC, named after the IOC, this host and this process
+    Parameters
+    ----------
+    ioc_name : str
+        name of the IOC
+    staging_top : str
+        directory holding the staging directories, created if needed
+
+    Returns
+    -------
+    str
+        path of the new staging directory
+    """
+
+    while True:
+        os.makedirs(staging_top, exist_ok=True)
+        try:
+            return tempfile.mkdtemp(prefix='{}.{}.{}.'.format(ioc_name, get_staging_host(), os.getpid()), dir=staging_top)
+        except FileNotFoundError:
+            # Another IOC removed the empty staging directory in between
+            continue
+
+
+def remove_staging_top(staging_top):
+    """
+    Function that removes the staging directory of an IOC directory once no IOC is built in it anymore.
+    A staging directory given with STAGING_DIR is left alone.
+    """
+
+    if os.path.basename(staging_top) != STAGING_DIR_NAME:
+        return
+    try:
+        os.rmdir(staging_top)
+    except OSError:
+        pass
+
+
+def publish_ioc(ioc_name, stage_top, ioc_top):
+    """
+    Function that moves a staged IOC into the IOC directory with a single atomic rename.
+    IOCs staged on another filesystem, ex. tmpfs, are first copied next to the IOC directory.
+    Parameters
+    ----------
+    ioc_name : str
+        name of the IOC
+    stage_top : str
+        staging directory the IOC was built in
+    ioc_top : str
+        Path to the top directory containing generated IOCs
+    """
+
+    staged_path = stage_top + '/' + ioc_name
+    ioc_path = ioc_top + '/' + ioc_name
+    with stage_event(ioc_name, 'publish'):
+        if os.path.exists(ioc_path):
+            raise FileExistsError('IOC with name {} was created in {} while it was being generated'.format(ioc_name, ioc_top))
+        try:
+            os.rename(staged_path, ioc_path)
+            return
+        except OSError as err:
+            if err.errno != errno.EXDEV:
+                raise
+        local_top = make_staging_dir(ioc_name, ioc_top + '/' + STAGING_DIR_NAME)
+        try:
+            shutil.copytree(staged_path, local_top + '/' + ioc_name, symlinks=True)
+            record_write(ioc_path, 0)
+            os.rename(local_top + '/' + ioc_name, ioc_path)
+        finally:
+            shutil.rmtree(local_top, ignore_errors=True)
+            remove_staging_top(ioc_top + '/' + STAGING_DIR_NAME)
+
+
+def read_state(ioc_path):
+    """
+    Function that reads the state file of a generated IOC
+    Parameters
+    ----------
+    ioc_path : str
+        path to the IOC directory
+
+    Returns
+    -------
+    dict
+        the state saved by MotorIOCAction.save_state, or None if it is missing, unreadable or of another version
+    """
+
+    try:
+        with open(ioc_path + '/' + STATE_FILE, 'r') as state_fp:
+            state = json.load(state_fp)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get('version') != STATE_VERSION:
+        return None
+    return state
+
+
+def publish_files(staged_path, ioc_path, files):
+    """
+    Function that publishes the given files of a staged copy of an IOC into the existing IOC, each with an atomic rename.
+    Files missing from the staged copy are removed, every other file of the IOC is left alone
+    Parameters
+    ----------
+    staged_path : str
+        regenerated copy of the IOC
+    ioc_path : str
+        the existing IOC directory
+    files : list of str
+        paths relative to the IOC directory to publish
+
+    Returns
+    -------
+    published : list of str
+        paths relative to the IOC directory that were replaced or removed
+    """
+    published = []
+    for relpath in files:
+        staged = staged_path + '/' + relpath
+        target = ioc_path + '/' + relpath
+        if not os.path.exists(staged):
+            if os.path.exists(target):
+                os.remove(target)
+                published.append(relpath)
+            continue
+        if os.path.exists(target) and (os.path.samefile(staged, target) or filecmp.cmp(staged, target, shallow=False)):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.replace(staged, target)
+        except OSError as err:
+            if err.errno != errno.EXDEV:
+                raise
+            with open(staged, 'rb') as staged_fp, open_atomic(target, os.stat(staged).st_mode & 0o7777) as target_fp:
+                shutil.copyfileobj(staged_fp, target_fp)
+        record_write(target, os.path.getsize(target))
+        published.append(relpath)
+    return published
+
+
+def regenerate_staged(action, configuration, bin_flat, template):
+    """
+    Function that regenerates an existing IOC on a staged copy, then publishes only the files of the stale stages,
+    so a failure leaves the IOC untouched
+    Parameters
+    ----------
+    action : MotorIOCAction
+        IOC action of the existing IOC
+    configuration : dict of str to str
+        configuration settings of the IOC
+    bin_flat : bool
+        toggle that tells the script if binaries are flat of not
+    template : TemplateCache
+        local template cache the IOC is regenerated from
+
+    Returns
+    -------
+    int
+        0 if success, -1 if error
+    """
+
+    ioc_path = configuration["IOC_DIR"] + '/' + action.ioc_name
+    with stage_ioc(action.ioc_name, configuration) as stage_top:
+        staged_path = stage_top + '/' + action.ioc_name
+        # Unchanged files are shared with the IOC by hard links, every rendered file is written as a new file
+        shutil.copytree(ioc_path, staged_path, symlinks=True, copy_function=link_or_copy)
+        previous = read_state(ioc_path) or {}
+        out = action.regenerate(stage_top, configuration, bin_flat, template)
+        if out != 0:
+            return out
+        # Only files rendered by the stale stages are published, files the IOC changed since the copy are kept
+        state = read_state(staged_path) or {}
+        stale = [stage for stage, sources, generated in setup_stages
+                 if state.get('stages', {}).get(stage) != previous.get('stages', {}).get(stage)]
+        generated_files = action.get_generated_files(staged_path)
+        files = [file for stage in stale for file in generated_files[stage]] + [STATE_FILE]
+        # Generated files the stale stages do not write anymore are removed
+        files = files + [file for file in previous.get('outputs', {}) if file not in state.get('outputs', {}) and file not in files]
+        with stage_event(action.ioc_name, 'publish'):
+            publish_files(staged_path, ioc_path, files)
+    return 0
@@ -0,0 +1,398 @@
+"""
+Local cache of the IOC template, and the cleanup manifest shipped with it.
+"""
+
+# imports
+import os
+import re
+import subprocess
+import shutil
+import hashlib
+import threading
+import contextlib
+import shlex
+
+from .config import setup_stages
+from .events import initIOC_print, record_write
+from .files import DiskTree, disk_tree, match_cleanup_pattern, reflink_file
+
+# fcntl is only available on unix, elsewhere the template cache is not locked between processes
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Upstream location of the IOC template
+TEMPLATE_URL = "https://github.com/epicsNSLS2-deploy/motor-ioc-template"
+
+# Default location of the local template mirror and its snapshots
+DEFAULT_TEMPLATE_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'initMotorIOCs')
+
+# Lock file serializing fetches, snapshots and pruning between processes sharing a template cache
+CACHE_LOCK_FILE = '.lock'
+
+# Declarative list of template paths and globs to drop from generated IOCs, kept with the template
+CLEANUP_MANIFEST = 'cleanup.manifest'
+
+# Cleanup scripts shipped with the template, used when no cleanup manifest can be found or derived
+cleanup_scripts = [
+    'cleanup.sh',
+    'cleanup.bat'
+]
+
+# Template files read while converting an IOC. Cleanup of these is deferred until setup is complete
+pipeline_inputs = [
+    'startupScripts',
+    'autosaveFiles',
+    'dependancyFiles',
+    'unique.cmd',
+    'config',
+    'envPaths',
+    'st.cmd'
+]
+
+# Matches the script directory prefix of a path in cleanup.sh, ex. $DIR/ or $(dirname $0)/
+SCRIPT_DIR_PREFIX = re.compile(r'^(\$\{?(?P<var>\w+)\}?|\$\(dirname \$\{?(0|BASH_SOURCE(\[0\])?)\}?\))/')
+
+# Ways to materialize template files that are never rewritten: real copies, hard links or copy-on-write reflinks
+link_modes = ['copy', 'hardlink', 'reflink']
+
+
+class TemplateCache:
+
+
+    def __init__(self, cache_dir=DEFAULT_TEMPLATE_CACHE, template_dir=None, url=TEMPLATE_URL, offline=False, link_mode='copy'):
+        """
+        Constructor for the TemplateCache class
+        Parameters
+        ----------
+        cache_dir : str
+            directory holding the local git mirror of the template and its per commit snapshots
+        template_dir : str
+            optional path to an existing template checkout or unpacked snapshot, used instead of the mirror
+        url : str
+            git url of the IOC template
+        offline : bool
+            if True, never contact the remote and use the cached mirror as is
+        link_mode : str
+            how template files that are never rewritten are materialized, one of link_modes.
+            Files read by the setup stages are always copied. Hard links are only made to the private
+            snapshots of the cache, with template_dir reflinks are used instead
+        """
+
+        self.cache_dir      = cache_dir
+        self.template_dir   = template_dir
+        self.url            = url
+        self.offline        = offline
+        self.link_mode      = link_mode
+        self.link_warned    = False
+        self.revision       = None
+        self.snapshot       = None
+        self.patterns       = None
+        self.lock           = threading.Lock()
+
+
+    def prepare(self):
+        """
+        Function that fetches or updates the template once, and creates a snapshot for its current commit.
+        Snapshots older than the previously used one are removed, other processes may still be copying from it
+        Returns
+        -------
+        int
+            0 if success, -1 if error
+        """
+
+        with self.lock:
+            if self.snapshot is not None:
+                return 0
+            if self.template_dir is not None:
+                if not os.path.isdir(self.template_dir):
+                    initIOC_print('ERROR - Template directory {} does not exist.'.format(self.template_dir))
+                    return -1
+                self.revision = get_git_revision(self.template_dir)
+                if self.revision is None:
+                    self.revision = fingerprint_tree(self.template_dir)
+                self.snapshot = self.template_dir
+                initIOC_print('Using IOC template in {} at revision {}'.format(self.snapshot, self.revision))
+                # Editing a file hard linked to a working tree would write through to it and to every other IOC
+                if self.link_mode == 'hardlink':
+                    initIOC_print('WARNING - Template files are not hard linked from a template directory, using reflinks instead.')
+                    self.link_mode = 'reflink'
+                return 0
+
+            with lock_cache(self.cache_dir):
+                mirror = os.path.join(self.cache_dir, 'motor-ioc-template')
+                if not os.path.exists(mirror):
+                    if self.offline:
+                        initIOC_print('ERROR - No cached IOC template in {}, and offline mode is enabled.'.format(self.cache_dir))
+                        return -1
+                    initIOC_print('Fetching IOC template from {} into {}'.format(self.url, mirror))
+                    mirror_temp = get_partial_path(mirror)
+                    out = subprocess.call(['git', 'clone', '--quiet', self.url, mirror_temp])
+                    if out != 0:
+                        shutil.rmtree(mirror_temp, ignore_errors=True)
+                        initIOC_print('ERROR - Failed to fetch IOC template from {}'.format(self.url))
+                        return -1
+                    os.rename(mirror_temp, mirror)
+                elif not self.offline:
+                    out = subprocess.call(['git', '-C', mirror, 'fetch', '--quiet', 'origin'])
+                    if out == 0:
+                        out = subprocess.call(['git', '-C', mirror, 'reset', '--quiet', '--hard', 'origin/HEAD'])
+                    if out != 0:
+                        initIOC_print('WARNING - Could not update IOC template, using cached version.')
+
+                self.revision = get_git_revision(mirror)
+                if self.revision is None:
+                    initIOC_print('ERROR - Cached IOC template in {} is not a valid git repository.'.format(mirror))
+                    return -1
+                snapshot_top = os.path.join(self.cache_dir, 'snapshots')
+                snapshot = os.path.join(snapshot_top, self.revision)
+                if not os.path.exists(snapshot):
+                    os.makedirs(snapshot_top, exist_ok=True)
+                    snapshot_temp = get_partial_path(snapshot)
+                    try:
+                        shutil.copytree(mirror, snapshot_temp, ignore=shutil.ignore_patterns('.git'))
+                        os.rename(snapshot_temp, snapshot)
+                    finally:
+                        shutil.rmtree(snapshot_temp, ignore_errors=True)
+                # The modification time of a snapshot is the last time a run started using it
+                os.utime(snapshot)
+                prune_snapshots(snapshot_top, self.revision)
+            self.snapshot = snapshot
+            initIOC_print('Using IOC template at revision {}'.format(self.revision))
+            return 0
+
+
+    def reset(self):
+        """ Function that forgets the prepared snapshot, so the next IOC fetches or checks the template again """
+
+        with self.lock:
+            self.revision   = None
+            self.snapshot   = None
+            self.patterns   = None
+
+
+    def cleanup_patterns(self):
+        """
+        Function that returns the paths and globs to remove from IOCs generated from the template.
+        They are read from the cleanup manifest kept with the template, or derived from its cleanup.sh script.
+        Returns
+        -------
+        patterns : list of str
+            paths relative to the IOC directory, or None if the template has no usable cleanup manifest
+        """
+
+        if self.prepare() != 0:
+            return None
+        with self.lock:
+            if self.patterns is None:
+                manifest_path = os.path.join(self.snapshot, CLEANUP_MANIFEST)
+                if os.path.exists(manifest_path):
+                    with open(manifest_path, 'r') as manifest_fp:
+                        self.patterns = [line.strip() for line in manifest_fp if line.strip() != '' and not line.strip().startswith('#')]
+                elif os.path.exists(os.path.join(self.snapshot, 'cleanup.sh')):
+                    self.patterns = parse_cleanup_script(os.path.join(self.snapshot, 'cleanup.sh'))
+                if self.patterns is None:
+                    self.patterns = False
+            if self.patterns is False:
+                return None
+            return list(self.patterns)
+
+
+    def materialize(self, ioc_path, tree=disk_tree):
+        """
+        Function that creates a new IOC directory as a local copy of the template snapshot.
+        Files that the cleanup manifest removes, and that are not read during setup, are not copied at all.
+        Parameters
+        ----------
+        ioc_path : str
+            path of the IOC directory to create. Must not exist yet
+        tree : DiskTree or MemoryTree
+            tree in which the IOC directory is created
+        """
+
+        if self.prepare() != 0:
+            raise RuntimeError('IOC template is not available')
+        patterns = self.cleanup_patterns()
+        skipped = []
+        if patterns is not None:
+            skipped = [pattern for pattern in patterns if pattern.split('/')[0] not in pipeline_inputs]
+            skipped = skipped + cleanup_scripts + [CLEANUP_MANIFEST]
+
+        def ignore(directory, names):
+            rel_dir = os.path.relpath(directory, self.snapshot)
+            ignored = []
+            for name in names:
+                relpath = name if rel_dir == '.' else rel_dir.replace(os.sep, '/') + '/' + name
+                if name == '.git' or any([match_cleanup_pattern(relpath, pattern) for pattern in skipped]):
+                    ignored.append(name)
+            return ignored
+
+        if self.link_mode == 'copy' or not isinstance(tree, DiskTree):
+            tree.copytree(self.snapshot, ioc_path, ignore)
+            return
+
+        rendered = [source for stage, sources, generated in setup_stages for source in sources]
+
+        def link(src, dst):
+            relpath = os.path.relpath(src, self.snapshot).replace(os.sep, '/')
+            if relpath.split('/')[0] not in rendered:
+                try:
+                    if self.link_mode == 'hardlink':
+                        os.link(src, dst)
+                    else:
+                        reflink_file(src, dst)
+                    record_write(dst, 0)
+                    return
+                except OSError as err:
+                    if not self.link_warned:
+                        self.link_warned = True
+                        initIOC_print('WARNING - Could not {} template files ({}), copying them instead.'.format(self.link_mode, err))
+            shutil.copy2(src, dst)
+            record_write(dst, os.path.getsize(dst))
+
+        shutil.copytree(self.snapshot, ioc_path, ignore=ignore, copy_function=link)
+
+
+@contextlib.contextmanager
+def lock_cache(cache_dir):
+    """ Context manager that holds an exclusive lock on a template cache, shared with other processes using it """
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, CACHE_LOCK_FILE), 'a') as lock_fp:
+        if fcntl is not None:
+            fcntl.flock(lock_fp.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def get_partial_path(path):
+    """ Function that returns the path this process writes to before renaming it to path, removing any leftover """
+
+    partial_path = '{}.partial.{}'.format(path, os.getpid())
+    shutil.rmtree(partial_path, ignore_errors=True)
+    return partial_path
+
+
+def prune_snapshots(snapshot_top, revision):
+    """
+    Function that removes the snapshots of a template cache older than the previously used one.
+    Partial snapshots are left to the process writing them
+    Parameters
+    ----------
+    snapshot_top : str
+        directory holding one snapshot per template commit
+    revision : str
+        commit of the snapshot in use
+    """
+
+    snapshots = []
+    for name in os.listdir(snapshot_top):
+        if name == revision or '.partial' in name:
+            continue
+        try:
+            snapshots.append((os.path.getmtime(os.path.join(snapshot_top, name)), name))
+        except OSError:
+            continue
+    for mtime, name in sorted(snapshots, reverse=True)[1:]:
+        shutil.rmtree(os.path.join(snapshot_top, name), ignore_errors=True)
+
+
+def parse_cleanup_script(script_path):
+    """
+    Function that derives a cleanup manifest from a cleanup.sh script made only of rm commands
+    Parameters
+    ----------
+    script_path : str
+        path to the cleanup.sh script
+
+    Returns
+    -------
+    patterns : list of str
+        paths and globs relative to the IOC directory, or None if the script can't be converted
+    """
+
+    script_dir_vars = []
+    patterns = []
+    with open(script_path, 'r') as script_fp:
+        lines = script_fp.readlines()
+    for line in lines:
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        assignment = re.match(r'^(?P<var>\w+)=(?P<value>.*)$', line)
+        if assignment is not None:
+            if 'dirname' not in assignment.group('value'):
+                return None
+            script_dir_vars.append(assignment.group('var'))
+            continue
+        try:
+            tokens = shlex.split(line, comments=True)
+        except ValueError:
+            return None
+        if len(tokens) == 0 or tokens[0] in ['set', 'echo']:
+            continue
+        if tokens[0] == 'cd' and len(tokens) == 2 and SCRIPT_DIR_PREFIX.match(tokens[1] + '/') is not None:
+            continue
+        if tokens[0] != 'rm':
+            return None
+        for token in tokens[1:]:
+            if token.startswith('-'):
+                continue
+            prefix = SCRIPT_DIR_PREFIX.match(token)
+            if prefix is not None:
+                if prefix.group('var') is not None and prefix.group('var') not in script_dir_vars:
+                    return None
+                token = token[prefix.end():]
+            if token == '' or '$' in token or os.path.isabs(token) or '..' in token.split('/'):
+                return None
+            patterns.append(token.rstrip('/'))
+    return patterns
+
+
+def get_git_revision(repo_path):
+    """
+    Function that returns the commit hash checked out in a git repository
+    Parameters
+    ----------
+    repo_path : str
+        path to the git repository
+
+    Returns
+    -------
+    str
+        the commit hash, or None if the path is not a git repository
+    """
+
+    if not os.path.exists(os.path.join(repo_path, '.git')):
+        return None
+    try:
+        return subprocess.check_output(['git', '-C', repo_path, 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fingerprint_tree(top):
+    """
+    Function that computes a content fingerprint for a directory tree that is not under version control
+    Parameters
+    ----------
+    top : str
+        path to the top of the directory tree
+
+    Returns
+    -------
+    str
+        hex digest built from the relative path, size and modification time of every file
+    """
+
+    digest = hashlib.sha1()
+    for dirpath, dirnames, filenames in os.walk(top):
+        dirnames.sort()
+        if '.git' in dirnames:
+            dirnames.remove('.git')
+        for filename in sorted(filenames):
+            stat = os.stat(os.path.join(dirpath, filename))
+            relpath = os.path.relpath(os.path.join(dirpath, filename), top)
+            digest.update('{}:{}:{}\n'.format(relpath, stat.st_size, stat.st_mtime_ns).encode())
+    return digest.hexdigest()
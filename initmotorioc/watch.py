@@ -0,0 +1,193 @@
+"""
+Watching directories for changes with inotify, or by polling where it is not available.
+"""
+
+# imports
+import os
+import errno
+import time
+import struct
+from sys import platform
+
+from .events import initIOC_print
+
+
+# Seconds without new changes before a rebuilt binary distribution is handled, and between polls without inotify
+WATCH_DEBOUNCE = 1.0
+WATCH_POLL_INTERVAL = 2.0
+
+# inotify event flags from sys/inotify.h, and the header of each event read from an inotify file descriptor
+IN_ATTRIB       = 0x00000004
+IN_CLOSE_WRITE  = 0x00000008
+IN_MOVED_FROM   = 0x00000040
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_DELETE       = 0x00000200
+IN_DELETE_SELF  = 0x00000400
+IN_MOVE_SELF    = 0x00000800
+IN_Q_OVERFLOW   = 0x00004000
+IN_IGNORED      = 0x00008000
+IN_ONLYDIR      = 0x01000000
+INOTIFY_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class DirectoryWatcher:
+
+
+    def __init__(self, poll=False, poll_interval=WATCH_POLL_INTERVAL):
+        """
+        Constructor for the DirectoryWatcher class
+        Parameters
+        ----------
+        poll : bool
+            if True, never use inotify, ex. for binary distributions on NFS changed by other hosts
+        poll_interval : float
+            seconds between polls when inotify is not used
+        """
+
+        self.poll           = poll
+        self.poll_interval  = poll_interval
+        self.directories    = []
+        self.inotify_fd     = None
+        self.libc           = None
+        self.watches        = {}
+        self.snapshot       = {}
+        if not poll:
+            self.start_inotify()
+
+
+    def start_inotify(self):
+        """ Function that opens an inotify instance through ctypes, falling back to polling if it is not available """
+
+        if platform != 'linux':
+            self.poll = True
+            return
+        import ctypes
+        try:
+            self.libc = ctypes.CDLL(None, use_errno=True)
+            self.inotify_fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        except (OSError, AttributeError):
+            self.inotify_fd = -1
+        if self.inotify_fd < 0:
+            initIOC_print('WARNING - inotify is not available, polling for changes every {}s.'.format(self.poll_interval))
+            self.inotify_fd = None
+            self.poll = True
+
+
+    def set_directories(self, directories):
+        """
+        Function that replaces the watched directories. Existing directories only are watched, not recursively
+        Parameters
+        ----------
+        directories : list of str
+            directories whose entries are watched for changes
+        """
+
+        self.directories = sorted(set(directories))
+        if not self.poll:
+            import ctypes
+            for wd in self.watches.keys():
+                self.libc.inotify_rm_watch(self.inotify_fd, wd)
+            self.watches = {}
+            for directory in self.directories:
+                wd = self.libc.inotify_add_watch(self.inotify_fd, os.fsencode(directory), INOTIFY_MASK)
+                if wd >= 0:
+                    self.watches[wd] = directory
+                elif ctypes.get_errno() not in [errno.ENOENT, errno.ENOTDIR]:
+                    # ex. ENOSPC once fs.inotify.max_user_watches is reached
+                    initIOC_print('WARNING - Could not watch {} ({}), polling for changes every {}s.'.format(
+                        directory, os.strerror(ctypes.get_errno()), self.poll_interval))
+                    self.close()
+                    self.poll = True
+                    break
+        if self.poll:
+            self.snapshot = self.take_snapshot()
+
+
+    def take_snapshot(self):
+        """
+        Function that records the state of every watched directory and its entries, for polling
+        Returns
+        -------
+        snapshot : dict of str to tuple
+            modification time, size and inode keyed by path, only the inode for watched directories
+        """
+
+        snapshot = {}
+        for directory in self.directories:
+            try:
+                # Changes to a directory's entries are reported for the entries themselves, not for the directory
+                snapshot[directory] = os.stat(directory).st_ino
+                with os.scandir(directory) as scanner:
+                    for entry in scanner:
+                        stat = entry.stat(follow_symlinks=False)
+                        snapshot[entry.path] = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            except OSError:
+                continue
+        return snapshot
+
+
+    def wait(self, timeout=None):
+        """
+        Function that waits for changes in the watched directories
+        Parameters
+        ----------
+        timeout : float
+            maximum number of seconds to wait. If None, waits until something changes
+
+        Returns
+        -------
+        changed : set of str
+            paths that were created, modified or removed. Empty if nothing changed before the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if self.poll:
+                time.sleep(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
+                snapshot = self.take_snapshot()
+                changed = set([path for path in set(snapshot) | set(self.snapshot) if snapshot.get(path) != self.snapshot.get(path)])
+                self.snapshot = snapshot
+            else:
+                import select
+                readable = select.select([self.inotify_fd], [], [], remaining)[0]
+                changed = self.read_events() if len(readable) > 0 else set()
+            if len(changed) > 0 or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+
+    def read_events(self):
+        """
+        Function that reads the pending inotify events
+        Returns
+        -------
+        changed : set of str
+            paths named by the events. Every watched directory if events were lost
+        """
+
+        changed = set()
+        try:
+            buffer = os.read(self.inotify_fd, 1 << 16)
+        except BlockingIOError:
+            return changed
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(buffer):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+            name = buffer[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0')
+            offset = offset + INOTIFY_EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                changed.update(self.directories)
+            elif wd in self.watches and not mask & IN_IGNORED:
+                directory = self.watches[wd]
+                changed.add(directory + '/' + os.fsdecode(name) if len(name) > 0 else directory)
+        return changed
+
+
+    def close(self):
+        """ Function that closes the inotify instance, if any """
+
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+            self.watches = {}
@@ -0,0 +1,3 @@
+"""
+Tests for initMotorIOCs, run from the top of the repository with python3 -m pytest or python3 -m unittest.
+"""
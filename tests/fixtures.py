@@ -0,0 +1,72 @@
+"""
+Shared fixtures: a local motor-ioc-template and synthetic binary distributions, as used by the benchmark.
+"""
+
+# imports
+import os
+import shutil
+import tempfile
+import unittest
+
+import initMotorIOCs
+from benchmarkMotorIOCs import build_template, build_binary_tree, make_entries
+
+
+# Test case with a template, a binary distribution and an empty IOC directory in a scratch directory
+class FixtureTestCase(unittest.TestCase):
+
+    # 'flat' or 'stacked' binary distribution
+    layout = 'stacked'
+
+
+    def setUp(self):
+        """ Function that builds the fixtures in a new scratch directory """
+
+        self.work_dir       = tempfile.mkdtemp(prefix='initMotorIOCs-test.')
+        self.template_dir   = self.work_dir + '/template'
+        self.bin_loc        = self.work_dir + '/bin'
+        self.ioc_dir        = self.work_dir + '/iocs'
+        build_template(self.template_dir)
+        build_binary_tree(self.bin_loc, self.layout, 3)
+        os.makedirs(self.ioc_dir)
+        initMotorIOCs.reset_caches()
+        self.template = initMotorIOCs.TemplateCache(template_dir=self.template_dir)
+
+
+    def tearDown(self):
+        """ Function that removes the scratch directory """
+
+        initMotorIOCs.reset_caches()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+    def make_entries(self, count, prefix='bench', **configuration):
+        """ Function that creates IOC entries for the fixture, named prefix0000 and up, with configuration overrides """
+
+        entries = make_entries(count, self.ioc_dir, self.bin_loc, prefix)
+        for action, entry_configuration in entries:
+            entry_configuration.update(configuration)
+        return entries
+
+
+    def generate(self, entries):
+        """ Function that generates IOC entries with the template fixture, checking that all of them succeeded """
+
+        results = initMotorIOCs.generate_entries(entries, workers=1, template=self.template)
+        self.assertIsNotNone(results)
+        self.assertEqual([message for action, success, message in results if not success], [])
+        return results
+
+
+    def read(self, ioc_name, file):
+        """ Function that returns the contents of a file of a generated IOC """
+
+        with open(self.ioc_dir + '/' + ioc_name + '/' + file, 'r') as file_fp:
+            return file_fp.read()
+
+
+    def get_inodes(self, ioc_name):
+        """ Function that returns the inode of every file of a generated IOC, keyed by file name """
+
+        ioc_path = self.ioc_dir + '/' + ioc_name
+        return dict([(file, os.stat(ioc_path + '/' + file).st_ino) for file in os.listdir(ioc_path)])
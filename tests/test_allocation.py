@@ -0,0 +1,65 @@
+"""
+Tests for allocating free telnet ports and MC numbers.
+"""
+
+# imports
+import unittest
+
+from initMotorIOCs import FIRST_TELNET_PORT, FIRST_MC_NUMBER, allocate_entries, validate_entries
+from tests.fixtures import FixtureTestCase
+
+
+class TestAllocateEntries(FixtureTestCase):
+
+
+    def make_auto_entries(self, count, prefix='auto', **configuration):
+        entries = self.make_entries(count, prefix, **configuration)
+        for action, entry_configuration in entries:
+            action.ioc_port = 'auto'
+            action.ioc_num = ''
+        return entries
+
+
+    def test_next_free(self):
+        entries = self.make_auto_entries(3)
+        entries[1][0].ioc_port = str(FIRST_TELNET_PORT + 1)
+        entries[1][0].ioc_num = 'MC:{}'.format(FIRST_MC_NUMBER)
+        allocate_entries(entries)
+        self.assertEqual([action.ioc_port for action, configuration in entries],
+                         [str(FIRST_TELNET_PORT), str(FIRST_TELNET_PORT + 1), str(FIRST_TELNET_PORT + 2)])
+        self.assertEqual([action.ioc_num for action, configuration in entries],
+                         [str(FIRST_MC_NUMBER + 1), 'MC:{}'.format(FIRST_MC_NUMBER), str(FIRST_MC_NUMBER + 2)])
+        self.assertEqual(validate_entries(entries), [[], [], []])
+
+
+    def test_ports_per_host(self):
+        entries = self.make_auto_entries(1, HOSTNAME='xf10id-ioc1') + self.make_auto_entries(1, 'other', HOSTNAME='xf10id-ioc2')
+        allocate_entries(entries)
+        self.assertEqual([action.ioc_port for action, configuration in entries], [str(FIRST_TELNET_PORT)] * 2)
+
+
+    def test_existing_iocs(self):
+        existing = self.make_entries(1)
+        existing[0][0].ioc_port = str(FIRST_TELNET_PORT)
+        existing[0][0].ioc_num = str(FIRST_MC_NUMBER)
+        self.generate(existing)
+        entries = self.make_auto_entries(1)
+        allocate_entries(entries)
+        self.assertEqual(entries[0][0].ioc_port, str(FIRST_TELNET_PORT + 1))
+        self.assertEqual(entries[0][0].ioc_num, str(FIRST_MC_NUMBER + 1))
+
+
+    def test_regenerated_ioc_keeps_its_own(self):
+        existing = self.make_entries(1, INCREMENTAL='YES')
+        existing[0][0].ioc_port = str(FIRST_TELNET_PORT + 5)
+        existing[0][0].ioc_num = str(FIRST_MC_NUMBER + 5)
+        self.generate(existing)
+        entries = self.make_auto_entries(1, 'bench', INCREMENTAL='YES')
+        allocate_entries(entries)
+        self.assertEqual(entries[0][0].ioc_port, str(FIRST_TELNET_PORT + 5))
+        self.assertEqual(entries[0][0].ioc_num, str(FIRST_MC_NUMBER + 5))
+        self.assertEqual(validate_entries(entries), [[]])
+
+
+if __name__ == '__main__':
+    unittest.main()
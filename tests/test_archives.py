@@ -0,0 +1,43 @@
+"""
+Tests for generating IOCs in memory and writing them to one archive per IOC server.
+"""
+
+# imports
+import os
+import tarfile
+import unittest
+
+from initMotorIOCs import CONFIG_KEY
+from initmotorioc.files import MemoryTree, rewrite_file
+from tests.fixtures import FixtureTestCase
+
+
+class TestArchives(FixtureTestCase):
+
+
+    def test_memory_tree(self):
+        tree = MemoryTree(self.work_dir)
+        tree.write(self.work_dir + '/config', 'NAME=motor\nPORT=4000\n')
+        rewrite_file(self.work_dir + '/config', CONFIG_KEY, {'PORT' : 'PORT=4001'}, tree=tree)
+        with tree.open_read(self.work_dir + '/config') as file_fp:
+            self.assertEqual(file_fp.read(), 'NAME=motor\nPORT=4001\n')
+        self.assertFalse(os.path.exists(self.work_dir + '/config'))
+
+
+    def test_archive_per_host(self):
+        archive_dir = self.work_dir + '/archives'
+        entries = self.make_entries(2, HOSTNAME='xf10id-ioc1', ARCHIVE_DIR=archive_dir)
+        entries = entries + self.make_entries(1, 'other', HOSTNAME='xf10id-ioc2', ARCHIVE_DIR=archive_dir)
+        entries[2][0].ioc_prefix = 'XF:10ID-CT'
+        self.generate(entries)
+        self.assertEqual(sorted(os.listdir(archive_dir)), ['xf10id-ioc1.tar.gz', 'xf10id-ioc2.tar.gz'])
+        self.assertEqual(os.listdir(self.ioc_dir), [])
+        with tarfile.open(archive_dir + '/xf10id-ioc1.tar.gz') as archive:
+            self.assertEqual(sorted(set([name.split('/')[0] for name in archive.getnames()])), ['bench0000', 'bench0001'])
+            self.assertEqual(archive.getmember('bench0001/st.cmd').mode & 0o777, 0o755)
+            config = archive.extractfile('bench0001/config').read().decode()
+        self.assertEqual(config, 'NAME=bench0001\nPORT=10001\nHOST=xf10id-ioc1\nUSER=softioc\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
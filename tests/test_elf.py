@@ -0,0 +1,100 @@
+"""
+Tests for reading shared library dependencies from the ELF dynamic section.
+"""
+
+# imports
+import shutil
+import struct
+import tempfile
+import unittest
+
+from initmotorioc.elf import PT_LOAD, PT_DYNAMIC, DT_NULL, DT_NEEDED, DT_STRTAB, DT_RPATH, DT_RUNPATH, read_elf_dynamic
+
+
+# Address the synthetic executables are loaded at
+LOAD_ADDRESS = 0x400000
+
+
+def write_elf(file_path, needed, runpath=None, rpath=None, dynamic=True):
+    """
+    Function that writes a minimal 64 bit little endian ELF executable with a dynamic section
+    Parameters
+    ----------
+    file_path : str
+        path of the file to write
+    needed : list of str
+        DT_NEEDED library names
+    runpath : str
+        DT_RUNPATH, if given
+    rpath : str
+        DT_RPATH, if given
+    dynamic : bool
+        if False, the PT_DYNAMIC program header is left out, as in a static executable
+    """
+
+    strtab = b'\0'
+    entries = []
+    for tag, value in [(DT_NEEDED, name) for name in needed] + [(DT_RUNPATH, runpath), (DT_RPATH, rpath)]:
+        if value is not None:
+            entries.append((tag, len(strtab)))
+            strtab = strtab + value.encode() + b'\0'
+
+    phoff = 64
+    strtab_offset = phoff + 2 * 56
+    dynamic_offset = strtab_offset + len(strtab)
+    entries = entries + [(DT_STRTAB, LOAD_ADDRESS + strtab_offset), (DT_NULL, 0)]
+    dynamic_section = b''.join([struct.pack('<qQ', tag, value) for tag, value in entries])
+    size = dynamic_offset + len(dynamic_section)
+
+    phdrs = [struct.pack('<IIQQQQQQ', PT_LOAD, 5, 0, LOAD_ADDRESS, LOAD_ADDRESS, size, size, 0x1000)]
+    phdrs.append(struct.pack('<IIQQQQQQ', PT_DYNAMIC if dynamic else 4, 6, dynamic_offset, LOAD_ADDRESS + dynamic_offset,
+                             LOAD_ADDRESS + dynamic_offset, len(dynamic_section), len(dynamic_section), 8))
+    ident = b'\x7fELF' + bytes([2, 1, 1]) + b'\0' * 9
+    header = ident + struct.pack('<HHIQQQIHHHHHH', 2, 62, 1, LOAD_ADDRESS, phoff, 0, 0, 64, 56, 2, 64, 0, 0)
+    with open(file_path, 'wb') as elf_fp:
+        elf_fp.write(header + b''.join(phdrs) + strtab + dynamic_section)
+
+
+class TestReadElfDynamic(unittest.TestCase):
+
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='initMotorIOCs-test.')
+        self.file_path = self.work_dir + '/NewFocusApp'
+
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+    def test_needed_libraries(self):
+        write_elf(self.file_path, ['libmotor.so', 'libasyn.so', 'libc.so.6'])
+        self.assertEqual(read_elf_dynamic(self.file_path), (['libmotor.so', 'libasyn.so', 'libc.so.6'], []))
+
+
+    def test_runpath_origin(self):
+        write_elf(self.file_path, ['libmotor.so'], runpath='$ORIGIN/../lib:/epics/base/lib::${ORIGIN}', rpath='/ignored')
+        needed, search_path = read_elf_dynamic(self.file_path)
+        self.assertEqual(needed, ['libmotor.so'])
+        self.assertEqual(search_path, [self.work_dir + '/../lib', '/epics/base/lib', self.work_dir])
+
+
+    def test_rpath_without_runpath(self):
+        write_elf(self.file_path, ['libmotor.so'], rpath='/epics/support/motor/lib')
+        self.assertEqual(read_elf_dynamic(self.file_path), (['libmotor.so'], ['/epics/support/motor/lib']))
+
+
+    def test_not_dynamic(self):
+        write_elf(self.file_path, ['libmotor.so'], dynamic=False)
+        self.assertIsNone(read_elf_dynamic(self.file_path))
+
+
+    def test_not_elf(self):
+        with open(self.file_path, 'w') as file_fp:
+            file_fp.write('#!/bin/bash\necho not an executable\n')
+        self.assertIsNone(read_elf_dynamic(self.file_path))
+        self.assertIsNone(read_elf_dynamic(self.work_dir + '/missing'))
+
+
+if __name__ == '__main__':
+    unittest.main()
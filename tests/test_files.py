@@ -0,0 +1,107 @@
+"""
+Tests for the line rewrite rules and the streaming macro substitution.
+"""
+
+# imports
+import shutil
+import tempfile
+import unittest
+
+from initmotorioc.files import rewrite_file, substitute_macros
+from initMotorIOCs import EPICS_ENV_SET_KEY, CONFIG_KEY
+
+
+class TestRewriteFile(unittest.TestCase):
+
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='initMotorIOCs-test.')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+    def write(self, name, contents):
+        with open(self.work_dir + '/' + name, 'w') as file_fp:
+            file_fp.write(contents)
+        return self.work_dir + '/' + name
+
+
+    def test_epics_env_set_rules(self):
+        file_path = self.write('unique.cmd', '# Unique IOC settings\n'
+                                             'epicsEnvSet("ENGINEER", "engineer")\n'
+                                             '#epicsEnvSet("ENGINEER", "commented out")\n'
+                                             'epicsEnvSet( "IOC", "iocMotor")\n'
+                                             'epicsEnvSet("PREFIX", "$(CT){MC:01}")\n')
+        applied = rewrite_file(file_path, EPICS_ENV_SET_KEY, {
+            'ENGINEER'  : 'epicsEnvSet("ENGINEER", "J. Doe")',
+            'IOC'       : 'epicsEnvSet("IOC", "iocmotorNewFocus")',
+            'MISSING'   : 'epicsEnvSet("MISSING", "never written")'
+        })
+        self.assertEqual(applied, set(['ENGINEER', 'IOC']))
+        with open(file_path, 'r') as file_fp:
+            self.assertEqual(file_fp.read(), '# Unique IOC settings\n'
+                                             'epicsEnvSet("ENGINEER", "J. Doe")\n'
+                                             '#epicsEnvSet("ENGINEER", "commented out")\n'
+                                             'epicsEnvSet("IOC", "iocmotorNewFocus")\n'
+                                             'epicsEnvSet("PREFIX", "$(CT){MC:01}")\n')
+
+
+    def test_config_rules(self):
+        file_path = self.write('config', 'NAME=motor\nPORT = 4000\nHOST=localhost\nUSER=softioc\n')
+        applied = rewrite_file(file_path, CONFIG_KEY, {'NAME' : 'NAME=nf1', 'PORT' : 'PORT=4001'})
+        self.assertEqual(applied, set(['NAME', 'PORT']))
+        with open(file_path, 'r') as file_fp:
+            self.assertEqual(file_fp.read(), 'NAME=nf1\nPORT=4001\nHOST=localhost\nUSER=softioc\n')
+
+
+class TestSubstituteMacros(unittest.TestCase):
+
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='initMotorIOCs-test.')
+        self.file_path = self.work_dir + '/motor.substitutions'
+
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+    def substitute(self, contents, macros, chunk_size):
+        with open(self.file_path, 'w') as file_fp:
+            file_fp.write(contents)
+        replaced = substitute_macros(self.file_path, macros, chunk_size=chunk_size)
+        with open(self.file_path, 'r') as file_fp:
+            return replaced, file_fp.read()
+
+
+    def test_both_syntaxes(self):
+        replaced, contents = self.substitute('{"$(PREFIX)", "${PORT}", "$(MOTOR)"}\n', {'PREFIX' : 'XF:10IDC-CT{MC:1}', 'PORT' : 'MC1'}, 4096)
+        self.assertEqual(replaced, 2)
+        self.assertEqual(contents, '{"XF:10IDC-CT{MC:1}", "MC1", "$(MOTOR)"}\n')
+
+
+    def test_longest_name_first(self):
+        replaced, contents = self.substitute('$(P) $(PORT)\n', {'P' : 'a', 'PORT' : 'b'}, 4096)
+        self.assertEqual(replaced, 2)
+        self.assertEqual(contents, 'a b\n')
+
+
+    def test_macros_split_across_chunks(self):
+        contents = '{"$(PREFIX)", "$(PORT)"}\n' * 64
+        expected = '{"XF:10IDC-CT{MC:1}", "MC1"}\n' * 64
+        for chunk_size in [1, 2, 3, 7, 13, 64]:
+            replaced, result = self.substitute(contents, {'PREFIX' : 'XF:10IDC-CT{MC:1}', 'PORT' : 'MC1'}, chunk_size)
+            self.assertEqual(replaced, 128)
+            self.assertEqual(result, expected)
+
+
+    def test_no_macros(self):
+        replaced, contents = self.substitute('$(PREFIX)\n', {}, 4096)
+        self.assertEqual(replaced, 0)
+        self.assertEqual(contents, '$(PREFIX)\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Tests for generating IOCs from the template fixture, with flat and stacked binary distributions.
+"""
+
+# imports
+import os
+import unittest
+
+from initMotorIOCs import get_host_arch
+from tests.fixtures import FixtureTestCase
+from tests.test_elf import write_elf
+
+
+class TestGenerateStacked(FixtureTestCase):
+
+    layout = 'stacked'
+
+
+    def get_support_dir(self):
+        return self.bin_loc if self.layout == 'flat' else self.bin_loc + '/support'
+
+
+    def test_unique_cmd(self):
+        self.generate(self.make_entries(1, ENGINEER='J. Doe', HOSTNAME='xf10id-ioc1'))
+        self.assertEqual(self.read('bench0000', 'unique.cmd'),
+                         '# Unique IOC settings\n'
+                         'epicsEnvSet("ENGINEER", "J. Doe")\n'
+                         'epicsEnvSet("HOSTNAME", "xf10id-ioc1")\n'
+                         'epicsEnvSet("IOCNAME", "bench0000")\n'
+                         'epicsEnvSet("IOC", "iocmotorNewFocus")\n'
+                         'epicsEnvSet("SUPPORT_DIR", "{}")\n'
+                         'epicsEnvSet("MC_CONNECT", "NA")\n'
+                         'epicsEnvSet("CT", "XF:99ID-CT")\n'
+                         'epicsEnvSet("MC", "MC:0")\n'
+                         'epicsEnvSet("PREFIX", "XF:99ID-CT{{NewFocusIOC:MC0}}")\n'
+                         'epicsEnvSet("EPICS_CA_ADDR_LIST", "127.0.0.255")\n'.format(self.get_support_dir()))
+
+
+    def test_config(self):
+        self.generate(self.make_entries(2, HOSTNAME='xf10id-ioc1'))
+        self.assertEqual(self.read('bench0000', 'config'), 'NAME=bench0000\nPORT=10000\nHOST=xf10id-ioc1\nUSER=softioc\n')
+        self.assertEqual(self.read('bench0001', 'config'), 'NAME=bench0001\nPORT=10001\nHOST=xf10id-ioc1\nUSER=softioc\n')
+
+
+    def test_env_paths(self):
+        self.generate(self.make_entries(1))
+        epics_base = '/epics/base' if self.layout == 'flat' else '$(SUPPORT)/../base'
+        self.assertEqual(self.read('bench0000', 'envPaths'),
+                         'epicsEnvSet("ARCH",       "{}")\nepicsEnvSet("TOP", ".")\n'
+                         'epicsEnvSet("SUPPORT", "$(SUPPORT_DIR)")\nepicsEnvSet("EPICS_BASE", "{}")\n'.format(get_host_arch(), epics_base))
+
+
+    def test_st_cmd(self):
+        self.generate(self.make_entries(1))
+        binary_path = self.get_support_dir() + '/motor/modules/motorNewFocus/iocs/NewFocusIOC/bin/{}/NewFocusApp'.format(get_host_arch())
+        self.assertEqual(self.read('bench0000', 'st.cmd').splitlines()[0], '#!' + binary_path)
+        self.assertTrue(os.access(self.ioc_dir + '/bench0000/st.cmd', os.X_OK))
+
+
+    def test_ldpath(self):
+        self.generate(self.make_entries(1))
+        arch = get_host_arch()
+        lib_dirs = [self.bin_loc + '/base/lib/' + arch] + [self.get_support_dir() + '/' + module + '/lib/' + arch
+                                                          for module in ['module000', 'module001', 'module002', 'motor']]
+        self.assertEqual(self.read('bench0000', 'ldpath.sh'), 'export LD_LIBRARY_PATH=' + ':'.join(lib_dirs + ['$LD_LIBRARY_PATH']))
+
+
+    def test_minimal_ldpath(self):
+        arch = get_host_arch()
+        binary_path = self.get_support_dir() + '/motor/modules/motorNewFocus/iocs/NewFocusIOC/bin/{}/NewFocusApp'.format(arch)
+        write_elf(binary_path, ['libmodule001.so'])
+        self.generate(self.make_entries(1, MINIMAL_LDPATH='YES'))
+        self.assertEqual(self.read('bench0000', 'ldpath.sh'),
+                         'export LD_LIBRARY_PATH={}/module001/lib/{}:$LD_LIBRARY_PATH'.format(self.get_support_dir(), arch))
+
+
+    def test_cleanup(self):
+        self.generate(self.make_entries(1))
+        self.assertEqual(sorted([file for file in os.listdir(self.ioc_dir + '/bench0000') if not file.startswith('.')]),
+                         ['auto_settings.req', 'config', 'envPaths', 'ldpath.sh', 'motor.substitutions', 'st.cmd', 'unique.cmd'])
+
+
+    def test_substitutions(self):
+        self.generate(self.make_entries(1))
+        self.assertEqual(self.read('bench0000', 'motor.substitutions').count('{"XF:99ID-CT", "P0"}'), 64)
+
+
+class TestGenerateFlat(TestGenerateStacked):
+
+    layout = 'flat'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+"""
+Tests for importing initMotorIOCs as a library without side effects or expensive imports.
+"""
+
+# imports
+import os
+import subprocess
+import sys
+import unittest
+
+
+# Modules only needed by some commands, which a plain import must not load
+LAZY_MODULES = ['asyncio', 'concurrent.futures', 'tarfile', 'ctypes', 'socket', 'csv', 'configparser', 'argparse', 'cProfile']
+
+
+class TestImports(unittest.TestCase):
+
+
+    def run_python(self, code):
+        top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        return subprocess.run([sys.executable, '-c', code], cwd=top, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True, check=True)
+
+
+    def test_lazy_modules(self):
+        result = self.run_python('import sys, initMotorIOCs\n'
+                                 'print(" ".join([module for module in {!r} if module in sys.modules]))'.format(LAZY_MODULES))
+        self.assertEqual(result.stdout.strip(), '')
+
+
+    def test_no_output(self):
+        result = self.run_python('import initMotorIOCs')
+        self.assertEqual((result.stdout, result.stderr), ('', ''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+Tests for the stage hashes of generated IOCs, and for regenerating only the stale stages of an existing IOC.
+"""
+
+# imports
+import os
+import unittest
+
+from initMotorIOCs import STATE_FILE, get_binary_index
+from initmotorioc.files import hash_inputs
+from initmotorioc.staging import STAGING_DIR_NAME, read_state
+from tests.fixtures import FixtureTestCase
+
+
+class TestStageInputs(FixtureTestCase):
+
+
+    def get_stage_hashes(self, action, configuration):
+        binary_path = get_binary_index(self.bin_loc).lookup(action.ioc_type)
+        inputs = action.get_stage_inputs(configuration, False, binary_path, 'revision')
+        return dict([(stage, hash_inputs(stage_inputs)) for stage, stage_inputs in inputs.items()])
+
+
+    def get_stale_stages(self, **changes):
+        action, configuration = self.make_entries(1)[0]
+        previous = self.get_stage_hashes(action, configuration)
+        for field, value in changes.items():
+            if hasattr(action, field):
+                setattr(action, field, value)
+            else:
+                configuration[field] = value
+        current = self.get_stage_hashes(action, configuration)
+        return sorted([stage for stage in current if current[stage] != previous[stage]])
+
+
+    def test_unchanged(self):
+        self.assertEqual(self.get_stale_stages(), [])
+
+
+    def test_engineer(self):
+        self.assertEqual(self.get_stale_stages(ENGINEER='J. Doe'), ['unique'])
+
+
+    def test_port(self):
+        self.assertEqual(self.get_stale_stages(ioc_port='4001'), ['config'])
+
+
+    def test_hostname(self):
+        self.assertEqual(self.get_stale_stages(HOSTNAME='xf10id-ioc1'), ['autosave', 'config', 'unique'])
+
+
+    def test_macros(self):
+        self.assertEqual(self.get_stale_stages(macros={'PORT' : 'MC1'}), ['autosave'])
+
+
+class TestRegenerate(FixtureTestCase):
+
+
+    def setUp(self):
+        super().setUp()
+        self.generate(self.make_entries(1, INCREMENTAL='YES'))
+        self.inodes = self.get_inodes('bench0000')
+
+
+    def regenerate(self, **configuration):
+        entries = self.make_entries(1, INCREMENTAL='YES', **configuration)
+        self.generate(entries)
+        return entries[0][0]
+
+
+    def get_changed_files(self):
+        inodes = self.get_inodes('bench0000')
+        return sorted([file for file in set(inodes) | set(self.inodes) if inodes.get(file) != self.inodes.get(file)])
+
+
+    def test_state_file(self):
+        state = read_state(self.ioc_dir + '/bench0000')
+        self.assertIsNotNone(state)
+        self.assertEqual(sorted(state['outputs']), ['auto_settings.req', 'config', 'envPaths', 'ldpath.sh',
+                                                    'motor.substitutions', 'st.cmd', 'unique.cmd'])
+        self.assertEqual(sorted(state['stages']), ['autosave', 'config', 'env_paths', 'path_scripts', 'st_cmd', 'unique'])
+
+
+    def test_up_to_date(self):
+        self.regenerate()
+        self.assertEqual(self.get_changed_files(), [])
+
+
+    def test_only_stale_stage(self):
+        self.regenerate(ENGINEER='J. Doe')
+        self.assertEqual(self.get_changed_files(), [STATE_FILE, 'unique.cmd'])
+        self.assertIn('epicsEnvSet("ENGINEER", "J. Doe")\n', self.read('bench0000', 'unique.cmd'))
+        self.assertEqual(read_state(self.ioc_dir + '/bench0000')['configuration']['ENGINEER'], 'J. Doe')
+
+
+    def test_st_cmd_mode_kept(self):
+        os.chmod(self.ioc_dir + '/bench0000/st.cmd', 0o700)
+        self.regenerate(ENGINEER='J. Doe')
+        self.assertEqual(os.stat(self.ioc_dir + '/bench0000/st.cmd').st_mode & 0o777, 0o700)
+
+
+    def test_dependency_files(self):
+        action, configuration = self.make_entries(1, INCREMENTAL='YES')[0]
+        action.macros = {'PORT' : 'MC1'}
+        self.generate([(action, configuration)])
+        self.assertEqual(self.get_changed_files(), [STATE_FILE, 'motor.substitutions'])
+        self.assertEqual(self.read('bench0000', 'motor.substitutions').count('{"XF:99ID-CT", "MC1"}'), 64)
+
+
+    def test_user_files_kept(self):
+        with open(self.ioc_dir + '/bench0000/autosave.sav', 'w') as autosave_fp:
+            autosave_fp.write('live settings\n')
+        self.inodes = self.get_inodes('bench0000')
+        self.regenerate(HOSTNAME='xf10id-ioc1')
+        self.assertEqual(self.get_changed_files(), [STATE_FILE, 'config', 'unique.cmd'])
+        self.assertEqual(self.read('bench0000', 'autosave.sav'), 'live settings\n')
+        self.assertNotIn(STAGING_DIR_NAME, os.listdir(self.ioc_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Tests for reading fleet manifests into IOC actions and configurations.
+"""
+
+# imports
+import shutil
+import tempfile
+import unittest
+
+from initMotorIOCs import read_manifest, parse_manifest_entries, optional_configuration_keys
+
+
+# Configuration shared by the IOCs of the test manifests
+shared_configuration = {
+    'ioc_dir'           : '/epics/iocs',
+    'top_binary_dir'    : '/epics/bin',
+    'hostname'          : 'xf10id-ioc1',
+    'engineer'          : 'J. Doe',
+    'ca_address'        : '10.0.0.255'
+}
+
+# Fields of a complete IOC entry
+nf1_entry = {'ioc_type' : 'motorNewFocus', 'ioc_name' : 'nf1', 'ioc_prefix' : 'XF:10IDC-CT', 'connection' : 'NA'}
+
+
+class TestParseManifestEntries(unittest.TestCase):
+
+
+    def test_entries(self):
+        entries = parse_manifest_entries(shared_configuration, [
+            {'ioc_type' : 'motorNewFocus', 'ioc_name' : 'nf1', 'ioc_prefix' : 'XF:10IDC-CT', 'ioc_port' : 4001,
+             'connection' : '10.0.0.5:4000', 'ioc_num' : 1, 'hostname' : 'xf10id-ioc2', 'macro.SPEED' : '10'},
+            {'ioc_type' : 'motorMotorSim', 'ioc_name' : 'sim1', 'ioc_prefix' : 'XF:10IDC-CT', 'connection' : 'NA',
+             'macros' : {'SPEED' : 20}}
+        ])
+        self.assertEqual([(action.ioc_name, action.ioc_port, action.ioc_num, action.macros) for action, configuration in entries],
+                         [('nf1', '4001', '1', {'SPEED' : '10'}), ('sim1', 'auto', 'auto', {'SPEED' : '20'})])
+        self.assertEqual([configuration['HOSTNAME'] for action, configuration in entries], ['xf10id-ioc2', 'xf10id-ioc1'])
+        self.assertEqual(entries[1][1]['INCREMENTAL'], optional_configuration_keys['INCREMENTAL'])
+
+
+    def test_missing_fields(self):
+        with self.assertRaisesRegex(ValueError, r'entry 1 \(nf1\) is missing ioc_type, ioc_prefix, connection'):
+            parse_manifest_entries(shared_configuration, [{'ioc_name' : 'nf1'}])
+
+
+    def test_malformed_entries(self):
+        with self.assertRaisesRegex(ValueError, 'entry 2 must be a mapping'):
+            parse_manifest_entries(shared_configuration, [dict(nf1_entry), 'foo'])
+        with self.assertRaisesRegex(ValueError, 'entry 1 macros must be a mapping'):
+            parse_manifest_entries(shared_configuration, [dict(nf1_entry, macros=['SPEED'])])
+        with self.assertRaisesRegex(ValueError, 'configuration must be a mapping'):
+            parse_manifest_entries(['ioc_dir'], [])
+        with self.assertRaisesRegex(ValueError, 'iocs must be a list'):
+            parse_manifest_entries(shared_configuration, {'nf1' : {}})
+
+
+class TestReadManifest(unittest.TestCase):
+
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='initMotorIOCs-test.')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+    def read(self, name, contents):
+        with open(self.work_dir + '/' + name, 'w') as manifest_fp:
+            manifest_fp.write(contents)
+        return read_manifest(self.work_dir + '/' + name)
+
+
+    def test_csv(self):
+        entries = self.read('fleet.csv', 'ioc_type,ioc_name,ioc_prefix,ioc_port,connection,ioc_num,ioc_dir,top_binary_dir,hostname,engineer,ca_address\n'
+                                         'motorNewFocus,nf1,XF:10IDC-CT,4001,NA,1,/epics/iocs,/epics/bin,xf10id-ioc1,J. Doe,10.0.0.255\n')
+        self.assertEqual([(action.ioc_name, configuration['IOC_DIR']) for action, configuration in entries], [('nf1', '/epics/iocs')])
+
+
+    def test_ini(self):
+        entries = self.read('fleet.ini', '[configuration]\n' + ''.join(['{} = {}\n'.format(key, value) for key, value in shared_configuration.items()]) +
+                                         '[nf1]\nioc_type = motorNewFocus\nioc_prefix = XF:10IDC-CT\nioc_port = 4001\nconnection = NA\nioc_num = 1\n')
+        self.assertEqual([(action.ioc_name, action.ioc_port, configuration['ENGINEER']) for action, configuration in entries],
+                         [('nf1', '4001', 'J. Doe')])
+
+
+    def test_unsupported_format(self):
+        with self.assertRaisesRegex(ValueError, 'Unsupported manifest format'):
+            self.read('fleet.json', '{}')
+
+
+if __name__ == '__main__':
+    unittest.main()
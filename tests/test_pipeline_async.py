@@ -0,0 +1,51 @@
+"""
+Tests for generating IOCs with the asyncio pipeline.
+"""
+
+# imports
+import os
+import threading
+import unittest
+from unittest import mock
+
+import initMotorIOCs
+import initmotorioc.pipeline_async
+from initmotorioc.config import DEFAULT_STAGE_LIMITS
+from initmotorioc.staging import STAGING_DIR_NAME, open_staging, close_staging
+from tests.fixtures import FixtureTestCase
+
+
+class TestPipelineAsync(FixtureTestCase):
+
+
+    def generate_async(self, entries):
+        results = initMotorIOCs.generate_entries(entries, template=self.template, stage_limits=DEFAULT_STAGE_LIMITS)
+        self.assertEqual([message for action, success, message in results if not success], [])
+
+
+    def test_generate(self):
+        self.generate_async(self.make_entries(3))
+        for ioc_name in ['bench0000', 'bench0001', 'bench0002']:
+            self.assertEqual(self.read(ioc_name, 'config').splitlines()[0], 'NAME=' + ioc_name)
+            self.assertTrue(os.access(self.ioc_dir + '/' + ioc_name + '/st.cmd', os.X_OK))
+        self.assertNotIn(STAGING_DIR_NAME, os.listdir(self.ioc_dir))
+
+
+    def test_staging_off_event_loop(self):
+        threads = []
+
+        def record(function):
+            def recorded(*args):
+                threads.append(threading.current_thread())
+                return function(*args)
+            return recorded
+
+        with mock.patch.object(initmotorioc.pipeline_async, 'open_staging', record(open_staging)), \
+                mock.patch.object(initmotorioc.pipeline_async, 'close_staging', record(close_staging)):
+            self.generate_async(self.make_entries(2))
+        self.assertEqual(len(threads), 4)
+        self.assertNotIn(threading.main_thread(), threads)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+Tests for building IOCs in a staging directory, publishing them, and rolling back failed builds.
+"""
+
+# imports
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from initMotorIOCs import get_host_arch, reset_caches
+from initmotorioc.staging import STAGING_DIR_NAME, stage_ioc, publish_ioc, publish_files, regenerate_staged
+from tests.fixtures import FixtureTestCase
+
+
+class TestPublishFiles(unittest.TestCase):
+
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='initMotorIOCs-test.')
+        self.staged_path = self.work_dir + '/staged/nf1'
+        self.ioc_path = self.work_dir + '/iocs/nf1'
+        for path, contents in [(self.staged_path + '/unique.cmd', 'new unique\n'), (self.staged_path + '/config', 'same config\n'),
+                               (self.staged_path + '/autosave.sav', 'stale copy\n'), (self.ioc_path + '/unique.cmd', 'old unique\n'),
+                               (self.ioc_path + '/config', 'same config\n'), (self.ioc_path + '/autosave.sav', 'live settings\n'),
+                               (self.ioc_path + '/old.substitutions', 'removed\n')]:
+            self.write(path, contents)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+    def write(self, path, contents):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file_fp:
+            file_fp.write(contents)
+
+
+    def read(self, path):
+        with open(path, 'r') as file_fp:
+            return file_fp.read()
+
+
+    def test_only_listed_files(self):
+        config_inode = os.stat(self.ioc_path + '/config').st_ino
+        published = publish_files(self.staged_path, self.ioc_path, ['unique.cmd', 'config', 'old.substitutions', 'missing.req'])
+        self.assertEqual(published, ['unique.cmd', 'old.substitutions'])
+        self.assertEqual(self.read(self.ioc_path + '/unique.cmd'), 'new unique\n')
+        self.assertEqual(os.stat(self.ioc_path + '/config').st_ino, config_inode)
+        self.assertEqual(self.read(self.ioc_path + '/autosave.sav'), 'live settings\n')
+        self.assertEqual(sorted(os.listdir(self.ioc_path)), ['autosave.sav', 'config', 'unique.cmd'])
+
+
+    def test_new_subdirectory(self):
+        self.write(self.staged_path + '/db/motor.db', 'record\n')
+        self.assertEqual(publish_files(self.staged_path, self.ioc_path, ['db/motor.db']), ['db/motor.db'])
+        self.assertEqual(self.read(self.ioc_path + '/db/motor.db'), 'record\n')
+
+
+class TestStageIoc(unittest.TestCase):
+
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='initMotorIOCs-test.')
+        self.ioc_dir = self.work_dir + '/iocs'
+        os.makedirs(self.ioc_dir)
+        self.configuration = {'IOC_DIR' : self.ioc_dir, 'STAGING_DIR' : ''}
+
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+    def test_publish(self):
+        with stage_ioc('nf1', self.configuration) as stage_top:
+            self.assertEqual(os.path.dirname(stage_top), self.ioc_dir + '/' + STAGING_DIR_NAME)
+            os.makedirs(stage_top + '/nf1')
+            with open(stage_top + '/nf1/st.cmd', 'w') as st_fp:
+                st_fp.write('iocInit()\n')
+            publish_ioc('nf1', stage_top, self.ioc_dir)
+        self.assertEqual(os.listdir(self.ioc_dir), ['nf1'])
+        self.assertEqual(os.listdir(self.ioc_dir + '/nf1'), ['st.cmd'])
+
+
+    def test_rollback(self):
+        with self.assertRaises(RuntimeError):
+            with stage_ioc('nf1', self.configuration) as stage_top:
+                os.makedirs(stage_top + '/nf1')
+                raise RuntimeError('failed while building')
+        self.assertEqual(os.listdir(self.ioc_dir), [])
+
+
+    def test_existing_ioc_not_replaced(self):
+        os.makedirs(self.ioc_dir + '/nf1')
+        with stage_ioc('nf1', self.configuration) as stage_top:
+            os.makedirs(stage_top + '/nf1')
+            with self.assertRaises(FileExistsError):
+                publish_ioc('nf1', stage_top, self.ioc_dir)
+        self.assertEqual(sorted(os.listdir(self.ioc_dir)), ['nf1'])
+        self.assertEqual(os.listdir(self.ioc_dir + '/nf1'), [])
+
+
+    def test_staging_dir_setting(self):
+        self.configuration['STAGING_DIR'] = self.work_dir + '/staging'
+        with stage_ioc('nf1', self.configuration) as stage_top:
+            self.assertTrue(stage_top.startswith(self.work_dir + '/staging/'))
+        self.assertEqual(os.listdir(self.work_dir + '/staging'), [])
+
+
+class TestRegenerateRollback(FixtureTestCase):
+
+
+    def setUp(self):
+        super().setUp()
+        self.generate(self.make_entries(1, INCREMENTAL='YES'))
+        self.inodes = self.get_inodes('bench0000')
+        self.unique = self.read('bench0000', 'unique.cmd')
+
+
+    def check_untouched(self):
+        self.assertEqual(self.get_inodes('bench0000'), self.inodes)
+        self.assertEqual(self.read('bench0000', 'unique.cmd'), self.unique)
+        self.assertNotIn(STAGING_DIR_NAME, os.listdir(self.ioc_dir))
+
+
+    def test_failed_stage(self):
+        action, configuration = self.make_entries(1, INCREMENTAL='YES', ENGINEER='J. Doe', HOSTNAME='xf10id-ioc1')[0]
+        render_stage = action.render_stage
+
+        def fail_on_config(stage, *args):
+            if stage == 'config':
+                raise OSError('disk full')
+            return render_stage(stage, *args)
+
+        with mock.patch.object(action, 'render_stage', side_effect=fail_on_config):
+            with self.assertRaises(OSError):
+                regenerate_staged(action, configuration, False, self.template)
+        self.check_untouched()
+
+
+    def test_missing_binary(self):
+        binary_dir = self.bin_loc + '/support/motor/modules/motorNewFocus/iocs/NewFocusIOC/bin/' + get_host_arch()
+        os.remove(binary_dir + '/NewFocusApp')
+        reset_caches()
+        action, configuration = self.make_entries(1, INCREMENTAL='YES', ENGINEER='J. Doe')[0]
+        self.assertEqual(regenerate_staged(action, configuration, False, self.template), -1)
+        self.check_untouched()
+
+
+if __name__ == '__main__':
+    unittest.main()
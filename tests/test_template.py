@@ -0,0 +1,57 @@
+"""
+Tests for deriving the cleanup manifest of the IOC template from its cleanup.sh script.
+"""
+
+# imports
+import shutil
+import tempfile
+import unittest
+
+from initmotorioc.template import parse_cleanup_script
+from benchmarkMotorIOCs import template_files
+
+
+class TestParseCleanupScript(unittest.TestCase):
+
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='initMotorIOCs-test.')
+        self.script_path = self.work_dir + '/cleanup.sh'
+
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+    def parse(self, contents):
+        with open(self.script_path, 'w') as script_fp:
+            script_fp.write(contents)
+        return parse_cleanup_script(self.script_path)
+
+
+    def test_template_script(self):
+        self.assertEqual(self.parse(template_files['cleanup.sh']),
+                         ['startupScripts', 'autosaveFiles', 'dependancyFiles', 'docs', 'README.md'])
+
+
+    def test_relative_paths(self):
+        self.assertEqual(self.parse('#!/bin/bash\nset -e\ncd "$(dirname "$0")"\n# remove the docs\n'
+                                    'rm -rf docs/ *.md\necho done\n'), ['docs', '*.md'])
+
+
+    def test_quoted_script_dir(self):
+        self.assertEqual(self.parse('SCRIPT_DIR=$(dirname "$0")\nrm -f "${SCRIPT_DIR}/README.md"\n'), ['README.md'])
+
+
+    def test_unconvertible_scripts(self):
+        for contents in ['mv docs old_docs\n',
+                         'rm -rf /opt/epics\n',
+                         'rm -rf ../iocs\n',
+                         'rm -rf $HOME/docs\n',
+                         'DIR=/tmp\nrm -rf $DIR/docs\n',
+                         'rm -rf "unterminated\n']:
+            self.assertIsNone(self.parse(contents), contents)
+
+
+if __name__ == '__main__':
+    unittest.main()
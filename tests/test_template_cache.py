@@ -0,0 +1,83 @@
+"""
+Tests for the local mirror of the IOC template and its per commit snapshots.
+"""
+
+# imports
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+from initmotorioc.template import TemplateCache
+from benchmarkMotorIOCs import build_template
+
+
+@unittest.skipIf(shutil.which('git') is None, 'git is not installed')
+class TestTemplateCache(unittest.TestCase):
+
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix='initMotorIOCs-test.')
+        self.upstream = self.work_dir + '/upstream'
+        self.cache_dir = self.work_dir + '/cache'
+        build_template(self.upstream)
+        self.git('init', '--quiet')
+        self.commit('Initial template')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+    def git(self, *args):
+        subprocess.check_call(['git', '-C', self.upstream, '-c', 'user.name=test', '-c', 'user.email=test@localhost'] + list(args))
+
+
+    def commit(self, message):
+        self.git('add', '-A')
+        self.git('commit', '--quiet', '-m', message)
+
+
+    def prepare(self):
+        template = TemplateCache(self.cache_dir, url=self.upstream)
+        self.assertEqual(template.prepare(), 0)
+        return template
+
+
+    def update_upstream(self, number):
+        with open(self.upstream + '/README.md', 'w') as readme_fp:
+            readme_fp.write('motor-ioc-template {}\n'.format(number))
+        self.commit('Update {}'.format(number))
+
+
+    def test_snapshot(self):
+        template = self.prepare()
+        self.assertEqual(template.snapshot, self.cache_dir + '/snapshots/' + template.revision)
+        self.assertTrue(os.path.exists(template.snapshot + '/unique.cmd'))
+        self.assertFalse(os.path.exists(template.snapshot + '/.git'))
+        self.assertEqual(TemplateCache(self.cache_dir, offline=True).prepare(), 0)
+
+
+    def test_previous_snapshot_kept(self):
+        revisions = [self.prepare().revision]
+        for number in range(1, 4):
+            self.update_upstream(number)
+            # Snapshots are ordered by the time a run last started using them
+            time.sleep(0.01)
+            revisions.append(self.prepare().revision)
+            self.assertEqual(sorted(os.listdir(self.cache_dir + '/snapshots')), sorted(revisions[-2:]))
+
+
+    def test_partial_snapshots_left_alone(self):
+        template = self.prepare()
+        partial = self.cache_dir + '/snapshots/0123abcd.partial.1'
+        os.makedirs(partial)
+        self.update_upstream(1)
+        self.assertNotEqual(self.prepare().revision, template.revision)
+        self.assertTrue(os.path.exists(partial))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Tests for rejecting IOCs that collide with each other or with existing IOCs.
+"""
+
+# imports
+import os
+import unittest
+
+from initMotorIOCs import validate_entries
+from tests.fixtures import FixtureTestCase
+
+
+class TestValidateEntries(FixtureTestCase):
+
+
+    def test_valid(self):
+        self.assertEqual(validate_entries(self.make_entries(3)), [[], [], []])
+
+
+    def test_collisions_in_run(self):
+        entries = self.make_entries(2) + self.make_entries(1)
+        entries[1][0].ioc_port = entries[0][0].ioc_port
+        entries[1][0].ioc_num = 'MC:' + entries[0][0].ioc_num
+        problems = validate_entries(entries)
+        self.assertEqual(problems[0], [])
+        self.assertEqual(problems[1], ['telnet port 10000 on localhost is already used by IOC bench0000 of this run',
+                                       'MC:0 under prefix XF:99ID-CT is already used by IOC bench0000 of this run'])
+        self.assertEqual(problems[2], ['name is already used by IOC bench0000 of this run',
+                                       'telnet port 10000 on localhost is already used by IOC bench0000 of this run',
+                                       'MC:0 under prefix XF:99ID-CT is already used by IOC bench0000 of this run'])
+
+
+    def test_same_port_on_other_host(self):
+        entries = self.make_entries(1, HOSTNAME='xf10id-ioc1') + self.make_entries(1, 'other', HOSTNAME='xf10id-ioc2')
+        entries[1][0].ioc_prefix = 'XF:10ID-CT'
+        self.assertEqual(validate_entries(entries), [[], []])
+
+
+    def test_collisions_with_existing_iocs(self):
+        self.generate(self.make_entries(1))
+        entries = self.make_entries(1) + self.make_entries(1, 'other')
+        problems = validate_entries(entries)
+        owner = 'existing IOC bench0000 in {}'.format(self.ioc_dir)
+        self.assertEqual(problems[0], ['name is already used by ' + owner,
+                                       'telnet port 10000 on localhost is already used by ' + owner,
+                                       'MC:0 under prefix XF:99ID-CT is already used by ' + owner])
+        self.assertEqual(problems[1], ['telnet port 10000 on localhost is already used by ' + owner,
+                                       'MC:0 under prefix XF:99ID-CT is already used by ' + owner])
+
+
+    def test_existing_directory(self):
+        os.makedirs(self.ioc_dir + '/bench0000')
+        open(self.ioc_dir + '/bench0001', 'w').close()
+        problems = validate_entries(self.make_entries(3))
+        self.assertEqual(problems, [['IOC directory {}/bench0000 already exists'.format(self.ioc_dir)],
+                                    ['IOC directory {}/bench0001 already exists'.format(self.ioc_dir)], []])
+        self.assertEqual(validate_entries(self.make_entries(1, INCREMENTAL='YES')), [[]])
+
+
+    def test_archived_iocs_ignore_existing(self):
+        self.generate(self.make_entries(1))
+        self.assertEqual(validate_entries(self.make_entries(1, ARCHIVE_DIR=self.work_dir + '/archives')), [[]])
+
+
+    def test_invalid_entries(self):
+        entries = self.make_entries(3)
+        entries[0][0].ioc_port = 'abc'
+        entries[1][0].ioc_name = 'bad/name'
+        entries[2][0].ioc_type = 'motorAcsMotion'
+        problems = validate_entries(entries)
+        self.assertEqual(problems[0], ['invalid telnet port "abc"'])
+        self.assertEqual(problems[1], ['invalid IOC name "bad/name"'])
+        self.assertEqual(problems[2], ['unsupported driver type motorAcsMotion'])
+
+
+if __name__ == '__main__':
+    unittest.main()